@@ -1,6 +1,8 @@
+from typing import List
+
 import typer
-from .pull_dashboards import main as pull_dashboards_main
-from .push_descriptions import main as push_descriptions_main
+
+# commands are imported within their functions, so that ``--help`` and each command load only what they need
 
 __version__ = '0.4.0'
 
@@ -27,11 +29,65 @@ def pull_dashboards(dbt_project_dir: str = typer.Option('.', help="Directory pat
                                                                    "Can be automatically generated if "
                                                                    "SUPERSET_REFRESH_TOKEN is provided."),
                     superset_refresh_token: str = typer.Option(None, envvar="SUPERSET_REFRESH_TOKEN",
-                                                               help="Refresh token to Superset API.")):
+                                                               help="Refresh token to Superset API."),
+                    superset_pool_size: int = typer.Option(10, help="Maximum number of keep-alive connections "
+                                                                    "to Superset, further requests wait for one."),
+                    superset_max_retries: int = typer.Option(3, help="Number of retries of Superset requests "
+                                                                     "failing on connection errors or with "
+                                                                     "429/5xx responses."),
+                    superset_page_size: int = typer.Option(1000, help="Number of objects requested per page "
+                                                                      "when listing Superset objects. Superset "
+                                                                      "caps it at its FAB_API_MAX_PAGE_SIZE."),
+                    max_workers: int = typer.Option(8, help="Number of dashboards whose details are fetched "
+                                                            "from Superset in parallel."),
+                    sql_cache: bool = typer.Option(True, help="Whether tables extracted from SQL of virtual "
+                                                              "datasets should be cached between runs."),
+                    sql_cache_path: str = typer.Option(None, help="Path of the SQL cache file. Defaults to "
+                                                                  "target/dbt_superset_lineage/sql_tables_cache.json "
+                                                                  "within PROJECT_DIR."),
+                    sql_cache_max_entries: int = typer.Option(10000, help="Maximum number of queries kept in "
+                                                                          "the SQL cache."),
+                    parse_workers: int = typer.Option(None, help="Number of processes parsing SQL of virtual "
+                                                                 "datasets in parallel. Defaults to the number "
+                                                                 "of CPUs."),
+                    incremental: bool = typer.Option(False, help="Whether to only get details of dashboards and "
+                                                                 "datasets changed since the last incremental run. "
+                                                                 "The exposure file is still complete."),
+                    full_refresh: bool = typer.Option(False, help="Whether an incremental run should ignore "
+                                                                  "the state of the last run and get everything."),
+                    state_path: str = typer.Option(None, help="Path of the state saved by incremental runs. "
+                                                              "Defaults to "
+                                                              "target/dbt_superset_lineage/pull_state.json "
+                                                              "within PROJECT_DIR."),
+                    profile: bool = typer.Option(False, help="Whether to log wall time of every phase, requests "
+                                                             "and latencies per endpoint and other metrics "
+                                                             "at the end."),
+                    metrics_json: str = typer.Option(None, help="Path of a JSON file the metrics of the run "
+                                                                "are written to."),
+                    mirror: bool = typer.Option(False, help="Whether to keep a local SQLite mirror of Superset "
+                                                              "metadata and read objects unchanged since the last "
+                                                              "run from it."),
+                    mirror_path: str = typer.Option(None, help="Path of the mirror. Defaults to "
+                                                               "target/dbt_superset_lineage/superset_mirror.sqlite "
+                                                               "within PROJECT_DIR."),
+                    shard: str = typer.Option(None, help="Shard of dashboards to pull as INDEX/COUNT, e.g. 1/4, "
+                                                         "split by a stable hash of their ID. Pull each shard into "
+                                                         "its own exposure file outside /models, given by "
+                                                         "--exposures-path, and combine them with "
+                                                         "merge-exposures.")):
+
+    from .pull_dashboards import main as pull_dashboards_main
 
     pull_dashboards_main(dbt_project_dir, exposures_path, dbt_db_name,
                          superset_url, superset_db_id, sql_dialect,
-                         superset_access_token, superset_refresh_token)
+                         superset_access_token, superset_refresh_token,
+                         superset_pool_size=superset_pool_size, superset_max_retries=superset_max_retries,
+                         max_workers=max_workers, superset_page_size=superset_page_size,
+                         sql_cache=sql_cache, sql_cache_path=sql_cache_path,
+                         sql_cache_max_entries=sql_cache_max_entries, parse_workers=parse_workers,
+                         incremental=incremental, full_refresh=full_refresh, state_path=state_path,
+                         profile=profile, metrics_json=metrics_json, mirror=mirror, mirror_path=mirror_path,
+                         shard=shard)
 
 
 @app.command()
@@ -45,21 +101,202 @@ def push_descriptions(dbt_project_dir: str = typer.Option('.', help="Directory p
                       superset_refresh_columns: bool = typer.Option(False, help="Whether columns in Superset should be "
                                                                                 "refreshed from database before "
                                                                                 "the push."),
-                      superset_pause_after_update: int = typer.Option(None, help="Number of seconds for which the "
-                                                                                 "script pauses after any update of "
-                                                                                 "Superset columns. This is to allow "
-                                                                                 "databases to catch up in "
-                                                                                 "the meantime."),
+                      superset_pause_after_update: int = typer.Option(None, help="Deprecated, use "
+                                                                                 "--superset-max-updates-per-second. "
+                                                                                 "Translated into a maximum of one "
+                                                                                 "update per this number of seconds."),
+                      superset_max_updates_per_second: float = typer.Option(None, help="Maximum number of updates "
+                                                                                       "of Superset datasets per "
+                                                                                       "second across all workers. "
+                                                                                       "This is to allow databases "
+                                                                                       "to catch up with updates."),
+                      superset_max_requests_per_second: float = typer.Option(None, help="Maximum number of requests "
+                                                                                        "to Superset per second "
+                                                                                        "across all workers."),
                       superset_access_token: str = typer.Option(None, envvar="SUPERSET_ACCESS_TOKEN",
                                                                 help="Access token to Superset API."
                                                                      "Can be automatically generated if "
                                                                      "SUPERSET_REFRESH_TOKEN is provided."),
                       superset_refresh_token: str = typer.Option(None, envvar="SUPERSET_REFRESH_TOKEN",
-                                                                 help="Refresh token to Superset API.")):
+                                                                 help="Refresh token to Superset API."),
+                      superset_pool_size: int = typer.Option(10, help="Maximum number of keep-alive connections "
+                                                                      "to Superset, further requests wait for one."),
+                      superset_max_retries: int = typer.Option(3, help="Number of retries of Superset requests "
+                                                                       "failing on connection errors or with "
+                                                                       "429/5xx responses."),
+                      superset_page_size: int = typer.Option(1000, help="Number of objects requested per page "
+                                                                        "when listing Superset objects. Superset "
+                                                                        "caps it at its FAB_API_MAX_PAGE_SIZE."),
+                      max_workers: int = typer.Option(1, help="Number of datasets processed in parallel. "
+                                                              "Raise it together with the rate limits above "
+                                                              "for Superset to keep up with the updates."),
+                      state: str = typer.Option(None, help="Path to manifest.json of the previous deploy, or to "
+                                                           "a directory containing it. Only datasets matching "
+                                                           "dbt tables with descriptions changed since then "
+                                                           "are pushed."),
+                      superset_bulk_read: bool = typer.Option(False, help="Whether columns info of datasets should "
+                                                                          "be pulled in bulk through the dataset "
+                                                                          "export endpoint. Only datasets that "
+                                                                          "would be updated are then pulled one "
+                                                                          "by one."),
+                      superset_bulk_write: bool = typer.Option(False, help="Whether descriptions should be "
+                                                                           "pushed in bulk by exporting datasets "
+                                                                           "and importing them back with "
+                                                                           "overwrite. Datasets failing to import "
+                                                                           "are updated one by one."),
+                      superset_export_batch_size: int = typer.Option(100, help="Number of datasets exported or "
+                                                                               "imported by a single request."),
+                      profile: bool = typer.Option(False, help="Whether to log wall time of every phase, requests "
+                                                               "and latencies per endpoint and other metrics "
+                                                               "at the end."),
+                      metrics_json: str = typer.Option(None, help="Path of a JSON file the metrics of the run "
+                                                                  "are written to."),
+                      mirror: bool = typer.Option(False, help="Whether to keep a local SQLite mirror of Superset "
+                                                                "metadata and read objects unchanged since the last "
+                                                                "run from it."),
+                      mirror_path: str = typer.Option(None, help="Path of the mirror. Defaults to "
+                                                                 "target/dbt_superset_lineage/superset_mirror.sqlite "
+                                                                 "within PROJECT_DIR."),
+                      shard: str = typer.Option(None, help="Shard of datasets to push to as INDEX/COUNT, e.g. 1/4, "
+                                                           "split by a stable hash of their ID.")):
+
+    from .push_descriptions import main as push_descriptions_main
 
     push_descriptions_main(dbt_project_dir, dbt_db_name,
                            superset_url, superset_db_id, superset_refresh_columns, superset_pause_after_update,
-                           superset_access_token, superset_refresh_token)
+                           superset_access_token, superset_refresh_token,
+                           superset_pool_size=superset_pool_size, superset_max_retries=superset_max_retries,
+                           max_workers=max_workers,
+                           superset_max_requests_per_second=superset_max_requests_per_second,
+                           superset_max_updates_per_second=superset_max_updates_per_second,
+                           superset_page_size=superset_page_size, state=state,
+                           superset_bulk_read=superset_bulk_read,
+                           superset_export_batch_size=superset_export_batch_size,
+                           superset_bulk_write=superset_bulk_write,
+                           profile=profile, metrics_json=metrics_json, mirror=mirror, mirror_path=mirror_path,
+                           shard=shard)
+
+
+@app.command()
+def sync(dbt_project_dir: str = typer.Option('.', help="Directory path to dbt project."),
+         exposures_path: str = typer.Option('/models/exposures/superset_dashboards.yml',
+                                            help="Where within PROJECT_DIR the exposure file should "
+                                                 "be stored. If you set this to go outside /models, it then "
+                                                 "needs to be added to source-paths in dbt_project.yml."),
+         dbt_db_name: str = typer.Option(None, help="Name of your database within dbt towards which "
+                                                    "the sync should be reduced to run."),
+         superset_url: str = typer.Argument(..., help="URL of your Superset, e.g. "
+                                                      "https://mysuperset.mycompany.com"),
+         superset_db_id: int = typer.Option(None, help="ID of your database within Superset towards which "
+                                                       "the sync should be reduced to run."),
+         sql_dialect: str = typer.Option('ansi', help="Database SQL dialect; used for parsing queries. "
+                                                      "Consult docs of SQLFluff for details: "
+                                                      "https://docs.sqlfluff.com/en/stable/dialects.html"),
+         superset_refresh_columns: bool = typer.Option(False, help="Whether columns in Superset should be "
+                                                                   "refreshed from database before the push."),
+         superset_max_updates_per_second: float = typer.Option(None, help="Maximum number of updates "
+                                                                          "of Superset datasets per second "
+                                                                          "across all workers."),
+         superset_max_requests_per_second: float = typer.Option(None, help="Maximum number of requests "
+                                                                           "to Superset per second "
+                                                                           "across all workers."),
+         superset_access_token: str = typer.Option(None, envvar="SUPERSET_ACCESS_TOKEN",
+                                                   help="Access token to Superset API. "
+                                                        "Can be automatically generated if "
+                                                        "SUPERSET_REFRESH_TOKEN is provided."),
+         superset_refresh_token: str = typer.Option(None, envvar="SUPERSET_REFRESH_TOKEN",
+                                                    help="Refresh token to Superset API."),
+         superset_pool_size: int = typer.Option(10, help="Maximum number of keep-alive connections "
+                                                         "to Superset, further requests wait for one."),
+         superset_max_retries: int = typer.Option(3, help="Number of retries of Superset requests "
+                                                          "failing on connection errors or with "
+                                                          "429/5xx responses."),
+         superset_page_size: int = typer.Option(1000, help="Number of objects requested per page "
+                                                           "when listing Superset objects. Superset "
+                                                           "caps it at its FAB_API_MAX_PAGE_SIZE."),
+         max_workers: int = typer.Option(1, help="Number of dashboards or datasets processed in parallel. "
+                                                 "Raise it together with the rate limits above "
+                                                 "for Superset to keep up with the updates."),
+         sql_cache: bool = typer.Option(True, help="Whether tables extracted from SQL of virtual "
+                                                   "datasets should be cached between runs."),
+         sql_cache_path: str = typer.Option(None, help="Path of the SQL cache file. Defaults to "
+                                                       "target/dbt_superset_lineage/sql_tables_cache.json "
+                                                       "within PROJECT_DIR."),
+         sql_cache_max_entries: int = typer.Option(10000, help="Maximum number of queries kept in "
+                                                               "the SQL cache."),
+         parse_workers: int = typer.Option(None, help="Number of processes parsing SQL of virtual "
+                                                      "datasets in parallel. Defaults to the number "
+                                                      "of CPUs."),
+         incremental: bool = typer.Option(False, help="Whether to only get details of dashboards and "
+                                                      "datasets changed since the last incremental pull. "
+                                                      "The exposure file is still complete."),
+         full_refresh: bool = typer.Option(False, help="Whether an incremental pull should ignore "
+                                                       "the state of the last run and get everything."),
+         state_path: str = typer.Option(None, help="Path of the state saved by incremental pulls. "
+                                                   "Defaults to "
+                                                   "target/dbt_superset_lineage/pull_state.json "
+                                                   "within PROJECT_DIR."),
+         state: str = typer.Option(None, help="Path to manifest.json of the previous deploy, or to "
+                                              "a directory containing it. Only datasets matching "
+                                              "dbt tables with descriptions changed since then "
+                                              "are pushed."),
+         superset_bulk_read: bool = typer.Option(False, help="Whether columns info of datasets should "
+                                                             "be pulled in bulk through the dataset "
+                                                             "export endpoint."),
+         superset_bulk_write: bool = typer.Option(False, help="Whether descriptions should be "
+                                                              "pushed in bulk by exporting datasets "
+                                                              "and importing them back with "
+                                                              "overwrite."),
+         superset_export_batch_size: int = typer.Option(100, help="Number of datasets exported or "
+                                                                  "imported by a single request."),
+         profile: bool = typer.Option(False, help="Whether to log wall time of every phase, requests "
+                                                  "and latencies per endpoint and other metrics "
+                                                  "at the end."),
+         metrics_json: str = typer.Option(None, help="Path of a JSON file the metrics of the run "
+                                                     "are written to."),
+         mirror: bool = typer.Option(False, help="Whether to keep a local SQLite mirror of Superset "
+                                                   "metadata and read objects unchanged since the last "
+                                                   "run from it."),
+         mirror_path: str = typer.Option(None, help="Path of the mirror. Defaults to "
+                                                    "target/dbt_superset_lineage/superset_mirror.sqlite "
+                                                    "within PROJECT_DIR."),
+         shard: str = typer.Option(None, help="Shard of dashboards to pull and datasets to push to as INDEX/COUNT, "
+                                              "e.g. 1/4, split by a stable hash of their ID. Pull each shard into "
+                                              "its own exposure file given by --exposures-path and combine them "
+                                              "with merge-exposures.")):
+
+    from .sync import main as sync_main
+
+    sync_main(dbt_project_dir, exposures_path, dbt_db_name,
+              superset_url, superset_db_id, sql_dialect, superset_refresh_columns,
+              superset_access_token, superset_refresh_token,
+              superset_pool_size=superset_pool_size, superset_max_retries=superset_max_retries,
+              max_workers=max_workers,
+              superset_max_requests_per_second=superset_max_requests_per_second,
+              superset_max_updates_per_second=superset_max_updates_per_second,
+              superset_page_size=superset_page_size,
+              sql_cache=sql_cache, sql_cache_path=sql_cache_path,
+              sql_cache_max_entries=sql_cache_max_entries, parse_workers=parse_workers,
+              incremental=incremental, full_refresh=full_refresh, state_path=state_path,
+              state=state, superset_bulk_read=superset_bulk_read,
+              superset_export_batch_size=superset_export_batch_size,
+              superset_bulk_write=superset_bulk_write,
+              profile=profile, metrics_json=metrics_json, mirror=mirror, mirror_path=mirror_path,
+              shard=shard)
+
+
+@app.command()
+def merge_exposures(partial_paths: List[str] = typer.Argument(..., help="Paths of exposure files pulled by "
+                                                                        "all shards, e.g. with --shard 1/4 "
+                                                                        "to --shard 4/4."),
+                    dbt_project_dir: str = typer.Option('.', help="Directory path to dbt project."),
+                    exposures_path: str = typer.Option('/models/exposures/superset_dashboards.yml',
+                                                       help="Where within PROJECT_DIR the merged exposure file "
+                                                            "should be stored, as in pull-dashboards.")):
+
+    from .merge_exposures import main as merge_exposures_main
+
+    merge_exposures_main(dbt_project_dir, exposures_path, partial_paths)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import os
+
+from dataclasses import astuple
+from pathlib import Path
+
+from .manifest import load_manifest
+from .records import DbtTable, get_table_key
+
+logger = logging.getLogger(__name__)
+
+# bump whenever the structure of the index changes to invalidate persisted indexes
+DBT_INDEX_VERSION = '2'
+
+
+def get_manifest_fingerprint(manifest_path, with_hash=True):
+    stat = os.stat(manifest_path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    if with_hash:
+        sha256 = hashlib.sha256()
+        with open(manifest_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(chunk)
+        fingerprint['sha256'] = sha256.hexdigest()
+
+    return fingerprint
+
+
+def build_dbt_index(manifest_path):
+    """Builds a compact index of dbt nodes and sources from ``manifest.json``.
+
+    Returns:
+        A list of ``DbtTable`` with their name, schema, database, type, reference to be used in dbt,
+        description and descriptions of columns.
+    """
+
+    logger.info("Building dbt index from %s.", manifest_path)
+    dbt_manifest = load_manifest(manifest_path,
+                                 fields=['name', 'schema', 'database', 'unique_id', 'description', 'columns'])
+
+    dbt_index = []
+    for table_type in ['nodes', 'sources']:
+        for table in dbt_manifest[table_type].values():
+            name = table['name']
+            source = table['unique_id'].split('.')[-2]
+            dbt_index.append(DbtTable(
+                name=name,
+                schema=table['schema'],
+                database=table['database'],
+                type=table_type[:-1],
+                ref=f"ref('{name}')" if table_type == 'nodes' else f"source('{source}', '{name}')",
+                description=table.get('description'),
+                columns={column_name: column['description']
+                         for column_name, column in table.get('columns', {}).items()
+                         if column.get('description') is not None}
+            ))
+
+    return dbt_index
+
+
+def load_dbt_index(dbt_project_dir, index_path=None):
+    """Loads the dbt index persisted next to ``target/manifest.json``, rebuilding it if outdated.
+
+    The persisted index is reused if the manifest has the same size and modification time as when
+    the index was built, or the same content hash if only the modification time differs (e.g. after
+    a fresh checkout in CI).
+
+    Args:
+        dbt_project_dir: Directory path to dbt project.
+        index_path: Where the index is persisted. Defaults to
+            ``target/dbt_superset_lineage/dbt_index.json`` within ``dbt_project_dir``.
+
+    Returns:
+        The index as returned by ``build_dbt_index``.
+    """
+
+    manifest_path = f'{dbt_project_dir}/target/manifest.json'
+    if index_path is None:
+        index_path = f'{dbt_project_dir}/target/dbt_superset_lineage/dbt_index.json'
+    index_path = Path(index_path)
+
+    fingerprint = get_manifest_fingerprint(manifest_path, with_hash=False)
+
+    try:
+        with open(index_path) as f:
+            index_persisted = json.load(f)
+    except FileNotFoundError:
+        index_persisted = None
+    except ValueError as e:
+        logger.warning("dbt index at %s is corrupted and will be rebuilt.", index_path, exc_info=e)
+        index_persisted = None
+
+    if index_persisted is not None and index_persisted['version'] == DBT_INDEX_VERSION \
+            and index_persisted['fingerprint']['size'] == fingerprint['size']:
+        if index_persisted['fingerprint']['mtime_ns'] == fingerprint['mtime_ns']:
+            logger.info("Using dbt index from %s.", index_path)
+            return [DbtTable(*table) for table in index_persisted['tables']]
+
+        fingerprint = get_manifest_fingerprint(manifest_path)
+        if index_persisted['fingerprint']['sha256'] == fingerprint['sha256']:
+            logger.info("Using dbt index from %s, manifest.json was only touched.", index_path)
+            index_persisted['fingerprint'] = fingerprint
+            save_dbt_index(index_path, index_persisted)
+            return [DbtTable(*table) for table in index_persisted['tables']]
+
+    if 'sha256' not in fingerprint:
+        fingerprint = get_manifest_fingerprint(manifest_path)
+    dbt_index = build_dbt_index(manifest_path)
+    # tables are persisted as lists of their fields, in the order of ``DbtTable``
+    save_dbt_index(index_path, {'version': DBT_INDEX_VERSION, 'fingerprint': fingerprint,
+                                'tables': [astuple(table) for table in dbt_index]})
+
+    return dbt_index
+
+
+def save_dbt_index(index_path, index_persisted):
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    index_path_tmp = index_path.with_name(index_path.name + '.tmp')
+    with open(index_path_tmp, 'w') as f:
+        json.dump(index_persisted, f)
+    os.replace(index_path_tmp, index_path)
+
+
+def get_tables_from_dbt(dbt_index, dbt_db_name):
+    """Returns tables from ``dbt_index`` keyed by "schema.name", optionally limited to one database."""
+
+    tables = {}
+    for table in dbt_index:
+        table_key = get_table_key(table.schema, table.name)
+
+        if dbt_db_name is None or table.database == dbt_db_name:
+            # fail if it breaks uniqueness constraint
+            assert table_key not in tables, \
+                f"Table {table_key} is a duplicate name (schema + table) across databases. " \
+                "This would result in incorrect matching between Superset and dbt. " \
+                "To fix this, remove duplicates or add the ``dbt_db_name`` argument."
+            tables[table_key] = table
+
+    assert tables, "Manifest is empty!"
+
+    return tables
+
+
+def get_tables_changed(dbt_tables, dbt_tables_previous):
+    """Returns keys of tables from ``dbt_tables`` that are new or whose descriptions differ
+    from ``dbt_tables_previous``.
+
+    Both arguments are as returned by ``get_tables_from_dbt``. Only the description of a table and descriptions
+    of its columns are compared, in the spirit of dbt's ``state:modified``.
+    """
+
+    tables_changed = set()
+    for table_key, table in dbt_tables.items():
+        table_previous = dbt_tables_previous.get(table_key)
+        if table_previous is None \
+                or table.description != table_previous.description \
+                or table.columns != table_previous.columns:
+            tables_changed.add(table_key)
+
+    return tables_changed
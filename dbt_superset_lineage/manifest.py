@@ -0,0 +1,166 @@
+import json
+import re
+
+WHITESPACE_REGEX = re.compile(r'\s*')
+NUMBER_CHARS_REGEX = re.compile(r'[0-9.eE+\-]*')
+
+
+class JsonStream:
+    """A reader of a JSON document that decodes it value by value instead of all at once.
+
+    Objects and arrays can be iterated member by member, so only a single member has to be held
+    in memory at any time. Members themselves are decoded by the C-accelerated ``json`` decoder.
+    """
+
+    def __init__(self, f, chunk_size=1 << 20):
+        """Instantiates the class.
+
+        Args:
+            f: File object opened in text mode.
+            chunk_size: Minimum number of characters read from ``f`` at once.
+        """
+
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _read(self):
+        # read at least as much as is buffered so that re-decoding a large value stays linear
+        chunk = self.f.read(max(self.chunk_size, len(self.buffer) - self.position))
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        """Returns the next non-whitespace character without consuming it, or '' at the end."""
+
+        while True:
+            self.position = WHITESPACE_REGEX.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read():
+                return ''
+
+    def expect(self, char):
+        """Consumes the next non-whitespace character, which has to be ``char``."""
+
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at character {self.position} of the current chunk.")
+        self.position += 1
+
+    def decode(self):
+        """Decodes and returns the next value."""
+
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self.eof or not self._read():
+                    raise
+                continue
+
+            # a number might continue in the part not read yet, e.g. "1." of "1.5"
+            if isinstance(value, (int, float)) and not self.eof \
+                    and NUMBER_CHARS_REGEX.match(self.buffer, end).end() == len(self.buffer) and self._read():
+                continue
+
+            self.position = end
+            return value
+
+    def iter_object(self):
+        """Iterates over keys of the next object.
+
+        The value of each key has to be consumed, e.g. by ``decode`` or ``skip``, before
+        the iteration continues.
+        """
+
+        self.expect('{')
+        if self.peek() == '}':
+            self.position += 1
+            return
+
+        while True:
+            key = self.decode()
+            self.expect(':')
+            yield key
+
+            if self.peek() == ',':
+                self.position += 1
+            else:
+                self.expect('}')
+                return
+
+    def iter_array(self):
+        """Iterates over the items of the next array, each of them has to be consumed like in ``iter_object``."""
+
+        self.expect('[')
+        if self.peek() == ']':
+            self.position += 1
+            return
+
+        while True:
+            yield
+
+            if self.peek() == ',':
+                self.position += 1
+            else:
+                self.expect(']')
+                return
+
+    def skip(self):
+        """Consumes the next value, holding at most one of its members in memory."""
+
+        char = self.peek()
+        if char == '{':
+            for _ in self.iter_object():
+                self.decode()
+        elif char == '[':
+            for _ in self.iter_array():
+                self.decode()
+        else:
+            self.decode()
+
+
+def load_manifest(path, fields, column_fields=('description',)):
+    """Loads tables of a dbt ``manifest.json`` file, keeping only the given fields.
+
+    The file is streamed, so memory stays proportional to the kept fields and the largest single
+    node, not to the size of the file.
+
+    Args:
+        path: Path to ``manifest.json``.
+        fields: Fields kept for every node and source, e.g. ``['name', 'schema']``.
+        column_fields: Fields kept for every column if ``columns`` is among ``fields``.
+
+    Returns:
+        A dictionary with ``nodes`` and ``sources`` in the same shape as in ``manifest.json``,
+        their values reduced to ``fields``.
+    """
+
+    manifest = {'nodes': {}, 'sources': {}}
+    with open(path, encoding='utf-8') as f:
+        stream = JsonStream(f)
+        for key in stream.iter_object():
+            if key not in manifest:
+                stream.skip()
+                continue
+
+            for table_key in stream.iter_object():
+                table = stream.decode()
+                table_reduced = {field: table[field] for field in fields if field in table}
+                if 'columns' in table_reduced:
+                    table_reduced['columns'] = {
+                        column_name: {field: column[field] for field in column_fields if field in column}
+                        for column_name, column in table_reduced['columns'].items()
+                    }
+                manifest[key][table_key] = table_reduced
+
+    return manifest
@@ -0,0 +1,66 @@
+import logging
+import re
+
+from .pull_dashboards import load_exposures, write_exposures
+
+
+def get_dashboard_id(exposure):
+    """Returns the ID of the dashboard of an exposure, as found at the end of its URL."""
+
+    match = re.search(r'/superset/dashboard/(\d+)/?$', exposure['url'])
+    assert match, f"Exposure {exposure['name']} does not link a Superset dashboard: {exposure['url']}"
+
+    return int(match[1])
+
+
+def merge_exposures(exposures_partial, exposures):
+    """Merges exposures pulled by shards into those a single run of ``pull-dashboards`` would pull.
+
+    Args:
+        exposures_partial: Lists of exposures pulled by every shard.
+        exposures: Exposures of the existing exposure file. Descriptions are taken from it
+            the same way a single run takes them, those of exposures not in it are empty.
+
+    Returns:
+        The list of exposures sorted by IDs of their dashboards.
+    """
+
+    exposures_orig = {exposure['url']: exposure for exposure in exposures}
+    exposures_merged = {}
+    for exposures_shard in exposures_partial:
+        for exposure in exposures_shard:
+            dashboard_id = get_dashboard_id(exposure)
+            assert dashboard_id not in exposures_merged, \
+                f"Dashboard with ID={dashboard_id} was pulled by more than one shard. " \
+                "Make sure all shards were run with the same COUNT."
+
+            exposures_merged[dashboard_id] = {
+                **exposure,
+                'description': exposures_orig.get(exposure['url'], {}).get('description', '')
+            }
+
+    labels = [exposure['label'] for exposure in exposures_merged.values()]
+    # fail if it breaks uniqueness constraint for exposure names, as shards only check their own dashboards
+    assert len(set(labels)) == len(labels), "There are duplicate dashboard names!"
+
+    return [exposures_merged[dashboard_id] for dashboard_id in sorted(exposures_merged)]
+
+
+def main(dbt_project_dir, exposures_path, partial_paths):
+    import ruamel.yaml
+
+    logging.info("Starting the script!")
+
+    exposures_partial = []
+    for partial_path in partial_paths:
+        # unlike the exposure file, every partial one must exist, lest dashboards of a shard go missing
+        with open(partial_path) as f:
+            exposures_partial.append(ruamel.yaml.YAML(typ='safe').load(f)['exposures'])
+        logging.info("There are %d exposures in %s.", len(exposures_partial[-1]), partial_path)
+
+    exposures_yaml_path = dbt_project_dir + exposures_path
+    exposures_dict = merge_exposures(exposures_partial, load_exposures(exposures_yaml_path))
+    write_exposures(exposures_dict, exposures_yaml_path)
+
+    logging.info("Merged %d exposures into a YAML file at %s.", len(exposures_dict), exposures_yaml_path)
+    logging.info("All done!")
@@ -0,0 +1,182 @@
+import json
+import logging
+import math
+import os
+import re
+import sys
+import threading
+import time
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# bump whenever the structure of the report changes so that scrapers can tell
+METRICS_VERSION = '1'
+
+ENDPOINT_ID_REGEX = re.compile(r'/[0-9]+(?=/|$)')
+
+
+def get_endpoint_name(method, endpoint):
+    """Returns e.g. "GET /dataset/{id}" for ``GET /dataset/42`` so that requests group by endpoint."""
+
+    return f"{method} {ENDPOINT_ID_REGEX.sub('/{id}', endpoint)}"
+
+
+def get_percentile(values_sorted, percentile):
+    """Returns the ``percentile`` of ``values_sorted`` by the nearest-rank method, None if there are none."""
+
+    if not values_sorted:
+        return None
+    return values_sorted[max(0, math.ceil(percentile / 100 * len(values_sorted)) - 1)]
+
+
+def get_peak_rss():
+    """Returns peak resident set sizes in bytes of the process and of its waited-for children, e.g. SQL parsers.
+
+    Both are None where the ``resource`` module is not available.
+    """
+
+    if resource is None:
+        return None, None
+
+    # kilobytes on Linux, bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+
+class Metrics:
+    """Collects wall time of phases, requests to Superset and counters of a single run.
+
+    Collecting is thread-safe. ``record_request`` has the signature of a ``Superset`` hook.
+    """
+
+    def __init__(self, command=None):
+        """Instantiates the class.
+
+        Args:
+            command: Name of the command the run is of, written to the report.
+        """
+
+        self.command = command
+        self.started_at = time.perf_counter()
+        self.phases = {}
+        self.counters = Counter()
+        self.timings = defaultdict(float)
+
+        self._requests = defaultdict(lambda: {'count': 0, 'errors': 0, 'retries': 0, 'bytes': 0, 'latencies': []})
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Measures wall time of the ``with`` block, added up if a phase of the same name repeats."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.timings[name] += seconds
+
+    def record_request(self, method, endpoint, response, elapsed):
+        """Records a finished request to Superset, retries done by the session included in ``elapsed``."""
+
+        retries = getattr(getattr(response, 'raw', None), 'retries', None)
+        with self._lock:
+            stats = self._requests[get_endpoint_name(method, endpoint)]
+            stats['count'] += 1
+            stats['errors'] += response.status_code >= 400
+            stats['retries'] += len(retries.history) if retries is not None else 0
+            stats['bytes'] += len(response.content or b'')
+            stats['latencies'].append(elapsed)
+
+    def report(self):
+        """Returns all metrics as a JSON-serializable dictionary."""
+
+        with self._lock:
+            requests = {}
+            for endpoint, stats in sorted(self._requests.items()):
+                latencies = sorted(stats['latencies'])
+                requests[endpoint] = {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'bytes': stats['bytes'],
+                    'latency_seconds': {
+                        'p50': get_percentile(latencies, 50),
+                        'p90': get_percentile(latencies, 90),
+                        'p99': get_percentile(latencies, 99),
+                        'max': latencies[-1]
+                    }
+                }
+            peak_rss, peak_rss_children = get_peak_rss()
+
+            return {
+                'version': METRICS_VERSION,
+                'command': self.command,
+                'wall_seconds': time.perf_counter() - self.started_at,
+                'phases_seconds': dict(self.phases),
+                'requests': requests,
+                'requests_total': {
+                    key: sum(stats[key] for stats in requests.values())
+                    for key in ['count', 'errors', 'retries', 'bytes']
+                },
+                'token_refreshes': requests.get('POST /security/refresh', {}).get('count', 0),
+                'counters': dict(sorted(self.counters.items())),
+                'timings_seconds': dict(sorted(self.timings.items())),
+                'peak_rss_bytes': peak_rss,
+                'peak_rss_children_bytes': peak_rss_children
+            }
+
+    def log_report(self):
+        """Logs a human-readable summary of the report."""
+
+        report = self.report()
+        logging.info("Finished in %.2f s.", report['wall_seconds'])
+        for name, seconds in report['phases_seconds'].items():
+            logging.info("Phase %s took %.2f s.", name, seconds)
+
+        total = report['requests_total']
+        logging.info("%d requests to Superset, %d failed, %d retries, %d token refreshes, %.1f MB downloaded.",
+                     total['count'], total['errors'], total['retries'], report['token_refreshes'],
+                     total['bytes'] / 1e6)
+        for endpoint, stats in sorted(report['requests'].items(), key=lambda item: -item[1]['count']):
+            latency = stats['latency_seconds']
+            logging.info("%s: %d requests, p50 %.3f s, p90 %.3f s, p99 %.3f s, max %.3f s.",
+                         endpoint, stats['count'], latency['p50'], latency['p90'], latency['p99'], latency['max'])
+
+        for name, value in report['counters'].items():
+            logging.info("%s: %d.", name, value)
+        for name, seconds in report['timings_seconds'].items():
+            logging.info("%s: %.2f s.", name, seconds)
+
+        if report['peak_rss_bytes'] is not None:
+            logging.info("Peak RSS %.1f MB, of SQL parsers %.1f MB.",
+                         report['peak_rss_bytes'] / 1e6, report['peak_rss_children_bytes'] / 1e6)
+
+    def write_json(self, path):
+        """Writes the report to ``path`` atomically."""
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path_tmp = path.with_name(path.name + '.tmp')
+        with open(path_tmp, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        os.replace(path_tmp, path)
+
+        logging.info("Metrics written to %s.", path)
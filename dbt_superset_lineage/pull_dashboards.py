@@ -1,41 +1,225 @@
+import hashlib
+import importlib.metadata
 import json
 import logging
+import multiprocessing
+import os
 import re
-
+import sys
+import time
+
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache, partial
+from itertools import count
 from pathlib import Path
 from requests import HTTPError
-import ruamel.yaml
-import sqlfluff
 
-from .superset_api import Superset
+from .dbt_index import get_tables_from_dbt, load_dbt_index
+from .metrics import Metrics
+from .records import Dashboard, Dataset, get_table_key
+from .shard import is_in_shard, parse_shard
+from .sql_cache import SqlTablesCache
+from .superset_api import Superset, map_bounded
+from .superset_mirror import open_mirror
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 logging.getLogger('sqlfluff').setLevel(level=logging.WARNING)
 
+# default exposure file within the dbt project, shards must not overwrite it with their part of dashboards
+EXPOSURES_PATH_DEFAULT = '/models/exposures/superset_dashboards.yml'
+
+# bump whenever the output of ``get_tables_from_sql`` changes to invalidate cached results
+SQL_EXTRACTOR_VERSION = '3'
+
+# bump whenever the structure of the state saved by incremental runs changes
+PULL_STATE_VERSION = '1'
+
+# fetches of details of dashboards queued per worker, bounding memory held by responses not yet consumed
+DASHBOARDS_PENDING_PER_WORKER = 4
+
+# queries queued per parsing process, bounding memory held by queries and tables not yet collected
+SQL_PENDING_PER_WORKER = 4
+
+SQL_TOKEN_REGEX = re.compile(r"""
+    (?P<space>\s+|--[^\n]*|/\*.*?\*/)
+    |(?P<string>'[^'\\]*(?:''[^'\\]*)*')
+    |(?P<quoted>"[^"]*")
+    |(?P<name>[a-z_][a-z0-9_]*)
+    |(?P<number>[0-9]+(?:\.[0-9]*)?(?:e[+-]?[0-9]+)?)
+    |(?P<symbol>::|<>|<=|>=|!=|\|\||[.,()*=<>+\-%;]|/(?!\*))
+""", re.VERBOSE | re.DOTALL | re.IGNORECASE)
+
+# keywords the fast path gives up on as they can introduce further tables or unusual syntax
+SQL_COMPLEX_KEYWORDS = frozenset([
+    'with', 'union', 'intersect', 'except', 'minus', 'lateral', 'values', 'unnest', 'into', 'table',
+    'pivot', 'unpivot', 'tablesample', 'qualify', 'connect', 'recursive', 'apply', 'match_recognize',
+])
+SQL_JOIN_KEYWORDS = frozenset(['join', 'inner', 'left', 'right', 'full', 'outer', 'cross', 'natural'])
+SQL_CLAUSE_KEYWORDS = frozenset(['where', 'group', 'having', 'order', 'limit', 'offset', 'fetch', 'window'])
+SQL_RESERVED_KEYWORDS = SQL_JOIN_KEYWORDS | SQL_CLAUSE_KEYWORDS | {'select', 'from', 'on', 'using', 'as'}
+
 
-def crawl_recursive(seq, key):
+def crawl_recursive(seq, keys):
     if isinstance(seq, dict):
         for k, v in seq.items():
-            if k == key:
+            if k in keys:
                 yield v
             else:
-                yield from crawl_recursive(v, key)
+                yield from crawl_recursive(v, keys)
     elif isinstance(seq, list):
         for i in seq:
-            yield from crawl_recursive(i, key)
+            yield from crawl_recursive(i, keys)
+
+
+@lru_cache(maxsize=None)
+def get_sqlfluff_config(dialect):
+    import sqlfluff.api.simple
+
+    # loading the config is a sizeable part of every ``sqlfluff.parse`` call
+    return sqlfluff.api.simple.get_simple_config(dialect=dialect)
+
+
+@lru_cache(maxsize=None)
+def get_sql_extractor_version():
+    # read from the metadata of sqlfluff, importing it takes longer than most runs need it
+    return f'{SQL_EXTRACTOR_VERSION}-{importlib.metadata.version("sqlfluff")}'
 
 
 def get_tables_from_sql_fluff(sql, dialect):
-    sql_parsed = sqlfluff.parse(sql=sql, dialect=dialect)
-    tables_references = crawl_recursive(sql_parsed, 'table_reference')
+    import sqlfluff
+
+    sql_parsed = sqlfluff.parse(sql=sql, config=get_sqlfluff_config(dialect))
 
     tables = set()  # to avoid duplicates
-    for identifier in ['naked_identifier', 'quoted_identifier']:
-        tables_parsed = [list(crawl_recursive(table_ref, identifier)) for table_ref in tables_references]
-        tables_cleaned = ['.'.join(table).replace('"', '').lower()
-                          for table in tables_parsed
-                          if len(table) >= 2]  # full name if with schema
-        tables.update(tables_cleaned)
+    # single walk through the tree, identifiers are only looked for within table references
+    for table_ref in crawl_recursive(sql_parsed, ('table_reference',)):
+        table = list(crawl_recursive(table_ref, ('naked_identifier', 'quoted_identifier')))
+        if len(table) >= 2:  # full name if with schema
+            tables.add('.'.join(identifier.strip('"`[]') for identifier in table).lower())
+
+    return tables
+
+
+def tokenize_sql(sql):
+    tokens = []
+    position = 0
+    while position < len(sql):
+        match = SQL_TOKEN_REGEX.match(sql, position)
+        if match is None:  # e.g. backticks, brackets, templating or escaped quotes
+            return None
+        position = match.end()
+        if match.lastgroup != 'space':
+            value = match.group()
+            tokens.append(value.lower() if match.lastgroup == 'name' else value)
+
+    return tokens
+
+
+def get_tables_from_sql_fast(sql):
+    """Extracts tables from a simple ``select ... from schema.table join ...`` query without sqlfluff.
+
+    Only queries with a single ``select``, naked table identifiers and plain ``from``/``join`` clauses
+    are handled, matching what ``get_tables_from_sql_fluff`` returns for them. As sqlfluff fails on some
+    of them in some dialects, e.g. on ``limit`` in tsql, and ``get_tables_from_sql`` falls back to regular
+    expressions then, queries are only handled if ``get_tables_from_sql_simple`` agrees.
+
+    Returns:
+        A set of tables, or None if the query is too complex for this fast path.
+    """
+
+    tokens = tokenize_sql(sql)
+    if not tokens:
+        return None
+    if tokens[-1] == ';':
+        tokens.pop()
+    if not tokens or tokens[0] != 'select' or tokens.count('select') > 1 \
+            or not SQL_COMPLEX_KEYWORDS.isdisjoint(tokens):
+        return None
+
+    def is_name(i):
+        return i < len(tokens) and tokens[i] not in SQL_RESERVED_KEYWORDS \
+            and (tokens[i][0].isalpha() or tokens[i][0] == '_')
+
+    def is_alias(i):
+        return is_name(i) or (i < len(tokens) and tokens[i][0] == '"')
+
+    def skip_expression(i, stop):
+        # move to the first top-level token in ``stop`` or to the end, None if parentheses don't match
+        depth = 0
+        while i < len(tokens) and (depth > 0 or tokens[i] not in stop):
+            if tokens[i] == '(':
+                depth += 1
+            elif tokens[i] == ')':
+                depth -= 1
+                if depth < 0:
+                    return None
+            i += 1
+        return i if depth == 0 else None
+
+    i = skip_expression(1, {'from'})
+    if i is None:
+        return None
+    if i == len(tokens):  # no tables at all
+        return set()
+
+    tables = set()
+    joined = False
+    i += 1
+    while i < len(tokens):
+        # table reference
+        if not is_name(i):
+            return None
+        table = [tokens[i]]
+        i += 1
+        while i + 1 < len(tokens) and tokens[i] == '.' and is_name(i + 1):
+            table.append(tokens[i + 1])
+            i += 2
+        if len(table) >= 2:  # full name if with schema
+            tables.add('.'.join(table))
+
+        # optional alias
+        if i < len(tokens) and tokens[i] == 'as':
+            if not is_alias(i + 1):
+                return None
+            i += 2
+        elif is_alias(i):
+            i += 1
+
+        # optional join condition
+        if joined and i < len(tokens) and tokens[i] == 'on':
+            i = skip_expression(i + 1, SQL_JOIN_KEYWORDS | SQL_CLAUSE_KEYWORDS | {','})
+            if i is None:
+                return None
+        elif joined and i < len(tokens) and tokens[i] == 'using':
+            if i + 1 == len(tokens) or tokens[i + 1] != '(' or ')' not in tokens[i + 2:]:
+                return None
+            i = tokens.index(')', i + 2) + 1
+
+        # what follows the table
+        if i == len(tokens) or tokens[i] in SQL_CLAUSE_KEYWORDS:
+            break
+        elif tokens[i] == ',':
+            joined = False
+            i += 1
+        elif tokens[i] in SQL_JOIN_KEYWORDS:
+            while i < len(tokens) and tokens[i] in SQL_JOIN_KEYWORDS - {'join'}:
+                i += 1
+            if i == len(tokens) or tokens[i] != 'join':
+                return None
+            joined = True
+            i += 1
+        else:
+            return None
+
+    # the remaining clauses must not reference any further tables
+    if skip_expression(i, {'from', 'join'}) != len(tokens):
+        return None
+
+    # the dialect is not known here, so whichever way it is parsed the result has to be the same
+    if tables != get_tables_from_sql_simple(sql):
+        return None
 
     return tables
 
@@ -55,9 +239,26 @@ def get_tables_from_sql_simple(sql):
     return tables
 
 
-def get_tables_from_sql(sql, dialect):
+def get_tables_from_sql_with_parser(sql, dialect):
+    """Extracts tables from ``sql`` like ``get_tables_from_sql``, telling how.
+
+    Returns:
+        A tuple of the list of tables, the parser that extracted them, i.e. "fast", "sqlfluff"
+        or "regex" if sqlfluff failed, and the number of seconds it took.
+    """
+
+    start = time.perf_counter()
+    tables = get_tables_from_sql_fast(sql)
+    if tables is not None:
+        return list(tables), 'fast', time.perf_counter() - start
+
+    # sqlfluff with all its dialects is imported only once a query needs it
+    import sqlfluff.api.simple
+    import sqlfluff.core.errors
+
     try:
         tables = get_tables_from_sql_fluff(sql=sql, dialect=dialect)
+        parser = 'sqlfluff'
     except (sqlfluff.core.errors.SQLParseError,
             sqlfluff.core.errors.SQLLexError,
             sqlfluff.api.simple.APIParsingError) as e:
@@ -66,121 +267,288 @@ def get_tables_from_sql(sql, dialect):
                         "check the problematic query and error below.\n%s",
                         sql, exc_info=e)
         tables = get_tables_from_sql_simple(sql)
+        parser = 'regex'
 
     tables = list(tables)  # turn set back into list
 
-    return tables
+    return tables, parser, time.perf_counter() - start
 
 
-def get_tables_from_dbt(dbt_manifest, dbt_db_name):
-    tables = {}
-    for table_type in ['nodes', 'sources']:
-        manifest_subset = dbt_manifest[table_type]
-
-        for table_key_long in manifest_subset:
-            table = manifest_subset[table_key_long]
-            name = table['name']
-            schema = table['schema']
-            database = table['database']
-            source = table['unique_id'].split('.')[-2]
-            table_key = schema + '.' + name
-
-            if dbt_db_name is None or database == dbt_db_name:
-                # fail if it breaks uniqueness constraint
-                assert table_key not in tables, \
-                    f"Table {table_key} is a duplicate name (schema + table) across databases. " \
-                    "This would result in incorrect matching between Superset and dbt. " \
-                    "To fix this, remove duplicates or add ``dbt_db_name``."
-                tables[table_key] = {
-                    'name': name,
-                    'schema': schema,
-                    'database': database,
-                    'type': table_type[:-1],
-                    'ref':
-                        f"ref('{name}')" if table_type == 'nodes'
-                        else f"source('{source}', '{name}')"
-                }
-
-    assert tables, "Manifest is empty!"
+def get_tables_from_sql(sql, dialect):
+    return get_tables_from_sql_with_parser(sql, dialect)[0]
+
+
+class SqlTablesExtractor:
+    """Extracts tables from SQL queries as they are submitted, parsing them in the background.
+
+    Queries found in ``sql_cache`` or simple enough for ``get_tables_from_sql_fast`` are resolved
+    right away. The rest are parsed in a pool of ``parse_workers`` processes as parsing is CPU-bound,
+    so that it overlaps with requests to Superset still running. At most ``SQL_PENDING_PER_WORKER``
+    queries per process are pending, further submits wait for the oldest one. Every worker falls back
+    to regular expressions on its own, see ``get_tables_from_sql``. Numbers of queries and seconds spent
+    by each parser are counted in ``metrics``. Instances are meant to be used from a single thread.
+    """
+
+    def __init__(self, dialect, parse_workers=1, sql_cache=None, metrics=None):
+        """Instantiates the class.
+
+        Args:
+            dialect: SQL dialect of the queries.
+            parse_workers: Number of processes parsing queries. With one, queries are parsed on submit.
+            sql_cache: ``SqlTablesCache`` queries are looked up in and parsed ones are added to.
+            metrics: ``Metrics`` of the run.
+        """
+
+        self.dialect = dialect
+        self.parse_workers = parse_workers or 1
+        self.sql_cache = sql_cache
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        self._results = {}  # tables, or futures of them while parsed, keyed by queries
+        self._pending = deque()  # queries submitted to the workers, oldest first
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, sql):
+        """Starts extracting tables from ``sql`` unless it was submitted before."""
+
+        if sql in self._results:
+            return
+
+        tables = self.sql_cache.get(sql, self.dialect) if self.sql_cache is not None else None
+        if tables is not None:
+            self.metrics.count('sql_queries_cached')
+            self._results[sql] = tables
+            return
+
+        start = time.perf_counter()
+        tables = get_tables_from_sql_fast(sql)
+        if tables is not None:
+            self._set_result(sql, (list(tables), 'fast', time.perf_counter() - start))
+        elif self.parse_workers > 1:
+            while len(self._pending) >= self.parse_workers * SQL_PENDING_PER_WORKER:
+                self.get_tables(self._pending.popleft())
+            if self._executor is None:
+                # workers are not forked from this process, as threads requesting Superset run in it by now
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                                     mp_context=multiprocessing.get_context(start_method))
+            self._results[sql] = self._executor.submit(get_tables_from_sql_with_parser, sql, self.dialect)
+            self._pending.append(sql)
+        else:
+            self._set_result(sql, get_tables_from_sql_with_parser(sql, self.dialect))
 
-    return tables
+    def get_tables(self, sql):
+        """Returns tables of ``sql``, submitting it first if needed and waiting for it to be parsed."""
 
+        self.submit(sql)
+        result = self._results[sql]
+        if isinstance(result, Future):
+            self._set_result(sql, result.result())
+        return self._results[sql]
 
-def get_dashboards_from_superset(superset, superset_url, superset_db_id):
-    logging.info("Getting published dashboards from Superset.")
-    page_number = 0
-    dashboards_id = []
-    while True:
-        logging.info("Getting page %d.", page_number + 1)
-
-        payload = {
-            'q': json.dumps({
-                'page': page_number,
-                'page_size': 100
-            })
-        }
-        res = superset.request('GET', '/dashboard/', params=payload)
-
-        result = res['result']
-        if result:
-            for r in result:
-                if r['published']:
-                    dashboards_id.append(r['id'])
-            page_number += 1
-        else:
-            break
+    def _set_result(self, sql, result):
+        tables, parser, elapsed = result
+        self.metrics.count(f'sql_queries_parsed_{parser}')
+        self.metrics.add_time(f'sql_parse_{parser}', elapsed)
+        self._results[sql] = tables
+        if self.sql_cache is not None:
+            self.sql_cache.set(sql, self.dialect, tables)
+
+    def close(self):
+        """Waits for queries still being parsed, so that they are cached, and stops the workers."""
+
+        for sql in list(self._results):
+            self.get_tables(sql)
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+        logging.info("Extracted tables from %d SQL queries.", len(self._results))
+
+
+def get_dashboard_from_superset(superset, superset_url, dashboard_id, position, total, mirror=None):
+    # responses are revalidated by their ETags if there is a mirror
+    def get(endpoint):
+        return superset.request('GET', endpoint) if mirror is None else mirror.request(superset, endpoint)
 
-    assert dashboards_id, "There are no published dashboards in Superset!"
+    try:
+        logging.info("Getting info for dashboard %d/%d.", position, total)
+        res_dashboard = get(f'/dashboard/{dashboard_id}')
+        result_dashboard = res_dashboard['result']
+
+        title = result_dashboard['dashboard_title']
+        url = superset_url + '/superset/dashboard/' + str(result_dashboard['id'])
+        owner_name = result_dashboard['owners'][0]['first_name'] + ' ' + result_dashboard['owners'][0]['last_name']
+
+        logging.info("Getting info about dashboard's datasets.")
+        res_datasets = get(f'/dashboard/{dashboard_id}/datasets')
+        result_datasets = res_datasets['result']
+    except HTTPError as e:
+        logging.error("Info about the dashboard with ID=%d wasn't (fully) obtained. "
+                      "Check the error below.", dashboard_id, exc_info=e)
+        return None, {}
+
+    # parse dataset names split into parts
+    datasets_parsed = [[dataset['database']['name'], dataset['schema'], dataset['table_name']]
+                       for dataset in result_datasets]
+    datasets_parsed = [['None' if x is None else x for x in dataset]
+                       for dataset in datasets_parsed]  # replace None with string "None" if something missing
+
+    # put them all together to get "database.schema.table"
+    datasets_w_db = ['.'.join(dataset) for dataset in datasets_parsed]
+
+    # skip database, i.e. first item, to get only "schema.table"
+    datasets_wo_db = [get_table_key(*dataset[1:]) for dataset in datasets_parsed]
+
+    dashboard = Dashboard(
+        id=result_dashboard['id'],
+        title=title,
+        url=url,
+        owner_name=owner_name,
+        datasets=datasets_wo_db,  # add in "schema.table" format
+        datasets_w_db=datasets_w_db
+    )
+
+    # keep what is needed to extract tables, so that datasets do not have to be requested again
+    datasets = {dataset_w_db: get_dataset_info(dataset, dataset['database'].get('name'))
+                for dataset_w_db, dataset in zip(datasets_w_db, result_datasets)}
+
+    return dashboard, datasets
+
+
+def get_dataset_info(dataset, database_name):
+    """Returns fields of a dataset from Superset needed to extract its tables, None if missing."""
+
+    return {
+        'id': dataset['id'],
+        'name': dataset['table_name'],
+        'schema': dataset['schema'],
+        'database': database_name,
+        'database_id': dataset['database'].get('id'),
+        'kind': dataset.get('kind'),
+        'sql': dataset.get('sql')
+    }
+
+
+def get_dashboards_listed(superset, superset_page_size=1000, max_workers=1, metrics=None):
+    """Lists published dashboards, pages after the first one concurrently, see ``Superset.paginate``.
 
-    logging.info("There are %d published dashboards in Superset.", len(dashboards_id))
+    Yields:
+        Tuples of the ID of a dashboard, when it changed last and the number of published dashboards.
+    """
 
+    if metrics is None:
+        metrics = Metrics()
+
+    query = {
+        'filters': [{'col': 'published', 'opr': 'eq', 'value': True}],
+        'columns': ['id', 'published', 'changed_on_utc']
+    }
+    start = time.perf_counter()
+    for res in superset.paginate('/dashboard/', query, superset_page_size, max_workers):
+        metrics.add_time('dashboard_listing', time.perf_counter() - start)
+        for r in res['result']:
+            if r['published']:
+                yield r['id'], r.get('changed_on_utc'), res['count']
+        start = time.perf_counter()
+
+
+def get_dashboards_from_superset(superset, superset_url, superset_db_id, max_workers=1,
+                                 superset_page_size=1000, dashboards_saved=None, metrics=None, mirror=None,
+                                 on_dataset=None, shard=None, charts_versions=None):
+    """Gets published dashboards and the datasets on them from Superset.
+
+    Pages of the listing of dashboards feed fetches of their details, with at most
+    ``DASHBOARDS_PENDING_PER_WORKER`` fetches per worker pending, and fetched details feed
+    ``on_dataset``, so that e.g. SQL of datasets is parsed while further dashboards are fetched.
+
+    Args:
+        dashboards_saved: Dashboards reused if they did not change since, keyed by their ID.
+        on_dataset: Function called with info of every dataset as soon as it is first seen,
+            see ``get_dataset_info``.
+        shard: Shard as returned by ``parse_shard``, only its dashboards are fetched.
+        charts_versions: Versions of charts on dashboards as returned by ``get_charts_versions_from_superset``.
+            Saved dashboards are only reused if their charts did not change either.
+        The remaining arguments are as in ``main``.
+
+    Returns:
+        A tuple of the list of ``Dashboard`` and datasets on them keyed by "schema.table",
+        their info being None if only on saved dashboards.
+    """
+
+    if metrics is None:
+        metrics = Metrics()
+    dashboards_saved = dashboards_saved or {}
+
+    def get_dashboard(listed, position):
+        dashboard_id, changed_on, total = listed
+        if charts_versions is not None and changed_on is not None:
+            # charts pointed to other datasets do not change their dashboards
+            changed_on = f"{changed_on} {charts_versions.get(dashboard_id, '')}"
+
+        # reuse details of dashboards unchanged since they were saved
+        dashboard = dashboards_saved.get(dashboard_id)
+        if dashboard is not None and changed_on is not None and dashboard.changed_on == changed_on:
+            return dashboard, None
+
+        dashboard, datasets = get_dashboard_from_superset(superset, superset_url, dashboard_id, position, total,
+                                                          mirror)
+        if dashboard is not None:
+            dashboard.changed_on = changed_on
+        return dashboard, datasets
+
+    def get_dashboards_listed_in_shard():
+        nonlocal dashboards_listed
+        for listed in get_dashboards_listed(superset, superset_page_size, max_workers, metrics):
+            dashboards_listed += 1
+            if is_in_shard(listed[0], shard):
+                yield listed
+
+    logging.info("Getting published dashboards from Superset.")
+    dashboards_listed = 0
+    dashboards_reused = 0
+
+    # datasets are deduplicated across dashboards, those only on saved dashboards are not known
     dashboards = []
-    dashboards_datasets_w_db = set()
-    for i, d in enumerate(dashboards_id):
-        try:
-            logging.info("Getting info for dashboard %d/%d.", i + 1, len(dashboards_id))
-            res_dashboard = superset.request('GET', f'/dashboard/{d}')
-            result_dashboard = res_dashboard['result']
-
-            dashboard_id = result_dashboard['id']
-            title = result_dashboard['dashboard_title']
-            url = superset_url + '/superset/dashboard/' + str(dashboard_id)
-            owner_name = result_dashboard['owners'][0]['first_name'] + ' ' + result_dashboard['owners'][0]['last_name']
-
-            logging.info("Getting info about dashboard's datasets.")
-            res_datasets = superset.request('GET', f'/dashboard/{d}/datasets')
-            result_datasets = res_datasets['result']
-
-            # parse dataset names split into parts
-            datasets_parsed = [[dataset['database']['name'], dataset['schema'], dataset['table_name']]
-                               for dataset in result_datasets]
-            datasets_parsed = [['None' if x is None else x for x in dataset]
-                               for dataset in datasets_parsed]  # replace None with string "None" if something missing
-
-            # put them all together to get "database.schema.table"
-            datasets_w_db = ['.'.join(dataset) for dataset in datasets_parsed]
-            dashboards_datasets_w_db.update(datasets_w_db)
-
-            # skip database, i.e. first item, to get only "schema.table"
-            datasets_wo_db = ['.'.join(dataset[1:]) for dataset in datasets_parsed]
-
-            dashboard = {
-                'id': dashboard_id,
-                'title': title,
-                'url': url,
-                'owner_name': owner_name,
-                'datasets': datasets_wo_db  # add in "schema.table" format
-            }
+    dashboards_datasets_w_db = {}
+    with metrics.phase('dashboards'), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = map_bounded(executor, get_dashboard, get_dashboards_listed_in_shard(), count(1),
+                              max_pending=max_workers * DASHBOARDS_PENDING_PER_WORKER)
+        for dashboard, datasets in results:
+            if dashboard is None:
+                continue
+            if datasets is None:
+                dashboards_reused += 1
+                datasets = {}
+
             dashboards.append(dashboard)
-        except HTTPError as e:
-            logging.error("Info about the dashboard with ID=%d wasn't (fully) obtained. "
-                          "Check the error below.", d, exc_info=e)
+            for dataset_w_db in dashboard.datasets_w_db:
+                dashboards_datasets_w_db.setdefault(dataset_w_db, None)
+            for dataset_w_db, dataset_info in datasets.items():
+                if on_dataset is not None and dashboards_datasets_w_db[dataset_w_db] is None:
+                    on_dataset(dataset_info)
+                dashboards_datasets_w_db[dataset_w_db] = dataset_info
+
+    assert dashboards_listed, "There are no published dashboards in Superset!"
+
+    logging.info("There are %d published dashboards in Superset, %d are unchanged since the last run.",
+                 dashboards_listed, dashboards_reused)
+    if shard is not None:
+        logging.info("There are %d published dashboards in the shard %d/%d.", len(dashboards), *shard)
+    metrics.count('dashboards_reused', dashboards_reused)
 
     # test if unique when database disregarded
     # loop to get the name of duplicated dataset and work with unique set of datasets w db
-    dashboards_datasets = set()
-    for dataset_w_db in dashboards_datasets_w_db:
-        dataset = '.'.join(dataset_w_db.split('.')[1:])  # similar logic as just a bit above
+    dashboards_datasets = {}
+    for dataset_w_db, dataset_info in dashboards_datasets_w_db.items():
+        dataset = sys.intern('.'.join(dataset_w_db.split('.')[1:]))  # similar logic as just a bit above
 
         # fail if it breaks uniqueness constraint and not limited to one database
         assert dataset not in dashboards_datasets or superset_db_id is not None, \
@@ -188,82 +556,273 @@ def get_dashboards_from_superset(superset, superset_url, superset_db_id):
             "This would result in incorrect matching between Superset and dbt. " \
             "To fix this, remove duplicates or add ``superset_db_id``."
 
-        dashboards_datasets.add(dataset)
+        # skip datasets known to be in other databases than the one the pull is limited to
+        if superset_db_id is not None and dataset_info is not None \
+                and dataset_info['database_id'] not in (None, superset_db_id):
+            continue
+
+        if dashboards_datasets.get(dataset) is None:
+            dashboards_datasets[dataset] = dataset_info
 
     return dashboards, dashboards_datasets
 
 
+def get_dataset_from_superset(superset, dataset_id):
+    try:
+        result = superset.request('GET', f'/dataset/{dataset_id}')['result']
+    except HTTPError as e:
+        logging.error("Info about the dataset with ID=%d wasn't obtained. "
+                      "Check the error below.", dataset_id, exc_info=e)
+        return None
+
+    return get_dataset_info(dict(result, id=dataset_id), result['database']['database_name'])
+
+
+def get_charts_versions_from_superset(superset, superset_page_size=1000, max_workers=1):
+    """Returns versions of the charts on every dashboard, keyed by IDs of the dashboards.
+
+    Pointing a chart to another dataset changes the chart but not its dashboard, so a dashboard unchanged
+    since the last run may still show other datasets. A version is a hash of IDs of the charts on
+    a dashboard and of when they changed, so it changes with any of them.
+    """
+
+    logging.info("Getting changes of charts from Superset.")
+
+    dashboards_charts = {}
+    query = {'columns': ['id', 'changed_on_utc', 'dashboards.id']}
+    for res in superset.paginate('/chart/', query, superset_page_size, max_workers):
+        for r in res['result']:
+            for dashboard in r['dashboards']:
+                dashboards_charts.setdefault(dashboard['id'], []).append([r['id'], r['changed_on_utc']])
+
+    return {dashboard_id: hashlib.sha256(json.dumps(sorted(charts)).encode()).hexdigest()[:16]
+            for dashboard_id, charts in dashboards_charts.items()}
+
+
+def get_datasets_changed_on_from_superset(superset, superset_db_id, superset_page_size=1000, max_workers=1):
+    logging.info("Getting changes of datasets from Superset.")
+
+    filters = []
+    if superset_db_id is not None:
+        filters.append({'col': 'database', 'opr': 'rel_o_m', 'value': superset_db_id})
+
+    datasets_changed_on = {}
+    query = {'filters': filters, 'columns': ['id', 'changed_on_utc']}
+    for res in superset.paginate('/dataset/', query, superset_page_size, max_workers):
+        for r in res['result']:
+            datasets_changed_on[r['id']] = r['changed_on_utc']
+
+    return datasets_changed_on
+
+
+def get_sql_hash(sql):
+    return hashlib.sha256(sql.encode('utf-8')).hexdigest()
+
+
 def get_datasets_from_superset(superset, dashboards_datasets, dbt_tables,
-                               sql_dialect, superset_db_id):
+                               sql_dialect, superset_db_id, superset_page_size=1000, sql_cache=None,
+                               parse_workers=None, datasets_saved=None, max_workers=1, incremental=False,
+                               metrics=None, snapshot=None, sql_extractor=None, datasets_changed_on=None,
+                               dashboards=None):
+    """Resolves datasets on dashboards to tables and references to dbt.
+
+    Datasets are taken from the responses on dashboards' datasets, datasets are only requested
+    from Superset one by one if a field is missing there and in ``snapshot``, if there is one.
+    Saved datasets are reused if they are only on saved dashboards and did not change since,
+    their tables also if their SQL did not change.
+
+    Args:
+        sql_extractor: ``SqlTablesExtractor`` SQL of datasets may have been submitted to already.
+            If None, one is made of ``sql_dialect``, ``parse_workers`` and ``sql_cache``.
+        datasets_changed_on: When datasets changed last keyed by their ID, if listed already.
+        dashboards: Dashboards the datasets are on. Saved ones are pointed to the current keys of their
+            datasets, should those be pointed to other tables since.
+        The remaining arguments are as in ``main``.
+
+    Returns:
+        Datasets keyed by "schema.table".
+    """
+
+    if metrics is None:
+        metrics = Metrics()
+
     logging.info("Getting datasets info from Superset.")
-    page_number = 0
+    datasets_saved = datasets_saved or {}
+
+    # changes are tracked to tell next time if datasets of saved dashboards can be reused
+    datasets_listed = {}
+    if snapshot is not None:
+        with metrics.phase('dataset_listing'):
+            datasets_listed = {dataset['id']: dataset for dataset in snapshot.get_datasets()}
+        datasets_changed_on = {dataset_id: dataset['changed_on_utc']
+                               for dataset_id, dataset in datasets_listed.items()}
+    elif datasets_changed_on is None and incremental:
+        with metrics.phase('dataset_listing'):
+            datasets_changed_on = get_datasets_changed_on_from_superset(superset, superset_db_id,
+                                                                        superset_page_size, max_workers)
+    datasets_changed_on = datasets_changed_on or {}
+
     datasets = {}
-    while True:
-        logging.info("Getting page %d.", page_number + 1)
-
-        payload = {
-            'q': json.dumps({
-                'page': page_number,
-                'page_size': 100
-            })
-        }
-        res = superset.request('GET', '/dataset/', params=payload)
-
-        result = res['result']
-        if result:
-            for r in result:
-                name = r['table_name']
-                schema = r['schema']
-                database_name = r['database']['database_name']
-                database_id = r['database']['id']
-
-                dataset_key = f'{schema}.{name}'  # same format as in dashboards
-
-                # only add datasets that are in dashboards, optionally limit to one database
-                if dataset_key in dashboards_datasets \
-                        and (superset_db_id is None or database_id == superset_db_id):
-                    kind = r['kind']
-                    if kind == 'virtual':  # built on custom sql
-                        sql = r['sql']
-                        tables = get_tables_from_sql(sql, sql_dialect)
-                        tables = [table if '.' in table else f'{schema}.{table}'
-                                  for table in tables]
-                    else:  # built on tables
-                        tables = [dataset_key]
-                    dbt_refs = [dbt_tables[table]['ref'] for table in tables
-                                if table in dbt_tables]
-
-                    datasets[dataset_key] = {
-                        'name': name,
-                        'schema': schema,
-                        'database': database_name,
-                        'kind': kind,
-                        'tables': tables,
-                        'dbt_refs': dbt_refs
-                    }
-            page_number += 1
+    datasets_info = {}
+    datasets_to_fetch = {}
+    for dataset_key, dataset_info in dashboards_datasets.items():
+        if dataset_info is None:  # only on saved dashboards
+            dataset_saved = datasets_saved.get(dataset_key)
+            if dataset_saved is None:  # not saved as it is in another database
+                continue
+            if dataset_saved.changed_on is not None \
+                    and datasets_changed_on.get(dataset_saved.id) == dataset_saved.changed_on:
+                datasets[dataset_key] = dataset_saved
+            else:
+                datasets_to_fetch[dataset_key] = dataset_saved.id
+        elif dataset_info['kind'] is None or dataset_info['database_id'] is None \
+                or dataset_info['kind'] == 'virtual' and dataset_info['sql'] is None:
+            datasets_to_fetch[dataset_key] = dataset_info['id']
         else:
-            break
+            datasets_info[dataset_key] = dataset_info
+
+    for dataset_key, dataset_id in list(datasets_to_fetch.items()):
+        if dataset_id in datasets_listed:
+            dataset = datasets_listed[dataset_id]
+            datasets_info[dataset_key] = get_dataset_info(dataset, dataset['database']['database_name'])
+            del datasets_to_fetch[dataset_key]
+
+    if datasets_to_fetch:
+        logging.info("Getting info for %d datasets one by one.", len(datasets_to_fetch))
+        metrics.count('datasets_fetched_one_by_one', len(datasets_to_fetch))
+        with metrics.phase('dataset_details'), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(partial(get_dataset_from_superset, superset), datasets_to_fetch.values())
+            for dataset_key, dataset_info in zip(datasets_to_fetch, results):
+                if dataset_info is not None:
+                    datasets_info[dataset_key] = dataset_info
+
+    # datasets of saved dashboards are known by their saved keys, which are stale if pointed to other tables
+    datasets_keys = {}
+    for dataset_key, dataset_info in list(datasets_info.items()):
+        dataset_key_current = get_table_key(dataset_info['schema'], dataset_info['name'])
+        if dataset_key_current != dataset_key:
+            del datasets_info[dataset_key]
+            datasets_info.setdefault(dataset_key_current, dataset_info)
+            datasets_keys[dataset_key] = dataset_key_current
+    if datasets_keys:
+        logging.info("There are %d datasets pointed to other tables since the last run.", len(datasets_keys))
+        for dashboard in dashboards or []:
+            if not any(dataset_key in datasets_keys for dataset_key in dashboard.datasets):
+                continue
+            databases = [dataset_w_db.split('.')[0] for dataset_w_db in dashboard.datasets_w_db]
+            dashboard.datasets = [datasets_keys.get(dataset_key, dataset_key) for dataset_key in dashboard.datasets]
+            dashboard.datasets_w_db = [f'{database}.{dataset_key}'
+                                       for database, dataset_key in zip(databases, dashboard.datasets)]
+
+    datasets_sql = {}  # parsed all at once, unless submitted to ``sql_extractor`` already
+    for dataset_key, dataset_info in datasets_info.items():
+        # optionally limit to one database
+        if superset_db_id is not None and dataset_info['database_id'] != superset_db_id:
+            continue
+
+        kind = dataset_info['kind']
+        sql_hash = None
+        if kind == 'virtual':  # built on custom sql
+            sql_hash = get_sql_hash(dataset_info['sql'])
+            dataset_saved = datasets_saved.get(dataset_key)
+            if dataset_saved is not None and dataset_saved.sql_hash == sql_hash:
+                tables = dataset_saved.tables
+            else:
+                datasets_sql[dataset_key] = dataset_info['sql']
+                tables = None
+        else:  # built on tables
+            tables = [dataset_key]
+
+        datasets[dataset_key] = Dataset(
+            id=dataset_info['id'],
+            name=dataset_info['name'],
+            schema=dataset_info['schema'],
+            database=dataset_info['database'],
+            kind=kind,
+            changed_on=datasets_changed_on.get(dataset_info['id']),
+            sql_hash=sql_hash,
+            tables=tables
+        )
+
+    with metrics.phase('sql_parse'), \
+            nullcontext(sql_extractor) if sql_extractor is not None \
+            else SqlTablesExtractor(sql_dialect, parse_workers, sql_cache, metrics) as sql_extractor:
+        for sql in datasets_sql.values():  # all are submitted before waiting for any
+            sql_extractor.submit(sql)
+        for dataset_key, sql in datasets_sql.items():
+            schema = datasets[dataset_key].schema
+            datasets[dataset_key].tables = [sys.intern(table) if '.' in table else get_table_key(schema, table)
+                                            for table in sql_extractor.get_tables(sql)]
+
+    for dataset in datasets.values():
+        dataset.dbt_refs = [dbt_tables[table].ref for table in dataset.tables
+                            if table in dbt_tables]
 
     return datasets
 
 
+def load_pull_state(state_path, params):
+    """Loads dashboards and datasets saved by the previous run of the same parameters.
+
+    Returns:
+        Saved dashboards keyed by their ID and saved datasets keyed by "schema.table",
+        or two Nones if there is no usable state.
+    """
+
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        logging.info("There is no state of a previous run at %s, running a full refresh.", state_path)
+        return None, None
+    except ValueError as e:
+        logging.warning("State at %s is corrupted, running a full refresh.", state_path, exc_info=e)
+        return None, None
+
+    if state.get('version') != PULL_STATE_VERSION or state.get('params') != params:
+        logging.info("State at %s was saved with different parameters, running a full refresh.", state_path)
+        return None, None
+
+    logging.info("Using state of the previous run from %s.", state_path)
+    dashboards_saved = {dashboard['id']: Dashboard(**dashboard) for dashboard in state['dashboards']}
+    datasets_saved = {sys.intern(dataset_key): Dataset(**dataset) for dataset_key, dataset in state['datasets'].items()}
+    return dashboards_saved, datasets_saved
+
+
+def save_pull_state(state_path, params, dashboards, datasets):
+    state = {
+        'version': PULL_STATE_VERSION,
+        'params': params,
+        'dashboards': [dashboard.get_state() for dashboard in dashboards],
+        'datasets': {dataset_key: dataset.get_state() for dataset_key, dataset in datasets.items()}
+    }
+
+    state_path = Path(state_path)
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    state_path_tmp = state_path.with_name(state_path.name + '.tmp')
+    with open(state_path_tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(state_path_tmp, state_path)
+
+    logging.info("Saved state of this run to %s.", state_path)
+
+
 def merge_dashboards_with_datasets(dashboards, datasets):
     for dashboard in dashboards:
         refs = set()
-        for dataset in dashboard['datasets']:
+        for dataset in dashboard.datasets:
             if dataset in datasets:
-                refs.update(datasets[dataset]['dbt_refs'])
+                refs.update(datasets[dataset].dbt_refs)
         refs = list(sorted(refs))
 
-        dashboard['refs'] = refs
+        dashboard.refs = refs
 
     return dashboards
 
 
 def get_exposures_dict(dashboards, exposures):
-    dashboards.sort(key=lambda dashboard: dashboard['id'])
-    titles = [dashboard['title'] for dashboard in dashboards]
+    dashboards.sort(key=lambda dashboard: dashboard.id)
+    titles = [dashboard.title for dashboard in dashboards]
     # fail if it breaks uniqueness constraint for exposure names
     assert len(set(titles)) == len(titles), "There are duplicate dashboard names!"
 
@@ -271,15 +830,15 @@ def get_exposures_dict(dashboards, exposures):
     exposures_dict = [{
         # remove non-word characters (unless it's space), replace spaces with underscores, make lowercase
         # required since dbt v1.3
-        'name': re.sub(r'[^\w ]+', '', dashboard['title']).replace(' ', '_').lower(),
-        'label': dashboard['title'],
+        'name': re.sub(r'[^\w ]+', '', dashboard.title).replace(' ', '_').lower(),
+        'label': dashboard.title,
         'type': 'dashboard',
-        'url': dashboard['url'],
+        'url': dashboard.url,
         # get descriptions from original file through url (unique as it's based on dashboard id)
-        'description': exposures_orig.get(dashboard['url'], {}).get('description', ''),
-        'depends_on': dashboard['refs'],
+        'description': exposures_orig.get(dashboard.url, {}).get('description', ''),
+        'depends_on': dashboard.refs,
         'owner': {
-            'name': dashboard['owner_name'],
+            'name': dashboard.owner_name,
             'email': ''  # required for dbt to accept owner.name but not in response
         }
     } for dashboard in dashboards]
@@ -287,35 +846,29 @@ def get_exposures_dict(dashboards, exposures):
     return exposures_dict
 
 
-class YamlFormatted(ruamel.yaml.YAML):
-    def __init__(self):
-        super(YamlFormatted, self).__init__()
-        self.default_flow_style = False
-        self.allow_unicode = True
-        self.encoding = 'utf-8'
-        self.block_seq_indent = 2
-        self.indent = 4
+def get_yaml_formatted():
+    import ruamel.yaml
 
+    yaml = ruamel.yaml.YAML()
+    yaml.default_flow_style = False
+    yaml.allow_unicode = True
+    yaml.encoding = 'utf-8'
+    yaml.block_seq_indent = 2
+    yaml.indent = 4
+    return yaml
 
-def main(dbt_project_dir, exposures_path, dbt_db_name,
-         superset_url, superset_db_id, sql_dialect,
-         superset_access_token, superset_refresh_token):
 
-    # require at least one token for Superset
-    assert superset_access_token is not None or superset_refresh_token is not None, \
-           "Add ``SUPERSET_ACCESS_TOKEN`` or ``SUPERSET_REFRESH_TOKEN`` " \
-           "to your environment variables or provide in CLI " \
-           "via ``superset-access-token`` or ``superset-refresh-token``."
+def load_exposures(exposures_yaml_path):
+    """Loads exposures from a YAML file, creating an empty one if there is none yet.
 
-    superset = Superset(superset_url + '/api/v1',
-                        access_token=superset_access_token, refresh_token=superset_refresh_token)
-
-    logging.info("Starting the script!")
+    Args:
+        exposures_yaml_path: Path of the YAML file.
 
-    with open(f'{dbt_project_dir}/target/manifest.json') as f:
-        dbt_manifest = json.load(f)
+    Returns:
+        The list of exposures as dicts, empty if there are none.
+    """
 
-    exposures_yaml_path = dbt_project_dir + exposures_path
+    import ruamel.yaml
 
     try:
         with open(exposures_yaml_path) as f:
@@ -324,19 +877,20 @@ def main(dbt_project_dir, exposures_path, dbt_db_name,
     except (FileNotFoundError, TypeError):
         Path(exposures_yaml_path).parent.mkdir(parents=True, exist_ok=True)
         Path(exposures_yaml_path).touch(exist_ok=True)
-        exposures = {}
-
-    dbt_tables = get_tables_from_dbt(dbt_manifest, dbt_db_name)
-    dashboards, dashboards_datasets = get_dashboards_from_superset(superset,
-                                                                   superset_url,
-                                                                   superset_db_id)
-    datasets = get_datasets_from_superset(superset,
-                                          dashboards_datasets,
-                                          dbt_tables,
-                                          sql_dialect,
-                                          superset_db_id)
-    dashboards = merge_dashboards_with_datasets(dashboards, datasets)
-    exposures_dict = get_exposures_dict(dashboards, exposures)
+        exposures = []
+
+    return exposures
+
+
+def write_exposures(exposures_dict, exposures_yaml_path):
+    """Writes exposures into a YAML file, formatted the same on every run.
+
+    Args:
+        exposures_dict: List of exposures as dicts, as returned by ``get_exposures_dict``.
+        exposures_yaml_path: Path of the YAML file.
+    """
+
+    import ruamel.yaml
 
     # insert empty line before each exposure, except the first
     exposures_yaml = ruamel.yaml.comments.CommentedSeq(exposures_dict)
@@ -349,9 +903,183 @@ def main(dbt_project_dir, exposures_path, dbt_db_name,
         'exposures': exposures_yaml
     }
 
-    exposures_yaml_file = YamlFormatted()
+    exposures_yaml_file = get_yaml_formatted()
     with open(exposures_yaml_path, 'w+', encoding='utf-8') as f:
         exposures_yaml_file.dump(exposures_yaml_schema, f)
 
+
+def pull_dashboards(superset, dbt_index, dbt_project_dir, exposures_path, dbt_db_name,
+                    superset_url, superset_db_id, sql_dialect,
+                    max_workers=1, superset_page_size=1000, sql_cache=True, sql_cache_path=None,
+                    sql_cache_max_entries=10000, parse_workers=None, incremental=False, full_refresh=False,
+                    state_path=None, snapshot=None, metrics=None, mirror=None, shard=None):
+    """Pulls published dashboards from Superset into the exposure file with references to dbt.
+
+    Args:
+        superset: Instance of ``Superset`` to pull through.
+        dbt_index: dbt index as returned by ``load_dbt_index``.
+        snapshot: ``SupersetSnapshot`` changes and missing fields of datasets are taken from.
+        metrics: ``Metrics`` of the run.
+        mirror: ``SupersetMirror`` unchanged dashboards and datasets are read from and pulled ones
+            saved to. It takes the place of the state of incremental runs.
+        shard: Shard as returned by ``parse_shard``, only its dashboards are pulled into the exposure file.
+        The remaining arguments are as in ``main``.
+    """
+
+    if metrics is None:
+        metrics = Metrics()
+
+    exposures_yaml_path = dbt_project_dir + exposures_path
+    exposures = load_exposures(exposures_yaml_path)
+
+    dbt_tables = get_tables_from_dbt(dbt_index, dbt_db_name)
+
+    if parse_workers is None:
+        parse_workers = os.cpu_count() or 1
+
+    if sql_cache:
+        if sql_cache_path is None:
+            sql_cache_path = f'{dbt_project_dir}/target/dbt_superset_lineage/sql_tables_cache.json'
+        sql_cache = SqlTablesCache(sql_cache_path,
+                                   version=get_sql_extractor_version(),
+                                   max_entries=sql_cache_max_entries)
+    else:
+        sql_cache = None
+
+    if state_path is None:
+        state_path = f'{dbt_project_dir}/target/dbt_superset_lineage/pull_state.json'
+    state_params = {
+        'superset_url': superset_url,
+        'superset_db_id': superset_db_id,
+        'sql_dialect': sql_dialect,
+        'sql_extractor_version': get_sql_extractor_version()
+    }
+    if shard is not None:
+        # dashboards saved by a run of one shard are not all there is to another one
+        state_params['shard'] = '%d/%d' % shard
+    if mirror is not None:
+        incremental = True  # the mirror is revalidated by changes like the state of incremental runs
+        dashboards_saved, datasets_saved = mirror.load_pull_state(state_params) if not full_refresh else (None, None)
+    elif incremental and not full_refresh:
+        dashboards_saved, datasets_saved = load_pull_state(state_path, state_params)
+    else:
+        dashboards_saved, datasets_saved = None, None
+
+    def submit_sql(dataset_info):
+        # parsing starts while further dashboards are fetched, unless tables of the saved dataset are reused
+        if dataset_info['kind'] != 'virtual' or dataset_info['sql'] is None \
+                or superset_db_id is not None and dataset_info['database_id'] != superset_db_id:
+            return
+        dataset_saved = (datasets_saved or {}).get(get_table_key(dataset_info['schema'], dataset_info['name']))
+        if dataset_saved is None or dataset_saved.sql_hash != get_sql_hash(dataset_info['sql']):
+            sql_extractor.submit(dataset_info['sql'])
+
+    # stages overlap: dashboards are fetched as they are listed, their datasets are parsed as they are
+    # fetched and datasets are listed in the background meanwhile
+    with SqlTablesExtractor(sql_dialect, parse_workers, sql_cache, metrics) as sql_extractor, \
+            ThreadPoolExecutor(max_workers=1) as listing_executor:
+        if snapshot is not None:
+            datasets_listing = listing_executor.submit(snapshot.get_datasets)
+        elif incremental:
+            datasets_listing = listing_executor.submit(get_datasets_changed_on_from_superset,
+                                                       superset, superset_db_id, superset_page_size, max_workers)
+
+        charts_versions = get_charts_versions_from_superset(superset, superset_page_size, max_workers) \
+            if incremental else None
+        dashboards, dashboards_datasets = get_dashboards_from_superset(superset,
+                                                                       superset_url,
+                                                                       superset_db_id,
+                                                                       max_workers,
+                                                                       superset_page_size,
+                                                                       dashboards_saved,
+                                                                       metrics,
+                                                                       mirror,
+                                                                       submit_sql,
+                                                                       shard,
+                                                                       charts_versions)
+        datasets = get_datasets_from_superset(superset,
+                                              dashboards_datasets,
+                                              dbt_tables,
+                                              sql_dialect,
+                                              superset_db_id,
+                                              superset_page_size,
+                                              sql_cache,
+                                              parse_workers,
+                                              datasets_saved,
+                                              max_workers,
+                                              incremental,
+                                              metrics,
+                                              snapshot,
+                                              sql_extractor,
+                                              datasets_listing.result() if snapshot is None and incremental else None,
+                                              dashboards)
+    metrics.count('dashboards', len(dashboards))
+    metrics.count('datasets', len(datasets))
+
+    with metrics.phase('state_save'):
+        if sql_cache is not None:
+            sql_cache.save()
+            logging.info("SQL cache stats: %s.", sql_cache.stats())
+
+        if incremental and mirror is None:
+            save_pull_state(state_path, state_params, dashboards, datasets)
+
+    with metrics.phase('merge'):
+        dashboards = merge_dashboards_with_datasets(dashboards, datasets)
+        exposures_dict = get_exposures_dict(dashboards, exposures)
+
+    # references to dbt are saved as well, for queries on which dashboards use which models
+    if mirror is not None:
+        with metrics.phase('state_save'):
+            mirror.save_pull_state(state_params, dashboards, datasets)
+
+    with metrics.phase('yaml_dump'):
+        write_exposures(exposures_dict, exposures_yaml_path)
+
     logging.info("Transferred into a YAML file at %s.", exposures_yaml_path)
+
+
+def main(dbt_project_dir, exposures_path, dbt_db_name,
+         superset_url, superset_db_id, sql_dialect,
+         superset_access_token, superset_refresh_token,
+         superset_pool_size=10, superset_max_retries=3, max_workers=1,
+         superset_page_size=1000, sql_cache=True, sql_cache_path=None, sql_cache_max_entries=10000,
+         parse_workers=None, incremental=False, full_refresh=False, state_path=None,
+         profile=False, metrics_json=None, mirror=False, mirror_path=None, shard=None):
+
+    # require at least one token for Superset
+    assert superset_access_token is not None or superset_refresh_token is not None, \
+           "Add ``SUPERSET_ACCESS_TOKEN`` or ``SUPERSET_REFRESH_TOKEN`` " \
+           "to your environment variables or provide in CLI " \
+           "via ``superset-access-token`` or ``superset-refresh-token``."
+    shard = parse_shard(shard)
+    assert shard is None or exposures_path != EXPOSURES_PATH_DEFAULT, \
+        f"Pull the shard into its own exposure file with ``exposures-path``, e.g. /target/exposures_{shard[0]}.yml, " \
+        f"instead of {EXPOSURES_PATH_DEFAULT}, and combine the files of all shards with ``merge-exposures``."
+
+    metrics = Metrics('pull-dashboards')
+    superset = Superset(superset_url + '/api/v1',
+                        access_token=superset_access_token, refresh_token=superset_refresh_token,
+                        pool_size=max(superset_pool_size, max_workers), max_retries=superset_max_retries,
+                        hooks=[metrics.record_request])
+
+    logging.info("Starting the script!")
+
+    with metrics.phase('manifest_load'):
+        dbt_index = load_dbt_index(dbt_project_dir)
+
+    # pooled connections are closed however the command ends
+    with superset, open_mirror(dbt_project_dir, mirror, mirror_path, metrics) as mirror:
+        pull_dashboards(superset, dbt_index, dbt_project_dir, exposures_path, dbt_db_name,
+                        superset_url, superset_db_id, sql_dialect,
+                        max_workers=max_workers, superset_page_size=superset_page_size,
+                        sql_cache=sql_cache, sql_cache_path=sql_cache_path, sql_cache_max_entries=sql_cache_max_entries,
+                        parse_workers=parse_workers, incremental=incremental, full_refresh=full_refresh,
+                        state_path=state_path, metrics=metrics, mirror=mirror, shard=shard)
+
+    if profile:
+        metrics.log_report()
+    if metrics_json is not None:
+        metrics.write_json(metrics_json)
+
     logging.info("All done!")
@@ -1,112 +1,122 @@
-import json
+import io
 import logging
+import os
 import re
-import time
+import threading
+import zipfile
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache, partial
+from html.entities import html5
+from html.parser import HTMLParser
+from itertools import repeat
 
-from bs4 import BeautifulSoup
-from markdown import markdown
 from requests import HTTPError
 
-from .superset_api import Superset
+from .dbt_index import build_dbt_index, get_tables_changed, get_tables_from_dbt, load_dbt_index
+from .metrics import Metrics
+from .records import get_table_key
+from .shard import is_in_shard, parse_shard
+from .superset_api import RateLimiter, Superset
+from .superset_mirror import open_mirror
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 
+MARKDOWN_CACHE_MAX_ENTRIES = 10000
+
+PRE_REGEX = re.compile(r'<pre>(.*?)</pre>')
+CODE_REGEX = re.compile(r'<code>(.*?)</code >')
+WHITESPACE_REGEX = re.compile(r'\s+')
+
+markdown_local = threading.local()
+
+
+def get_datasets_from_superset(superset, superset_db_id, superset_page_size=1000, snapshot=None, max_workers=1):
+    """Returns physical datasets in Superset with their ID and "schema.table" key.
+
+    Datasets are taken from ``snapshot`` if there is one, so that they are not listed again.
+    """
+
+    if snapshot is not None:
+        logging.info("Getting physical datasets from the snapshot of Superset.")
+        return get_physical_datasets(snapshot.get_datasets(), superset_db_id)
 
-def get_datasets_from_superset(superset, superset_db_id):
     logging.info("Getting physical datasets from Superset.")
 
-    page_number = 0
-    datasets = []
-    datasets_keys = set()
-    while True:
-        logging.info("Getting page %d.", page_number + 1)
-
-        payload = {
-            'q': json.dumps({
-                'page': page_number,
-                'page_size': 100
-            })
-        }
-        res = superset.request('GET', '/dataset/', params=payload)
-
-        result = res['result']
-        if result:
-            for r in result:
-                kind = r['kind']
-                database_id = r['database']['id']
-
-                if kind == 'physical' \
-                        and (superset_db_id is None or database_id == superset_db_id):
-
-                    dataset_id = r['id']
-
-                    name = r['table_name']
-                    schema = r['schema']
-                    dataset_key = f'{schema}.{name}'  # used as unique identifier
-
-                    dataset_dict = {
-                        'id': dataset_id,
-                        'key': dataset_key
-                    }
-
-                    # fail if it breaks uniqueness constraint
-                    assert dataset_key not in datasets_keys, \
-                        f"Dataset {dataset_key} is a duplicate name (schema + table) " \
-                        "across databases. " \
-                        "This would result in incorrect matching between Superset and dbt. " \
-                        "To fix this, remove duplicates or add the ``superset_db_id`` argument."
-
-                    datasets_keys.add(dataset_key)
-                    datasets.append(dataset_dict)
-            page_number += 1
-        else:
-            break
+    # physical datasets are the ones without custom sql
+    filters = [{'col': 'sql', 'opr': 'dataset_is_null_or_empty', 'value': True}]
+    if superset_db_id is not None:
+        filters.append({'col': 'database', 'opr': 'rel_o_m', 'value': superset_db_id})
 
-    assert datasets, "There are no datasets in Superset!"
+    results = []
+    query = {'filters': filters,
+             'columns': ['id', 'table_name', 'schema', 'kind', 'database.id', 'changed_on_utc', 'owners.id']}
+    for res in superset.paginate('/dataset/', query, superset_page_size, max_workers):
+        results.extend(res['result'])
 
-    return datasets
+    return get_physical_datasets(results, superset_db_id)
 
 
-def get_tables_from_dbt(dbt_manifest, dbt_db_name):
-    tables = {}
-    for table_type in ['nodes', 'sources']:
-        manifest_subset = dbt_manifest[table_type]
+def get_physical_datasets(results, superset_db_id):
+    """Returns physical datasets among datasets listed by ``/dataset/``, optionally limited to one database."""
 
-        for table_key_long in manifest_subset:
-            table = manifest_subset[table_key_long]
-            name = table['name']
-            schema = table['schema']
-            database = table['database']
+    datasets = []
+    datasets_keys = set()
+    for r in results:
+        kind = r['kind']
+        database_id = r['database']['id']
+
+        if kind == 'physical' \
+                and (superset_db_id is None or database_id == superset_db_id):
 
-            table_key_short = schema + '.' + name
-            columns = table['columns']
-            description = table['description']
+            dataset_id = r['id']
 
-            if dbt_db_name is None or database == dbt_db_name:
-                # fail if it breaks uniqueness constraint
-                assert table_key_short not in tables, \
-                    f"Table {table_key_short} is a duplicate name (schema + table) " \
-                    f"across databases. " \
-                    "This would result in incorrect matching between Superset and dbt. " \
-                    "To fix this, remove duplicates or add the ``dbt_db_name`` argument."
+            name = r['table_name']
+            schema = r['schema']
+            dataset_key = get_table_key(schema, name)  # used as unique identifier
 
-                tables[table_key_short] = {'columns': columns, 'description': description}
+            dataset_dict = {
+                'id': dataset_id,
+                'key': dataset_key,
+                'changed_on': r.get('changed_on_utc'),
+                'owner_ids': [owner['id'] for owner in r['owners']] if 'owners' in r else None
+            }
 
-    assert tables, "Manifest is empty!"
+            # fail if it breaks uniqueness constraint
+            assert dataset_key not in datasets_keys, \
+                f"Dataset {dataset_key} is a duplicate name (schema + table) " \
+                "across databases. " \
+                "This would result in incorrect matching between Superset and dbt. " \
+                "To fix this, remove duplicates or add the ``superset_db_id`` argument."
 
-    return tables
+            datasets_keys.add(dataset_key)
+            datasets.append(dataset_dict)
 
+    assert datasets, "There are no datasets in Superset!"
 
-def refresh_columns_in_superset(superset, dataset_id):
+    return datasets
+
+
+def refresh_columns_in_superset(superset, dataset_id, update_limiter=None):
     logging.info("Refreshing columns in Superset.")
+    if update_limiter is not None:
+        update_limiter.acquire()
     superset.request('PUT', f'/dataset/{dataset_id}/refresh')
 
 
-def add_superset_columns(superset, dataset):
-    logging.info("Pulling fresh columns info from Superset.")
-
-    res = superset.request('GET', f"/dataset/{dataset['id']}")
-    result = res['result']
+def add_superset_columns(superset, dataset, mirror=None):
+    result = mirror.get_dataset_details(dataset['id'], dataset.get('changed_on')) if mirror is not None else None
+    if result is not None:
+        logging.info("Using columns info from the mirror, the dataset did not change since.")
+    else:
+        logging.info("Pulling fresh columns info from Superset.")
+        if mirror is None:
+            result = superset.request('GET', f"/dataset/{dataset['id']}")['result']
+        else:
+            result = mirror.request(superset, f"/dataset/{dataset['id']}")['result']
+            mirror.save_dataset_details(dataset['id'], dataset.get('changed_on'), result)
 
     dataset['columns'] = result['columns']
     dataset['description'] = result['description']
@@ -115,30 +125,344 @@ def add_superset_columns(superset, dataset):
     return dataset
 
 
+def read_datasets_export(content):
+    """Reads columns info of datasets from a ZIP file exported by Superset.
+
+    Exported datasets carry neither their ID, nor IDs of their columns, nor their owners.
+
+    Returns:
+        Datasets keyed by "schema.table" with their description and columns in the same shape
+        as ``add_superset_columns`` adds them, column IDs being None. The exported files are kept
+        under ``files``, starting with the one of the dataset's database, to be imported back.
+    """
+
+    import ruamel.yaml
+
+    yaml = ruamel.yaml.YAML(typ='safe')
+    datasets_exported = {}
+    with zipfile.ZipFile(io.BytesIO(content)) as zip_file:
+        # e.g. dataset_export_20240101T000000/datasets/examples/orders.yaml
+        files = {file_name.split('/', 1)[1]: zip_file.read(file_name) for file_name in zip_file.namelist()
+                 if file_name.endswith('.yaml') and '/' in file_name}
+
+    databases_files = {}
+    for file_name, file_content in files.items():
+        if file_name.startswith('databases/'):
+            databases_files[yaml.load(file_content)['uuid']] = (file_name, file_content)
+
+    for file_name, file_content in files.items():
+        if not file_name.startswith('datasets/'):
+            continue
+
+        dataset = yaml.load(file_content)
+        dataset_key = get_table_key(dataset['schema'], dataset['table_name'])
+        datasets_exported[dataset_key] = {
+            'description': dataset.get('description'),
+            'columns': [{
+                'column_name': column['column_name'],
+                'id': None,
+                'expression': column.get('expression'),
+                'description': column.get('description')
+            } for column in dataset.get('columns', [])],
+            'files': [databases_files[dataset['database_uuid']], (file_name, file_content)]
+        }
+
+    return datasets_exported
+
+
+def dump_yaml(yaml, data):
+    stream = io.StringIO()
+    yaml.dump(data, stream)
+    return stream.getvalue()
+
+
+def build_datasets_import(datasets):
+    """Builds a ZIP file to be imported to Superset from exported datasets with new descriptions.
+
+    Args:
+        datasets: Exported datasets as returned by ``read_datasets_export``, merged with dbt docs
+            by ``merge_columns_info``.
+
+    Returns:
+        The ZIP file as bytes.
+    """
+
+    import ruamel.yaml
+
+    yaml = ruamel.yaml.YAML(typ='safe')
+    yaml.default_flow_style = False
+
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        metadata = {'version': '1.0.0', 'type': 'SqlaTable',
+                    'timestamp': datetime.now(tz=timezone.utc).isoformat()}
+        zip_file.writestr('dataset_import/metadata.yaml', dump_yaml(yaml, metadata))
+
+        files_written = set()
+        for dataset in datasets:
+            (database_file_name, database_file_content), (dataset_file_name, dataset_file_content) = dataset['files']
+            if database_file_name not in files_written:
+                zip_file.writestr(f'dataset_import/{database_file_name}', database_file_content)
+                files_written.add(database_file_name)
+
+            # only descriptions are changed, everything else is imported as exported
+            config = yaml.load(dataset_file_content)
+            config['description'] = dataset['description_new']
+            descriptions_new = {column['column_name']: description for column, description
+                                in zip(dataset['columns'], dataset['column_descriptions_new'])}
+            for column in config.get('columns', []):
+                column['description'] = descriptions_new.get(column['column_name'], column.get('description'))
+            zip_file.writestr(f'dataset_import/{dataset_file_name}', dump_yaml(yaml, config))
+
+    return content.getvalue()
+
+
+def import_datasets_to_superset(superset, datasets, update_limiter=None):
+    logging.info("Importing %d datasets with new descriptions into Superset.", len(datasets))
+
+    content = build_datasets_import(datasets)
+    if update_limiter is not None:
+        update_limiter.acquire()
+    try:
+        superset.request('POST', '/dataset/import/',
+                         files={'formData': ('dataset_import.zip', content, 'application/zip')},
+                         data={'overwrite': 'true'})
+    except HTTPError as e:
+        logging.error("Datasets with IDs %s weren't imported, they will be updated one by one. "
+                      "Check the error below.", ','.join(str(dataset['id']) for dataset in datasets), exc_info=e)
+        return False
+
+    return True
+
+
+def get_current_user_id(superset):
+    """Returns the ID of the user the requests to Superset are made by, or None if Superset does not tell."""
+
+    try:
+        return superset.request('GET', '/me/')['result']['id']
+    except HTTPError as e:
+        logging.warning("The current user wasn't obtained, owners of all imported datasets will be put back. "
+                        "Check the error below.", exc_info=e)
+        return None
+
+
+def restore_owners_in_superset(superset, datasets, user_id, update_limiter=None):
+    """Puts back owners of imported datasets, as Superset adds the importing user to them.
+
+    Args:
+        superset: Superset API wrapper.
+        datasets: Imported datasets as returned by ``get_datasets_from_superset``.
+        user_id: ID of the importing user, datasets already owned by them are left alone.
+            If None, owners of all datasets are put back.
+        update_limiter: ``RateLimiter`` of updates.
+
+    Returns:
+        IDs of datasets whose owners weren't put back.
+    """
+
+    datasets_failed = []
+    for dataset in datasets:
+        # owners not listed are not known, they are rather kept than emptied
+        if dataset['owner_ids'] is None or user_id is not None and user_id in dataset['owner_ids']:
+            continue
+
+        if update_limiter is not None:
+            update_limiter.acquire()
+        try:
+            superset.request('PUT', f"/dataset/{dataset['id']}?override_columns=false",
+                             json={'owners': dataset['owner_ids']})
+        except HTTPError as e:
+            logging.error("Owners of the dataset with ID=%d weren't put back after its import. "
+                          "Check the error below.", dataset['id'], exc_info=e)
+            datasets_failed.append(dataset['id'])
+
+    return datasets_failed
+
+
+def push_datasets_descriptions_in_bulk(superset, datasets, datasets_exported, dbt_tables, batch_size,
+                                       update_limiter=None):
+    """Pushes descriptions of exported datasets by importing them back in batches.
+
+    Args:
+        superset: Superset API wrapper.
+        datasets: Datasets as returned by ``get_datasets_from_superset``.
+        datasets_exported: Exported datasets keyed by their ID, as returned by
+            ``get_datasets_exports_from_superset``.
+        dbt_tables: Tables from dbt keyed by "schema.table".
+        batch_size: Number of datasets imported by a single request.
+        update_limiter: ``RateLimiter`` of imports, each of them counting as a single update, and of
+            updates of owners put back after them.
+
+    Returns:
+        Statuses of pushed datasets keyed by their ID. Datasets not exported or whose import
+        failed are missing, datasets whose owners weren't put back have failed.
+    """
+
+    statuses = {}
+    datasets_changed = []
+    for dataset in datasets:
+        if dataset['id'] not in datasets_exported:
+            continue
+
+        dataset_new = merge_columns_info(dict(dataset, owners=[], **datasets_exported[dataset['id']]), dbt_tables)
+        if check_descriptions_changed(dataset_new):
+            datasets_changed.append(dataset_new)
+        else:
+            statuses[dataset['id']] = 'skipped'
+
+    # the importing user becomes an owner of the datasets, unlike by updating them one by one
+    user_id = get_current_user_id(superset) if datasets_changed else None
+
+    batches = [datasets_changed[i:i + batch_size] for i in range(0, len(datasets_changed), batch_size)]
+    for batch in batches:
+        if import_datasets_to_superset(superset, batch, update_limiter):
+            statuses.update((dataset['id'], 'updated') for dataset in batch)
+            statuses.update((dataset_id, 'failed') for dataset_id
+                            in restore_owners_in_superset(superset, batch, user_id, update_limiter))
+
+    logging.info("Imported %d datasets into Superset in %d requests.",
+                 sum(status == 'updated' for status in statuses.values()), len(batches))
+    return statuses
+
+
+def get_datasets_export_from_superset(superset, datasets):
+    logging.info("Exporting %d datasets from Superset.", len(datasets))
+
+    ids = ','.join(str(dataset['id']) for dataset in datasets)
+    try:
+        content = superset.request('GET', '/dataset/export/', params={'q': f'!({ids})'}, raw=True)
+    except HTTPError as e:
+        logging.error("Datasets with IDs %s weren't exported, their columns info will be pulled one by one. "
+                      "Check the error below.", ids, exc_info=e)
+        return {}
+
+    return read_datasets_export(content)
+
+
+def get_datasets_exports_from_superset(superset, datasets, batch_size, max_workers=1):
+    """Pulls columns info of ``datasets`` in bulk through the dataset export endpoint.
+
+    Args:
+        superset: Superset API wrapper.
+        datasets: Datasets as returned by ``get_datasets_from_superset``.
+        batch_size: Number of datasets exported by a single request.
+        max_workers: Number of batches exported in parallel.
+
+    Returns:
+        Exported datasets keyed by their ID, as returned by ``read_datasets_export``. Datasets
+        whose export failed are missing.
+    """
+
+    batches = [datasets[i:i + batch_size] for i in range(0, len(datasets), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        exports = list(executor.map(partial(get_datasets_export_from_superset, superset), batches))
+
+    datasets_exported = {}
+    for batch, export in zip(batches, exports):
+        for dataset in batch:
+            if dataset['key'] in export:
+                datasets_exported[dataset['id']] = export[dataset['key']]
+
+    logging.info("Exported %d datasets from Superset in %d requests.", len(datasets_exported), len(batches))
+    return datasets_exported
+
+
+class HtmlTextExtractor(HTMLParser):
+    """Collects all strings of an HTML document, incl. comments, with character references resolved.
+
+    Strings are extracted like ``BeautifulSoup(html, 'html.parser')`` does, i.e. unknown entities
+    are kept without their semicolon, C1 control references are read as Windows-1252 and empty
+    comments or declarations count as a space unless whitespace is preserved.
+    """
+
+    PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.texts = []
+        self.tags_open = []
+
+    def handle_starttag(self, tag, attrs):
+        self.tags_open.append(tag)
+
+    def handle_endtag(self, tag):
+        # closing a tag closes all tags opened within it, closing a tag not opened is ignored
+        if tag in self.tags_open:
+            del self.tags_open[len(self.tags_open) - self.tags_open[::-1].index(tag) - 1:]
+
+    def handle_startendtag(self, tag, attrs):
+        pass
+
+    def handle_data(self, data):
+        self.texts.append(data)
+
+    def handle_entityref(self, name):
+        self.texts.append(html5.get(name + ';') or html5.get(name) or f'&{name}')
+
+    def handle_charref(self, name):
+        codepoint = int(name[1:], 16) if name[0] in 'xX' else int(name)
+        if codepoint == 0 or codepoint > 0x10ffff or 0xd800 <= codepoint <= 0xdfff:
+            self.texts.append('\ufffd')
+        elif 0x80 <= codepoint <= 0x9f:
+            try:
+                self.texts.append(bytes([codepoint]).decode('cp1252'))
+            except UnicodeDecodeError:
+                self.texts.append(chr(codepoint))
+        else:
+            self.texts.append(chr(codepoint))
+
+    def handle_comment(self, data):
+        preserve_whitespace = not self.PRESERVE_WHITESPACE_TAGS.isdisjoint(self.tags_open)
+        self.texts.append(data or ('' if preserve_whitespace else ' '))
+
+    handle_pi = handle_comment
+
+    def handle_decl(self, decl):
+        self.handle_comment(decl[len('DOCTYPE '):])
+
+    def unknown_decl(self, data):
+        self.handle_comment(data[len('CDATA['):] if data.upper().startswith('CDATA[') else data)
+
+
+def get_markdown():
+    """Returns a ``Markdown`` instance of the current thread, creating one is costlier than converting."""
+
+    if not hasattr(markdown_local, 'markdown'):
+        from markdown import Markdown
+
+        markdown_local.markdown = Markdown()
+    return markdown_local.markdown
+
+
+@lru_cache(maxsize=MARKDOWN_CACHE_MAX_ENTRIES)
 def convert_markdown_to_plain_text(md_string):
     """Converts a markdown string to plaintext.
 
     The following solution is used:
     https://gist.github.com/lorey/eb15a7f3338f959a78cc3661fbc255fe
+
+    Results are memoized as the same doc blocks tend to be used by many columns.
     """
 
-    # md -> html -> text since BeautifulSoup can extract text cleanly
-    html = markdown(md_string)
+    # md -> html -> text since HTML parser can extract text cleanly
+    html = get_markdown().reset().convert(md_string)
 
     # remove code snippets
-    html = re.sub(r'<pre>(.*?)</pre>', ' ', html)
-    html = re.sub(r'<code>(.*?)</code >', ' ', html)
+    html = PRE_REGEX.sub(' ', html)
+    html = CODE_REGEX.sub(' ', html)
 
     # extract text
-    soup = BeautifulSoup(html, 'html.parser')
-    text = ''.join(soup.findAll(text=True))
+    parser = HtmlTextExtractor()
+    parser.feed(html)
+    parser.close()
+    text = ''.join(parser.texts)
 
     # make one line
-    single_line = re.sub(r'\s+', ' ', text)
+    single_line = WHITESPACE_REGEX.sub(' ', text)
 
     # make fixes
-    single_line = re.sub('→', '->', single_line)
-    single_line = re.sub('<null>', '"null"', single_line)
+    single_line = single_line.replace('→', '->')
+    single_line = single_line.replace('<null>', '"null"')
 
     return single_line
 
@@ -146,40 +470,27 @@ def convert_markdown_to_plain_text(md_string):
 def merge_columns_info(dataset, tables):
     logging.info("Merging columns info from Superset and manifest.json file.")
 
-    key = dataset['key']
-    sst_columns = dataset['columns']
-    dbt_columns = tables.get(key, {}).get('columns', {})
+    table = tables.get(dataset['key'])
+    dbt_columns = table.columns if table is not None else {}
 
     sst_description = dataset['description']
-    dbt_description = tables.get(key, {}).get('description')
+    dbt_description = table.description if table is not None else None
 
     sst_owners = dataset['owners']
 
-    columns_new = []
-    for sst_column in sst_columns:
-
-        column_name = sst_column['column_name']
-
-        # add the mandatory fields
-        column_new = {
-            'column_name': column_name,
-            'id': sst_column['id']
-        }
-
-        # add column descriptions
-        if column_name in dbt_columns \
-                and 'description' in dbt_columns[column_name] \
+    # only descriptions are kept, aligned with ``columns``, the columns to put are built if anything changed
+    column_descriptions_new = []
+    for sst_column in dataset['columns']:
+        description = dbt_columns.get(sst_column['column_name'])
+        if description is not None \
                 and (sst_column['expression'] is None  # database columns
                      or sst_column['expression'] == ''):
-            description = dbt_columns[column_name]['description']
             description = convert_markdown_to_plain_text(description)
         else:
             description = sst_column['description']
-        column_new['description'] = description
+        column_descriptions_new.append(description)
 
-        columns_new.append(column_new)
-
-    dataset['columns_new'] = columns_new
+    dataset['column_descriptions_new'] = column_descriptions_new
 
     # add dataset description
     if dbt_description is None:
@@ -193,44 +504,175 @@ def merge_columns_info(dataset, tables):
     return dataset
 
 
-def check_columns_equal(lst1, lst2):
-    return sorted(lst1, key=lambda c: c["id"]) == sorted(lst2, key=lambda c: c["id"])
+def get_columns_new(dataset):
+    """Returns the columns to put into Superset, as ``merge_columns_info`` merged them."""
+
+    return [{
+        'column_name': column['column_name'],
+        'id': column['id'],
+        'description': description
+    } for column, description in zip(dataset['columns'], dataset['column_descriptions_new'])]
 
 
-def pause_after_update(superset_pause_after_update):
-    if superset_pause_after_update:
-        logging.info("Pausing the script for %d seconds to allow for databases to catch up with the update.",
-                     superset_pause_after_update)
-        time.sleep(superset_pause_after_update)
-        logging.info("Resuming the script again.")
+def check_descriptions_changed(dataset):
+    # new descriptions are aligned with the columns, so no copies of them have to be compared
+    return dataset['description_new'] != dataset['description'] \
+        or any(column['description'] != description
+               for column, description in zip(dataset['columns'], dataset['column_descriptions_new']))
 
 
-def put_descriptions_to_superset(superset, dataset, superset_pause_after_update):
+def put_descriptions_to_superset(superset, dataset, update_limiter=None):
     logging.info("Putting model and column descriptions into Superset.")
 
     description_new = dataset['description_new']
-    columns_new = dataset['columns_new']
     owners_new = dataset['owners_new']
 
-    description_old = dataset['description']
-    columns_old = [{
-        'column_name': col['column_name'],
-        'id': col['id'],
-        'description': col['description']
-    } for col in dataset['columns']]
-
-    if description_new != description_old or \
-       not check_columns_equal(columns_new, columns_old):
-        payload = {'description': description_new, 'columns': columns_new, 'owners': owners_new}
+    if check_descriptions_changed(dataset):
+        payload = {'description': description_new, 'columns': get_columns_new(dataset), 'owners': owners_new}
+        if update_limiter is not None:
+            update_limiter.acquire()
         superset.request('PUT', f"/dataset/{dataset['id']}?override_columns=false", json=payload)
-        pause_after_update(superset_pause_after_update)
-    else:
-        logging.info("Skipping PUT execute request as nothing would be updated.")
+        return True
+
+    logging.info("Skipping PUT execute request as nothing would be updated.")
+    return False
+
+
+def push_dataset_descriptions(superset, dataset, dbt_tables, superset_refresh_columns, update_limiter,
+                              position, total, dataset_exported=None, mirror=None):
+    logging.info("Processing dataset %d/%d.", position, total)
+
+    # exported columns info tells if anything would be updated, IDs and owners are only pulled if so
+    if dataset_exported is not None:
+        dataset_exported_new = merge_columns_info(dict(dataset, owners=[], **dataset_exported), dbt_tables)
+        if not check_descriptions_changed(dataset_exported_new):
+            logging.info("Skipping the dataset as nothing would be updated.")
+            return 'skipped'
+
+    try:
+        if superset_refresh_columns:
+            refresh_columns_in_superset(superset, dataset['id'], update_limiter)
+        dataset_w_cols = add_superset_columns(superset, dataset, mirror)
+        dataset_w_cols_new = merge_columns_info(dataset_w_cols, dbt_tables)
+        updated = put_descriptions_to_superset(superset, dataset_w_cols_new, update_limiter)
+    except HTTPError as e:
+        logging.error("The dataset with ID=%d wasn't updated. Check the error below.",
+                      dataset['id'], exc_info=e)
+        return 'failed'
+
+    return 'updated' if updated else 'skipped'
+
+
+def push_descriptions(superset, dbt_index, dbt_db_name, superset_db_id, superset_refresh_columns,
+                      update_limiter=None, max_workers=1, superset_page_size=1000, state=None,
+                      superset_bulk_read=False, superset_export_batch_size=100, superset_bulk_write=False,
+                      snapshot=None, metrics=None, mirror=None, shard=None):
+    """Pushes descriptions of dbt tables and their columns to the matching physical datasets in Superset.
+
+    Args:
+        superset: Instance of ``Superset`` to push through.
+        dbt_index: dbt index as returned by ``load_dbt_index``.
+        snapshot: ``SupersetSnapshot`` datasets are taken from instead of being listed again.
+        metrics: ``Metrics`` of the run.
+        mirror: ``SupersetMirror`` columns info of datasets unchanged since it was saved is read from.
+        shard: Shard as returned by ``parse_shard``, only its datasets are pushed to.
+        The remaining arguments are as in ``main``.
+
+    Returns:
+        Counts of datasets by their status, i.e. "updated", "skipped" or "failed".
+    """
+
+    if metrics is None:
+        metrics = Metrics()
+
+    with metrics.phase('dataset_listing'):
+        sst_datasets = get_datasets_from_superset(superset, superset_db_id, superset_page_size, snapshot,
+                                                  max_workers)
+    logging.info("There are %d physical datasets in Superset overall.", len(sst_datasets))
+
+    dbt_tables = get_tables_from_dbt(dbt_index, dbt_db_name)
+
+    sst_datasets_dbt_filtered = [d for d in sst_datasets if d["key"] in dbt_tables]
+    logging.info("There are %d physical datasets in Superset with a match in dbt.", len(sst_datasets_dbt_filtered))
+
+    if shard is not None:
+        sst_datasets_dbt_filtered = [d for d in sst_datasets_dbt_filtered if is_in_shard(d['id'], shard)]
+        logging.info("There are %d physical datasets with a match in dbt in the shard %d/%d.",
+                     len(sst_datasets_dbt_filtered), *shard)
+
+    # only push descriptions changed since the manifest of the previous deploy
+    if state is not None:
+        manifest_previous_path = f'{state}/manifest.json' if os.path.isdir(state) else state
+        with metrics.phase('state_diff'):
+            dbt_tables_previous = get_tables_from_dbt(build_dbt_index(manifest_previous_path), dbt_db_name)
+            dbt_tables_changed = get_tables_changed(dbt_tables, dbt_tables_previous)
+        logging.info("There are %d tables in dbt with descriptions changed since %s.",
+                     len(dbt_tables_changed), manifest_previous_path)
+
+        sst_datasets_dbt_filtered = [d for d in sst_datasets_dbt_filtered if d["key"] in dbt_tables_changed]
+        logging.info("There are %d physical datasets in Superset with a changed match in dbt.",
+                     len(sst_datasets_dbt_filtered))
+
+    sst_datasets_exported = {}
+    if (superset_bulk_read or superset_bulk_write) and superset_refresh_columns:
+        logging.warning("``superset_bulk_read`` and ``superset_bulk_write`` are ignored as columns are refreshed, "
+                        "exported columns would be outdated.")
+    elif superset_bulk_read or superset_bulk_write:
+        with metrics.phase('dataset_export'):
+            sst_datasets_exported = get_datasets_exports_from_superset(superset, sst_datasets_dbt_filtered,
+                                                                       superset_export_batch_size, max_workers)
+
+    if mirror is not None and superset_refresh_columns:
+        logging.warning("The mirror is not used as columns are refreshed, mirrored columns would be outdated.")
+        mirror = None
+
+    # datasets not pushed in bulk are pushed one by one
+    statuses_by_id = {}
+    if superset_bulk_write:
+        with metrics.phase('push_bulk'):
+            statuses_by_id = push_datasets_descriptions_in_bulk(superset, sst_datasets_dbt_filtered,
+                                                                sst_datasets_exported, dbt_tables,
+                                                                superset_export_batch_size, update_limiter)
+    sst_datasets_remaining = [d for d in sst_datasets_dbt_filtered if d['id'] not in statuses_by_id]
+
+    with metrics.phase('push'), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        statuses_by_id.update(zip([d['id'] for d in sst_datasets_remaining],
+                                  executor.map(partial(push_dataset_descriptions, superset),
+                                               sst_datasets_remaining,
+                                               repeat(dbt_tables),
+                                               repeat(superset_refresh_columns),
+                                               repeat(update_limiter),
+                                               range(1, len(sst_datasets_remaining) + 1),
+                                               repeat(len(sst_datasets_remaining)),
+                                               [sst_datasets_exported.get(d['id']) for d in sst_datasets_remaining],
+                                               repeat(mirror))))
+    statuses = [statuses_by_id[d['id']] for d in sst_datasets_dbt_filtered]
+
+    # updated datasets have changed in Superset since their columns info was mirrored
+    if mirror is not None:
+        for dataset_id, status in statuses_by_id.items():
+            if status == 'updated':
+                mirror.delete_dataset_details(dataset_id)
+
+    for sst_dataset, status in zip(sst_datasets_dbt_filtered, statuses):
+        logging.info("Dataset with ID=%d (%s): %s.", sst_dataset['id'], sst_dataset['key'], status)
+
+    statuses_count = Counter(statuses)
+    logging.info("Updated %d, skipped %d and failed %d datasets.",
+                 statuses_count['updated'], statuses_count['skipped'], statuses_count['failed'])
+    for status in ['updated', 'skipped', 'failed']:
+        metrics.count(f'datasets_{status}', statuses_count[status])
+
+    return statuses_count
 
 
 def main(dbt_project_dir, dbt_db_name,
          superset_url, superset_db_id, superset_refresh_columns, superset_pause_after_update,
-         superset_access_token, superset_refresh_token):
+         superset_access_token, superset_refresh_token,
+         superset_pool_size=10, superset_max_retries=3, max_workers=1,
+         superset_max_requests_per_second=None, superset_max_updates_per_second=None,
+         superset_page_size=1000, state=None, superset_bulk_read=False, superset_export_batch_size=100,
+         superset_bulk_write=False, profile=False, metrics_json=None, mirror=False, mirror_path=None, shard=None):
 
     # require at least one token for Superset
     assert superset_access_token is not None or superset_refresh_token is not None, \
@@ -238,34 +680,35 @@ def main(dbt_project_dir, dbt_db_name,
            "to your environment variables or provide in CLI " \
            "via ``superset-access-token`` or ``superset-refresh-token``."
 
+    if superset_pause_after_update and superset_max_updates_per_second is None:
+        logging.warning("``superset_pause_after_update`` is deprecated, "
+                        "use ``superset_max_updates_per_second`` instead.")
+        superset_max_updates_per_second = 1 / superset_pause_after_update
+    shard = parse_shard(shard)
+
+    metrics = Metrics('push-descriptions')
     superset = Superset(superset_url + '/api/v1',
-                        access_token=superset_access_token, refresh_token=superset_refresh_token)
+                        access_token=superset_access_token, refresh_token=superset_refresh_token,
+                        pool_size=max(superset_pool_size, max_workers), max_retries=superset_max_retries,
+                        max_requests_per_second=superset_max_requests_per_second,
+                        hooks=[metrics.record_request])
+    update_limiter = RateLimiter(superset_max_updates_per_second) if superset_max_updates_per_second else None
 
     logging.info("Starting the script!")
 
-    sst_datasets = get_datasets_from_superset(superset, superset_db_id)
-    logging.info("There are %d physical datasets in Superset overall.", len(sst_datasets))
-
-    with open(f'{dbt_project_dir}/target/manifest.json') as f:
-        dbt_manifest = json.load(f)
-
-    dbt_tables = get_tables_from_dbt(dbt_manifest, dbt_db_name)
-
-    sst_datasets_dbt_filtered = [d for d in sst_datasets if d["key"] in dbt_tables]
-    logging.info("There are %d physical datasets in Superset with a match in dbt.", len(sst_datasets_dbt_filtered))
-
-    for i, sst_dataset in enumerate(sst_datasets_dbt_filtered):
-        logging.info("Processing dataset %d/%d.", i + 1, len(sst_datasets_dbt_filtered))
-        sst_dataset_id = sst_dataset['id']
-        try:
-            if superset_refresh_columns:
-                refresh_columns_in_superset(superset, sst_dataset_id)
-                pause_after_update(superset_pause_after_update)
-            sst_dataset_w_cols = add_superset_columns(superset, sst_dataset)
-            sst_dataset_w_cols_new = merge_columns_info(sst_dataset_w_cols, dbt_tables)
-            put_descriptions_to_superset(superset, sst_dataset_w_cols_new, superset_pause_after_update)
-        except HTTPError as e:
-            logging.error("The dataset with ID=%d wasn't updated. Check the error below.",
-                          sst_dataset_id, exc_info=e)
-
+    with metrics.phase('manifest_load'):
+        dbt_index = load_dbt_index(dbt_project_dir)
+
+    # pooled connections are closed however the command ends
+    with superset, open_mirror(dbt_project_dir, mirror, mirror_path, metrics) as mirror:
+        push_descriptions(superset, dbt_index, dbt_db_name, superset_db_id, superset_refresh_columns,
+                          update_limiter=update_limiter, max_workers=max_workers,
+                          superset_page_size=superset_page_size, state=state,
+                          superset_bulk_read=superset_bulk_read, superset_export_batch_size=superset_export_batch_size,
+                          superset_bulk_write=superset_bulk_write, metrics=metrics, mirror=mirror, shard=shard)
+
+    if profile:
+        metrics.log_report()
+    if metrics_json is not None:
+        metrics.write_json(metrics_json)
     logging.info("All done!")
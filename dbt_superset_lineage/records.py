@@ -0,0 +1,89 @@
+import sys
+
+from dataclasses import dataclass
+
+
+def get_table_key(schema, name):
+    """Returns the interned "schema.table" key tables and datasets are matched by."""
+
+    return sys.intern(f'{schema}.{name}')
+
+
+@dataclass(slots=True)
+class DbtTable:
+    """A dbt node or source as kept in the dbt index.
+
+    Columns map names of columns to their descriptions, which are all the index needs of them.
+    """
+
+    name: str
+    schema: str
+    database: str
+    type: str
+    ref: str
+    description: str
+    columns: dict
+
+    def __post_init__(self):
+        # tens of thousands of tables share a few schemas
+        self.name = sys.intern(self.name)
+        self.schema = sys.intern(self.schema)
+
+
+@dataclass(slots=True)
+class Dashboard:
+    """A published dashboard pulled from Superset, with datasets in "schema.table" and "database.schema.table".
+
+    In incremental runs, ``changed_on`` includes versions of the charts on the dashboard.
+    """
+
+    id: int
+    title: str
+    url: str
+    owner_name: str
+    datasets: list
+    datasets_w_db: list
+    changed_on: str = None
+    refs: list = None
+
+    def get_state(self):
+        """Returns the fields saved between runs, i.e. all but references to dbt."""
+
+        return {
+            'id': self.id,
+            'title': self.title,
+            'url': self.url,
+            'owner_name': self.owner_name,
+            'datasets': self.datasets,
+            'datasets_w_db': self.datasets_w_db,
+            'changed_on': self.changed_on
+        }
+
+
+@dataclass(slots=True)
+class Dataset:
+    """A dataset on dashboards pulled from Superset with the tables it is built on."""
+
+    id: int
+    name: str
+    schema: str
+    database: str
+    kind: str
+    changed_on: str
+    sql_hash: str
+    tables: list
+    dbt_refs: list = None
+
+    def get_state(self):
+        """Returns the fields saved between runs, i.e. all but references to dbt."""
+
+        return {
+            'id': self.id,
+            'name': self.name,
+            'schema': self.schema,
+            'database': self.database,
+            'kind': self.kind,
+            'changed_on': self.changed_on,
+            'sql_hash': self.sql_hash,
+            'tables': self.tables
+        }
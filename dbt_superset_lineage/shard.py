@@ -0,0 +1,39 @@
+import zlib
+
+
+def parse_shard(shard):
+    """Parses a shard given as "INDEX/COUNT", e.g. "2/4" for the second of four shards.
+
+    Args:
+        shard: Shard as given in CLI, or None for no sharding.
+
+    Returns:
+        A tuple of the index from 1 and the count of shards, or None if ``shard`` is None.
+    """
+
+    if shard is None:
+        return None
+
+    index, _, count = shard.partition('/')
+    assert index.isdigit() and count.isdigit() and 1 <= int(index) <= int(count), \
+        f"Shard {shard} is not in the format INDEX/COUNT with 1 <= INDEX <= COUNT, e.g. 1/4."
+
+    return int(index), int(count)
+
+
+def is_in_shard(object_id, shard):
+    """Tells whether a dashboard or dataset belongs to ``shard``.
+
+    Objects are split by a hash of their ID, which is stable across processes and machines
+    (unlike the built-in ``hash``), so that shards run on separate CI workers cover each object exactly once.
+
+    Args:
+        object_id: ID of the object in Superset.
+        shard: Shard as returned by ``parse_shard``, None covers all objects.
+    """
+
+    if shard is None:
+        return True
+
+    index, count = shard
+    return zlib.crc32(str(object_id).encode()) % count == index - 1
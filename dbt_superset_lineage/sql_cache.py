@@ -0,0 +1,90 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class SqlTablesCache:
+    """A persistent, size-bounded cache of tables extracted from SQL queries.
+
+    Entries are keyed by a hash of the SQL text, the dialect and the extractor version, so a change
+    in any of them results in a miss rather than in a stale result. The least recently used entries
+    are evicted once there are more than ``max_entries`` of them.
+    """
+
+    def __init__(self, path, version, max_entries=10000):
+        """Instantiates the class and loads the entries stored in ``path``, if any.
+
+        Args:
+            path: Path of the JSON file the cache is persisted in.
+            version: Version of the extractor; entries of other versions are never hit.
+            max_entries: Maximum number of entries kept when the cache is saved.
+        """
+
+        self.path = Path(path)
+        self.version = version
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.path) as f:
+                self._entries.update(json.load(f)['entries'])
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("SQL cache at %s is corrupted and will be rebuilt.", self.path, exc_info=e)
+
+    def _key(self, sql, dialect):
+        return hashlib.sha256('\0'.join([self.version, dialect, sql]).encode('utf-8')).hexdigest()
+
+    def get(self, sql, dialect):
+        """Returns the cached tables of ``sql`` parsed in ``dialect``, or None on a miss."""
+
+        key = self._key(sql, dialect)
+        with self._lock:
+            tables = self._entries.get(key)
+            if tables is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(tables)
+
+    def set(self, sql, dialect, tables):
+        """Stores the tables of ``sql`` parsed in ``dialect``."""
+
+        key = self._key(sql, dialect)
+        with self._lock:
+            self._entries[key] = list(tables)
+            self._entries.move_to_end(key)
+
+    def save(self):
+        """Evicts the least recently used entries over ``max_entries`` and persists the rest."""
+
+        with self._lock:
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            content = json.dumps({'entries': self._entries})
+
+        # write atomically so that an interrupted run does not leave a corrupted cache behind
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        path_tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(path_tmp, 'w') as f:
+            f.write(content)
+        os.replace(path_tmp, self.path)
+
+    def stats(self):
+        """Returns a dictionary with the number of entries, hits and misses."""
+
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
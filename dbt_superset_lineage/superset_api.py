@@ -1,14 +1,94 @@
+import base64
+import binascii
+import json
 import logging
+import math
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# pages of listings requested ahead per worker, bounding memory held by pages not yet consumed
+PAGES_PENDING_PER_WORKER = 2
+
+
+def get_token_expiration(token):
+    """Returns the expiration of a JWT as a Unix timestamp, or None if it cannot be decoded.
+
+    The signature is not verified, the expiration is only used to refresh the token in time.
+    """
+
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError, binascii.Error):
+        return None
+
+
+def map_bounded(executor, function, *iterables, max_pending):
+    """Like ``executor.map``, but takes ``iterables`` lazily, keeping at most ``max_pending`` calls pending.
+
+    Results are yielded in order as soon as they are done, so that the consumer works while further
+    calls are running and further items, e.g. pages of a listing, are only taken once there is room.
+    """
+
+    pending = deque()
+    for args in zip(*iterables):
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+        pending.append(executor.submit(function, *args))
+
+    while pending:
+        yield pending.popleft().result()
+
+
+class RateLimiter:
+    """A token bucket limiting the rate of events across threads."""
+
+    def __init__(self, rate, burst=1):
+        """Instantiates the class.
+
+        Args:
+            rate: Maximum number of events per second on average.
+            burst: Maximum number of events that may happen at once after a period of inactivity.
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until the next event is allowed to happen."""
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1  # reserve the token, possibly going into debt
+            wait = -self._tokens / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
+
 
 class Superset:
     """A class for accessing the Superset API in an easy way."""
 
-    def __init__(self, api_url, access_token=None, refresh_token=None):
+    def __init__(self, api_url, access_token=None, refresh_token=None,
+                 pool_size=10, max_retries=3, backoff_factor=0.5, hooks=None,
+                 max_requests_per_second=None, refresh_margin=60):
         """Instantiates the class.
 
         If ``access_token`` is None, attempts to obtain it using ``refresh_token``.
@@ -19,11 +99,39 @@ class Superset:
                 API. Can be automatically obtained if ``refresh_token`` is not None.
             refresh_token: Refresh token to use for obtaining or refreshing the ``access_token``.
                 If None, no refresh will be done.
+            pool_size: Maximum number of keep-alive connections kept open to the Superset host.
+                Requests beyond it wait for a connection, however many threads share the instance,
+                so that connections are reused instead of opened and discarded.
+            max_retries: Number of retries for connection errors and 429/5xx responses.
+                ``Retry-After`` headers are honored.
+            backoff_factor: Factor of the exponential backoff between retries, in seconds.
+            hooks: Callables invoked after every request as
+                ``hook(method, endpoint, response, elapsed)``, ``elapsed`` being in seconds.
+            max_requests_per_second: Maximum rate of requests shared by all threads using
+                the instance. If None, the rate is not limited.
+            refresh_margin: Number of seconds before the expiration of ``access_token`` when it is
+                refreshed, provided there is ``refresh_token``.
         """
 
         self.api_url = api_url
         self.access_token = access_token
+        self.access_token_expiration = get_token_expiration(access_token)
         self.refresh_token = refresh_token
+        self.refresh_margin = refresh_margin
+        self._token_lock = threading.Lock()
+        self.hooks = list(hooks) if hooks else []
+        self.rate_limiter = RateLimiter(max_requests_per_second) if max_requests_per_second else None
+
+        self.session = requests.Session()
+        retries = Retry(total=max_retries,
+                        backoff_factor=backoff_factor,
+                        status_forcelist=RETRY_STATUS_CODES,
+                        respect_retry_after_header=True,
+                        raise_on_status=False)  # let ``raise_for_status`` raise HTTPError as before
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries,
+                              pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
         if self.access_token is None:
             self._refresh_access_token()
@@ -37,56 +145,196 @@ class Superset:
             **headers,
         }
 
-    def _refresh_access_token(self):
-        logger.debug("Refreshing API token")
+    def _refresh_access_token(self, access_token_expired=None):
+        """Refreshes ``access_token`` once across threads.
+
+        Args:
+            access_token_expired: The token found to be expired. If another thread has already
+                replaced it, it is not refreshed again.
+
+        Returns:
+            Whether there is a fresh ``access_token``.
+        """
 
         if self.refresh_token is None:
             logging.warning("Cannot refresh access_token, refresh_token is None")
             return False
 
-        res = self.request('POST', '/security/refresh',
-                           headers={'Authorization': f'Bearer {self.refresh_token}'},
-                           refresh_token_if_needed=False)
-        self.access_token = res['access_token']
+        with self._token_lock:
+            if access_token_expired is not None and self.access_token != access_token_expired:
+                logger.debug("Token already refreshed by another thread")
+                return True
+
+            logger.debug("Refreshing API token")
+            res = self.request('POST', '/security/refresh',
+                               headers={'Authorization': f'Bearer {self.refresh_token}'},
+                               refresh_token_if_needed=False)
+            self.access_token = res['access_token']
+            self.access_token_expiration = get_token_expiration(self.access_token)
 
         logger.debug("Token refreshed successfully")
         return True
 
-    def request(self, method, endpoint, refresh_token_if_needed=True, headers=None,
+    def _refresh_access_token_if_expiring(self):
+        access_token = self.access_token
+        if self.refresh_token is not None and self.access_token_expiration is not None \
+                and time.time() >= self.access_token_expiration - self.refresh_margin:
+            self._refresh_access_token(access_token)
+
+    def _send(self, method, endpoint, headers, **request_kwargs):
+        url = self.api_url + endpoint
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        start = time.perf_counter()
+        res = self.session.request(method, url, headers=self._headers(**headers), **request_kwargs)
+        elapsed = time.perf_counter() - start
+
+        logger.debug("Request finished with status: %d", res.status_code)
+        for hook in self.hooks:
+            hook(method, endpoint, res, elapsed)
+
+        return res
+
+    def add_hook(self, hook):
+        """Registers a callable invoked after every request.
+
+        Args:
+            hook: Callable invoked as ``hook(method, endpoint, response, elapsed)``.
+        """
+
+        self.hooks.append(hook)
+
+    def close(self):
+        """Closes all pooled connections."""
+
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, method, endpoint, refresh_token_if_needed=True, headers=None, raw=False,
                 **request_kwargs):
         """Executes a request against the Superset API.
 
+        Connections are pooled and kept alive across requests. Connection errors and 429/5xx
+        responses are retried with an exponential backoff before the response is evaluated.
+
+        The ``access_token`` is refreshed shortly before it expires. Should it still be rejected
+        as expired, it is refreshed and the request is repeated with the same arguments.
+
         Args:
             method: HTTP method to use.
             endpoint: Endpoint to use.
             refresh_token_if_needed: Whether the ``access_token`` should be automatically refreshed
                 if needed.
             headers: Additional headers to use.
+            raw: Whether the response body should be returned as bytes instead of being parsed
+                from JSON, e.g. for exported files.
             **request_kwargs: Any ``requests.request`` arguments to use.
 
         Returns:
-            A dictionary containing response body parsed from JSON.
+            A dictionary containing response body parsed from JSON, or the response body as bytes
+            if ``raw`` is True.
 
         Raises:
             HTTPError: There is an HTTP error (detected by ``requests.Response.raise_for_status``)
                 even after retrying with a fresh ``access_token``.
         """
 
+        res = self._request(method, endpoint, refresh_token_if_needed, headers, **request_kwargs)
+        return res.content if raw else res.json()
+
+    def request_conditional(self, endpoint, etag=None, **request_kwargs):
+        """Executes a GET request against the Superset API, revalidating a response received before.
+
+        Superset sends ETags of e.g. dashboards and their datasets, and answers with 304 Not Modified
+        if the ETag sent in ``If-None-Match`` still matches.
+
+        Args:
+            endpoint: Endpoint to use.
+            etag: ETag of the response received before. If None, the request is not conditional.
+            **request_kwargs: Any ``requests.request`` arguments to use.
+
+        Returns:
+            A tuple of the response body parsed from JSON, None if it did not change since ``etag``,
+            and the ETag of the response, None if Superset does not send any.
+        """
+
+        headers = {'If-None-Match': etag} if etag is not None else None
+        res = self._request('GET', endpoint, headers=headers, **request_kwargs)
+        if res.status_code == 304:
+            return None, etag
+
+        return res.json(), res.headers.get('ETag')
+
+    def paginate(self, endpoint, query, page_size=1000, max_workers=1):
+        """GETs all pages of a listing endpoint, the pages after the first one concurrently.
+
+        The first page tells the number of objects and the page size Superset actually uses, as it
+        caps the requested one (``FAB_API_MAX_PAGE_SIZE``). The remaining pages are then requested
+        by up to ``max_workers`` threads at once, so that listing takes about as long as the slowest
+        page instead of the sum of all. At most ``PAGES_PENDING_PER_WORKER`` pages per worker are requested
+        ahead of the one consumed. Should objects be added meanwhile, further pages are requested
+        one by one until a page is not full.
+
+        Args:
+            endpoint: Endpoint to use, e.g. ``/dataset/``.
+            query: Query of the listing without the page, e.g. with ``filters`` and ``columns``.
+            page_size: Number of objects requested per page.
+            max_workers: Maximum number of pages requested at once.
+
+        Yields:
+            Response bodies of the pages in order, each with ``result`` and ``count``.
+        """
+
+        def get_page(page_number):
+            logger.info("Getting page %d of %s.", page_number + 1, endpoint)
+            payload = {'q': json.dumps({**query, 'page': page_number, 'page_size': page_size})}
+            return self.request('GET', endpoint, params=payload)
+
+        res = get_page(0)
+        yield res
+
+        page_size_effective = len(res['result'])
+        objects_count = page_size_effective
+        if not page_size_effective or objects_count >= res['count']:
+            return
+
+        pages_count = math.ceil(res['count'] / page_size_effective)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for res in map_bounded(executor, get_page, range(1, pages_count),
+                                   max_pending=max_workers * PAGES_PENDING_PER_WORKER):
+                objects_count += len(res['result'])
+                yield res
+
+        page_number = pages_count
+        while len(res['result']) == page_size_effective and objects_count < res['count']:
+            res = get_page(page_number)
+            objects_count += len(res['result'])
+            page_number += 1
+            yield res
+
+    def _request(self, method, endpoint, refresh_token_if_needed=True, headers=None, **request_kwargs):
         logger.info("About to %s execute request for endpoint %s", method, endpoint)
 
         if headers is None:
             headers = {}
 
-        url = self.api_url + endpoint
-        res = requests.request(method, url, headers=self._headers(**headers), **request_kwargs)
+        if refresh_token_if_needed:
+            self._refresh_access_token_if_expiring()
 
-        logger.debug("Request finished with status: %d", res.status_code)
+        access_token = self.access_token
+        res = self._send(method, endpoint, headers, **request_kwargs)
 
         if refresh_token_if_needed and res.status_code == 401 \
-                and res.json().get('msg') == 'Token has expired' and self._refresh_access_token():
-            logger.debug("Retrying %s request for endpoint %s with refreshed token")
-            res = requests.request(method, url, headers=self._headers(**headers))
-            logger.debug("Request finished with status: %d", res.status_code)
+                and res.json().get('msg') == 'Token has expired' and self._refresh_access_token(access_token):
+            logger.debug("Retrying %s request for endpoint %s with refreshed token", method, endpoint)
+            res = self._send(method, endpoint, headers, **request_kwargs)
 
         res.raise_for_status()
-        return res.json()
+        return res
@@ -0,0 +1,223 @@
+import json
+import logging
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+from pathlib import Path
+
+from .records import Dashboard, Dataset
+
+# bump whenever the schema changes, mirrors of other versions are recreated
+MIRROR_VERSION = 1
+
+MIRROR_SCHEMA = """
+create table meta (key text primary key, value text);
+create table dashboards (id integer primary key, title text, url text, owner_name text, changed_on text,
+                         data text);
+create table dashboard_refs (dashboard_id integer, ref text, primary key (dashboard_id, ref));
+create table datasets (key text primary key, id integer, name text, schema text, database text, kind text,
+                       changed_on text, data text);
+create table dataset_details (id integer primary key, changed_on text, description text, data text);
+create table columns (dataset_id integer, id integer, column_name text, expression text, description text,
+                      primary key (dataset_id, id));
+create table owners (dataset_id integer, id integer, first_name text, last_name text,
+                     primary key (dataset_id, id));
+create table responses (endpoint text primary key, etag text, body text);
+"""
+
+
+class SupersetMirror:
+    """A local SQLite mirror of metadata of dashboards, datasets, their columns and owners in Superset.
+
+    Both commands fill the mirror and read objects from it as long as they did not change in
+    Superset, which is told by ``changed_on`` of listed objects or by ETags of responses.
+    The mirror can also be queried directly, e.g. for dashboards using a dbt model::
+
+        select d.title, d.url from dashboards d join dashboard_refs r on r.dashboard_id = d.id
+        where r.ref = 'ref(''orders'')'
+    """
+
+    def __init__(self, path):
+        """Instantiates the class, creating the mirror at ``path`` if missing or of another version.
+
+        Args:
+            path: Path of the SQLite file.
+        """
+
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self._connection = self._connect()
+        except sqlite3.DatabaseError as e:
+            logging.warning("Mirror at %s is corrupted and will be recreated.", self.path, exc_info=e)
+            self.path.unlink()
+            self._connection = self._connect()
+
+    def _connect(self):
+        # the connection is shared by worker threads, access is serialized by ``_lock``
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        if connection.execute('pragma user_version').fetchone()[0] != MIRROR_VERSION:
+            logging.info("Creating a mirror of Superset metadata at %s.", self.path)
+            tables = connection.execute("select name from sqlite_master where type = 'table'").fetchall()
+            with connection:
+                for (table,) in tables:
+                    connection.execute(f'drop table "{table}"')
+                connection.executescript(MIRROR_SCHEMA)
+                connection.execute(f'pragma user_version = {MIRROR_VERSION}')
+        return connection
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def load_pull_state(self, params):
+        """Loads dashboards and datasets saved by ``save_pull_state`` with the same parameters.
+
+        Returns:
+            Saved ``Dashboard`` keyed by their ID and saved ``Dataset`` keyed by "schema.table",
+            or two Nones if nothing was saved with ``params``.
+        """
+
+        with self._lock:
+            row = self._connection.execute("select value from meta where key = 'pull_params'").fetchone()
+            if row is None or json.loads(row[0]) != params:
+                logging.info("Mirror at %s holds no dashboards pulled with the same parameters.", self.path)
+                return None, None
+
+            dashboards = self._connection.execute('select id, data from dashboards').fetchall()
+            datasets = self._connection.execute('select key, data from datasets').fetchall()
+
+        logging.info("Using %d dashboards and %d datasets from the mirror at %s.",
+                     len(dashboards), len(datasets), self.path)
+        return ({dashboard_id: Dashboard(**json.loads(data)) for dashboard_id, data in dashboards},
+                {dataset_key: Dataset(**json.loads(data)) for dataset_key, data in datasets})
+
+    def save_pull_state(self, params, dashboards, datasets):
+        """Replaces pulled dashboards, their references to dbt and datasets with those of this run."""
+
+        with self._lock, self._connection:
+            self._connection.execute("insert or replace into meta values ('pull_params', ?)", [json.dumps(params)])
+            for table in ['dashboards', 'dashboard_refs', 'datasets']:
+                self._connection.execute(f'delete from {table}')
+
+            self._connection.executemany('insert into dashboards values (?, ?, ?, ?, ?, ?)', [
+                (dashboard.id, dashboard.title, dashboard.url, dashboard.owner_name, dashboard.changed_on,
+                 json.dumps(dashboard.get_state()))
+                for dashboard in dashboards
+            ])
+            self._connection.executemany('insert into dashboard_refs values (?, ?)', [
+                (dashboard.id, ref) for dashboard in dashboards for ref in dashboard.refs or []
+            ])
+            self._connection.executemany('insert into datasets values (?, ?, ?, ?, ?, ?, ?, ?)', [
+                (dataset_key, dataset.id, dataset.name, dataset.schema, dataset.database, dataset.kind,
+                 dataset.changed_on, json.dumps(dataset.get_state()))
+                for dataset_key, dataset in datasets.items()
+            ])
+
+        logging.info("Saved %d dashboards and %d datasets to the mirror at %s.",
+                     len(dashboards), len(datasets), self.path)
+
+    def get_dataset_details(self, dataset_id, changed_on):
+        """Returns details of a dataset as returned by ``/dataset/{id}``, None if they changed since saved."""
+
+        with self._lock:
+            row = self._connection.execute('select changed_on, data from dataset_details where id = ?',
+                                           [dataset_id]).fetchone()
+            if changed_on is None or row is None or row[0] != changed_on:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return json.loads(row[1])
+
+    def save_dataset_details(self, dataset_id, changed_on, result):
+        """Saves details of a dataset as returned by ``/dataset/{id}`` along with its ``changed_on``."""
+
+        with self._lock, self._connection:
+            self._delete_dataset_details(dataset_id)
+            self._connection.execute('insert into dataset_details values (?, ?, ?, ?)',
+                                     [dataset_id, changed_on, result.get('description'), json.dumps(result)])
+            self._connection.executemany('insert or replace into columns values (?, ?, ?, ?, ?)', [
+                (dataset_id, column['id'], column['column_name'], column.get('expression'), column.get('description'))
+                for column in result.get('columns', [])
+            ])
+            self._connection.executemany('insert or replace into owners values (?, ?, ?, ?)', [
+                (dataset_id, owner['id'], owner.get('first_name'), owner.get('last_name'))
+                for owner in result.get('owners', [])
+            ])
+
+    def delete_dataset_details(self, dataset_id):
+        """Forgets details of a dataset, e.g. after it was updated."""
+
+        with self._lock, self._connection:
+            self._delete_dataset_details(dataset_id)
+
+    def _delete_dataset_details(self, dataset_id):
+        for table, column in [('dataset_details', 'id'), ('columns', 'dataset_id'), ('owners', 'dataset_id')]:
+            self._connection.execute(f'delete from {table} where {column} = ?', [dataset_id])
+
+    def request(self, superset, endpoint):
+        """GETs ``endpoint`` through ``superset``, revalidating the response saved before by its ETag.
+
+        Returns:
+            The response body parsed from JSON.
+        """
+
+        with self._lock:
+            row = self._connection.execute('select etag, body from responses where endpoint = ?',
+                                           [endpoint]).fetchone()
+        etag, body = row if row is not None else (None, None)
+
+        result, etag_new = superset.request_conditional(endpoint, etag)
+        if result is None:
+            with self._lock:
+                self.not_modified += 1
+            return json.loads(body)
+
+        if etag_new is not None:
+            with self._lock, self._connection:
+                self._connection.execute('insert or replace into responses values (?, ?, ?)',
+                                         [endpoint, etag_new, json.dumps(result)])
+        return result
+
+    def stats(self):
+        """Returns a dictionary with the number of hits, misses and responses not modified."""
+
+        return {'hits': self.hits, 'misses': self.misses, 'not_modified': self.not_modified}
+
+
+@contextmanager
+def open_mirror(dbt_project_dir, mirror=False, mirror_path=None, metrics=None):
+    """Opens the mirror of a run if it is enabled, closing it at the end.
+
+    Args:
+        dbt_project_dir: Directory of the dbt project the mirror is kept in by default.
+        mirror: Whether the mirror is enabled.
+        mirror_path: Path of the mirror. Defaults to target/dbt_superset_lineage/superset_mirror.sqlite
+            within ``dbt_project_dir``.
+        metrics: ``Metrics`` of the run hits of the mirror are counted in.
+
+    Yields:
+        A ``SupersetMirror``, or None if it is not enabled.
+    """
+
+    if not mirror:
+        yield None
+        return
+
+    if mirror_path is None:
+        mirror_path = f'{dbt_project_dir}/target/dbt_superset_lineage/superset_mirror.sqlite'
+    mirror = SupersetMirror(mirror_path)
+    try:
+        yield mirror
+    finally:
+        if metrics is not None:
+            metrics.count('mirror_hits', mirror.hits)
+            metrics.count('mirror_not_modified', mirror.not_modified)
+        mirror.close()
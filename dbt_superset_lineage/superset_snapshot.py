@@ -0,0 +1,58 @@
+import logging
+import threading
+
+# every field of datasets needed by either of the commands, see ``SupersetSnapshot``
+DATASET_COLUMNS = ['id', 'table_name', 'schema', 'kind', 'sql', 'changed_on_utc',
+                   'database.id', 'database.database_name', 'owners.id']
+
+
+class SupersetSnapshot:
+    """An in-memory snapshot of the datasets in Superset shared by the commands of a single run.
+
+    Datasets are listed at most once, at the first call of ``get_datasets``, with all the fields
+    either command needs. ``pull-dashboards`` takes changes and missing fields of datasets from it,
+    ``push-descriptions`` its physical datasets, so that ``sync`` pages through ``/dataset/`` once.
+    """
+
+    def __init__(self, superset, superset_db_id=None, superset_page_size=1000, max_workers=1):
+        """Instantiates the class.
+
+        Args:
+            superset: Instance of ``Superset`` the datasets are listed through.
+            superset_db_id: ID of the database datasets are limited to. If None, all are listed.
+            superset_page_size: Number of datasets requested per page.
+            max_workers: Maximum number of pages requested at once.
+        """
+
+        self.superset = superset
+        self.superset_db_id = superset_db_id
+        self.superset_page_size = superset_page_size
+        self.max_workers = max_workers
+
+        self._datasets = None
+        self._lock = threading.Lock()
+
+    def get_datasets(self):
+        """Returns datasets as listed by ``/dataset/``, each with the fields in ``DATASET_COLUMNS``."""
+
+        with self._lock:
+            if self._datasets is None:
+                self._datasets = self._list_datasets()
+
+        return self._datasets
+
+    def _list_datasets(self):
+        logging.info("Getting a snapshot of datasets from Superset.")
+
+        filters = []
+        if self.superset_db_id is not None:
+            filters.append({'col': 'database', 'opr': 'rel_o_m', 'value': self.superset_db_id})
+
+        datasets = []
+        query = {'filters': filters, 'columns': DATASET_COLUMNS}
+        for res in self.superset.paginate('/dataset/', query, self.superset_page_size, self.max_workers):
+            datasets.extend(res['result'])
+
+        logging.info("There are %d datasets in the snapshot.", len(datasets))
+
+        return datasets
@@ -0,0 +1,70 @@
+import logging
+
+from .dbt_index import load_dbt_index
+from .metrics import Metrics
+from .pull_dashboards import EXPOSURES_PATH_DEFAULT, pull_dashboards
+from .push_descriptions import push_descriptions
+from .shard import parse_shard
+from .superset_api import RateLimiter, Superset
+from .superset_mirror import open_mirror
+from .superset_snapshot import SupersetSnapshot
+
+
+def main(dbt_project_dir, exposures_path, dbt_db_name,
+         superset_url, superset_db_id, sql_dialect, superset_refresh_columns,
+         superset_access_token, superset_refresh_token,
+         superset_pool_size=10, superset_max_retries=3, max_workers=1,
+         superset_max_requests_per_second=None, superset_max_updates_per_second=None,
+         superset_page_size=1000, sql_cache=True, sql_cache_path=None, sql_cache_max_entries=10000,
+         parse_workers=None, incremental=False, full_refresh=False, state_path=None,
+         state=None, superset_bulk_read=False, superset_export_batch_size=100, superset_bulk_write=False,
+         profile=False, metrics_json=None, mirror=False, mirror_path=None, shard=None):
+
+    # require at least one token for Superset
+    assert superset_access_token is not None or superset_refresh_token is not None, \
+           "Add ``SUPERSET_ACCESS_TOKEN`` or ``SUPERSET_REFRESH_TOKEN`` " \
+           "to your environment variables or provide in CLI " \
+           "via ``superset-access-token`` or ``superset-refresh-token``."
+    shard = parse_shard(shard)
+    assert shard is None or exposures_path != EXPOSURES_PATH_DEFAULT, \
+        f"Pull the shard into its own exposure file with ``exposures-path``, e.g. /target/exposures_{shard[0]}.yml, " \
+        f"instead of {EXPOSURES_PATH_DEFAULT}, and combine the files of all shards with ``merge-exposures``."
+
+    # one client, one dbt index and one listing of datasets are shared by both commands
+    metrics = Metrics('sync')
+    superset = Superset(superset_url + '/api/v1',
+                        access_token=superset_access_token, refresh_token=superset_refresh_token,
+                        pool_size=max(superset_pool_size, max_workers), max_retries=superset_max_retries,
+                        max_requests_per_second=superset_max_requests_per_second,
+                        hooks=[metrics.record_request])
+    update_limiter = RateLimiter(superset_max_updates_per_second) if superset_max_updates_per_second else None
+    snapshot = SupersetSnapshot(superset, superset_db_id, superset_page_size, max_workers)
+
+    logging.info("Starting the script!")
+
+    with metrics.phase('manifest_load'):
+        dbt_index = load_dbt_index(dbt_project_dir)
+
+    # pooled connections are closed however the command ends
+    with superset, open_mirror(dbt_project_dir, mirror, mirror_path, metrics) as mirror:
+        logging.info("Pulling dashboards.")
+        pull_dashboards(superset, dbt_index, dbt_project_dir, exposures_path, dbt_db_name,
+                        superset_url, superset_db_id, sql_dialect,
+                        max_workers=max_workers, superset_page_size=superset_page_size,
+                        sql_cache=sql_cache, sql_cache_path=sql_cache_path, sql_cache_max_entries=sql_cache_max_entries,
+                        parse_workers=parse_workers, incremental=incremental, full_refresh=full_refresh,
+                        state_path=state_path, snapshot=snapshot, metrics=metrics, mirror=mirror, shard=shard)
+
+        logging.info("Pushing descriptions.")
+        push_descriptions(superset, dbt_index, dbt_db_name, superset_db_id, superset_refresh_columns,
+                          update_limiter=update_limiter, max_workers=max_workers,
+                          superset_page_size=superset_page_size, state=state,
+                          superset_bulk_read=superset_bulk_read, superset_export_batch_size=superset_export_batch_size,
+                          superset_bulk_write=superset_bulk_write, snapshot=snapshot, metrics=metrics,
+                          mirror=mirror, shard=shard)
+
+    if profile:
+        metrics.log_report()
+    if metrics_json is not None:
+        metrics.write_json(metrics_json)
+    logging.info("All done!")
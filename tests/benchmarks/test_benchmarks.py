@@ -0,0 +1,84 @@
+import math
+import time
+import tracemalloc
+
+import pytest
+
+from dbt_superset_lineage.dbt_index import get_tables_from_dbt, load_dbt_index
+
+from ..support.commands import pull, push
+from ..support.fake_superset import FakeSuperset
+from ..support.manifest_generator import write_dbt_project
+
+MAX_PAGE_SIZE = 100
+
+# budgets in seconds, about three times the runs measured on a development machine
+# (pull 0.4/3.9/69 s, push 0.4/4.2/31 s), so that regressions of a few times are caught
+BUDGETS = {
+    100: {'pull': 1.5, 'push': 1.5},
+    1000: {'pull': 12, 'push': 12},
+    10000: {'pull': 200, 'push': 100},
+}
+BUDGET_DBT_INDEX_BYTES_PER_TABLE = 6000
+
+
+def run_timed(results, name, fake, function, *args, **kwargs):
+    fake.requests.clear()
+    start = time.perf_counter()
+    result = function(fake, *args, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    results[name] = elapsed
+    print(f"{name}: {elapsed:.2f} s, {len(fake.requests)} requests")
+    return result, fake.count_requests()
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('size', sorted(BUDGETS))
+def test_benchmark(size, tmp_path):
+    write_dbt_project(tmp_path, n_models=size)
+    results = {}
+
+    with FakeSuperset(n_dashboards=size, n_datasets=size, max_page_size=MAX_PAGE_SIZE) as fake:
+        dashboards_published = sum(d['published'] for d in fake.dashboards.values())
+        datasets_physical = sum(d['kind'] == 'physical' for d in fake.datasets.values())
+        pages = math.ceil(size / MAX_PAGE_SIZE)
+
+        exposures, requests = run_timed(results, f'pull {size}', fake, pull, tmp_path)
+        assert len(exposures) == dashboards_published
+        assert requests['GET /dashboard/'] <= pages + 1
+        assert requests['GET /dashboard/{id}'] == dashboards_published
+        assert requests['GET /dashboard/{id}/datasets'] == dashboards_published
+        assert requests['GET /dataset/{id}'] == 0
+
+        _, requests = run_timed(results, f'push {size}', fake, push, tmp_path)
+        assert requests['GET /dataset/'] <= pages + 1
+        assert requests['GET /dataset/{id}'] == datasets_physical
+        assert requests['PUT /dataset/{id}'] == datasets_physical
+
+        # descriptions are already in Superset, nothing is updated
+        _, requests = run_timed(results, f'push {size} bulk', fake, push, tmp_path,
+                                superset_bulk_read=True, superset_bulk_write=True)
+        assert requests['GET /dataset/export/'] == math.ceil(datasets_physical / 100)
+        assert requests['GET /dataset/{id}'] == requests['PUT /dataset/{id}'] == 0
+        assert requests['POST /dataset/import/'] == 0
+
+    assert results[f'pull {size}'] < BUDGETS[size]['pull']
+    assert results[f'push {size}'] < BUDGETS[size]['push']
+
+
+@pytest.mark.benchmark
+def test_benchmark_dbt_index_memory(tmp_path):
+    write_dbt_project(tmp_path, n_models=10000, columns_per_table=10)
+    load_dbt_index(tmp_path)  # built and persisted, the rest of the runs load it
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    tables = get_tables_from_dbt(load_dbt_index(tmp_path), None)
+    elapsed = time.perf_counter() - start
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"dbt index 10000: {elapsed:.2f} s, {size / len(tables):.0f} B per table, peak {peak / 1e6:.0f} MB")
+    # mostly descriptions of tables and their columns, about 5.2 kB per table as compact records
+    assert size / len(tables) < BUDGET_DBT_INDEX_BYTES_PER_TABLE
@@ -0,0 +1,39 @@
+import ruamel.yaml
+
+from dbt_superset_lineage.pull_dashboards import main as pull_dashboards_main
+from dbt_superset_lineage.push_descriptions import main as push_descriptions_main
+from dbt_superset_lineage.sync import main as sync_main
+
+EXPOSURES_PATH = '/models/exposures/superset_dashboards.yml'
+
+
+def load_exposures(dbt_project_dir, exposures_path=EXPOSURES_PATH):
+    with open(f'{dbt_project_dir}{exposures_path}') as f:
+        return ruamel.yaml.YAML(typ='safe').load(f)['exposures']
+
+
+def pull(fake, dbt_project_dir, max_workers=8, exposures_path=EXPOSURES_PATH, **kwargs):
+    """Pulls dashboards from ``fake`` into the dbt project, returning the exposures pulled."""
+
+    pull_dashboards_main(str(dbt_project_dir), exposures_path, None,
+                         fake.url, None, 'ansi', None, 'refresh',
+                         max_workers=max_workers, sql_cache=False, **kwargs)
+
+    return load_exposures(dbt_project_dir, exposures_path)
+
+
+def push(fake, dbt_project_dir, max_workers=8, **kwargs):
+    """Pushes descriptions of the dbt project to ``fake``."""
+
+    push_descriptions_main(str(dbt_project_dir), None, fake.url, None, False, None, None, 'refresh',
+                           max_workers=max_workers, **kwargs)
+
+
+def sync(fake, dbt_project_dir, max_workers=8, **kwargs):
+    """Syncs the dbt project with ``fake``, returning the exposures pulled."""
+
+    sync_main(str(dbt_project_dir), EXPOSURES_PATH, None,
+              fake.url, None, 'ansi', False, None, 'refresh',
+              max_workers=max_workers, sql_cache=False, **kwargs)
+
+    return load_exposures(dbt_project_dir)
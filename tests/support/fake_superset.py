@@ -0,0 +1,415 @@
+import base64
+import email
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+import zipfile
+
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import ruamel.yaml
+
+from .manifest_generator import get_table_name
+
+
+# users owning datasets, all requests are made by the API user
+USERS = {
+    1: {'id': 1, 'first_name': 'Jane', 'last_name': 'Doe'},
+    2: {'id': 2, 'first_name': 'API', 'last_name': 'User'},
+}
+API_USER_ID = 2
+
+
+def make_token(lifetime=None):
+    """Returns an unsigned JWT expiring in ``lifetime`` seconds, or without expiration if None."""
+
+    claims = {'nonce': random.random()}
+    if lifetime is not None:
+        claims['exp'] = time.time() + lifetime
+    payload = json.dumps(claims).encode()
+    return 'header.' + base64.urlsafe_b64encode(payload).decode().rstrip('=') + '.signature'
+
+
+class FakeSuperset:
+    """An in-process stand-in for the Superset API serving synthetic dashboards and datasets.
+
+    Implements the endpoints used by ``dbt_superset_lineage``: listing and details of dashboards
+    and datasets, listing of charts, datasets of dashboards, refresh of columns, updates, export,
+    import and refresh of the access token. Datasets are built on tables from ``manifest_generator``,
+    every third one on custom SQL. Dashboards show their datasets through one chart per dataset.
+    Datasets are owned by another user than the one of the API, who becomes their owner by importing them.
+    """
+
+    def __init__(self, n_dashboards=100, n_datasets=100, datasets_per_dashboard=3, columns_per_dataset=5,
+                 latency=0.0, max_page_size=100, error_rate=0.0, token_lifetime=None, token_exp_claim=True,
+                 token_max_requests=None, seed=0):
+        """Instantiates the class.
+
+        Args:
+            n_dashboards: Number of dashboards, every fourth of them unpublished.
+            n_datasets: Number of datasets, all in a single database.
+            datasets_per_dashboard: Number of datasets on each dashboard.
+            columns_per_dataset: Number of columns of each dataset.
+            latency: Number of seconds each response is delayed by.
+            max_page_size: Maximum number of objects in a listed page, as FAB_API_MAX_PAGE_SIZE.
+            error_rate: Share of GET and PUT requests failing with 503 Service Unavailable, i.e.
+                of the requests retried by the client.
+            token_lifetime: Number of seconds access tokens are valid for, requests with expired
+                tokens failing with 401 Unauthorized. If None, any token is accepted forever.
+            token_exp_claim: Whether access tokens tell their expiration. If False, the client only
+                learns about it from 401 responses.
+            token_max_requests: Number of requests access tokens are valid for, so that they
+                expire at the same point of every run. If None, the number is not limited.
+            seed: Seed of the random generator of the data and errors.
+        """
+
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.error_rate = error_rate
+        self.token_lifetime = token_lifetime
+        self.token_exp_claim = token_exp_claim
+        self.token_max_requests = token_max_requests
+
+        self.requests = []
+        self.tokens = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.datasets = {}
+        for i in range(1, n_datasets + 1):
+            schema, table_name = get_table_name(i)
+            virtual = i % 3 == 0
+            self.datasets[i] = {
+                'id': i,
+                'table_name': f'virtual_{i}' if virtual else table_name,
+                'schema': schema,
+                'kind': 'virtual' if virtual else 'physical',
+                'sql': ('select a.*, b.id as other_id from {}.{} a join {}.{} b on a.id = b.id'
+                        .format(*get_table_name(i), *get_table_name(i % n_datasets + 1)) if virtual else None),
+                'description': None,
+                'changed_on_utc': '2024-01-01T00:00:00.000000+0000',
+                'database': {'id': 1, 'database_name': 'warehouse'},
+                'owners': [dict(USERS[1])],
+                'columns': [{
+                    'id': i * 1000 + c,
+                    'column_name': f'column_{c}',
+                    'expression': None if c else 'id * 2',
+                    'description': None,
+                    'filterable': True,
+                    'groupby': True
+                } for c in range(columns_per_dataset)]
+            }
+
+        self.dashboards = {}
+        self.charts = {}
+        self.dashboards_charts = {}  # IDs of charts on every dashboard, as scanning all charts per request is quadratic
+        datasets_ids = sorted(self.datasets)
+        for i in range(1, n_dashboards + 1):
+            self.dashboards[i] = {
+                'id': i,
+                'dashboard_title': f'Dashboard {i}',
+                'published': i % 4 != 0,
+                'changed_on_utc': '2024-01-01T00:00:00.000000+0000',
+                'owners': [{'first_name': 'Jane', 'last_name': f'Doe {i}'}]
+            }
+            for dataset_id in self._random.sample(datasets_ids, min(datasets_per_dashboard, n_datasets)):
+                chart_id = len(self.charts) + 1
+                self.charts[chart_id] = {
+                    'id': chart_id,
+                    'slice_name': f'Chart {chart_id}',
+                    'datasource_id': dataset_id,
+                    'changed_on_utc': '2024-01-01T00:00:00.000000+0000',
+                    'dashboards': [{'id': i}]
+                }
+                self.dashboards_charts.setdefault(i, []).append(chart_id)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def issue_token(self):
+        """Returns a new access token, valid for ``token_lifetime`` seconds."""
+
+        token = make_token(self.token_lifetime if self.token_exp_claim else None)
+        with self._lock:
+            self.tokens[token] = {
+                'expiration': time.time() + self.token_lifetime if self.token_lifetime else None,
+                'requests': 0
+            }
+        return token
+
+    def get_dashboard_datasets(self, dashboard_id):
+        """Returns IDs of datasets of the charts on a dashboard, in the order of the charts."""
+
+        return list(dict.fromkeys(self.charts[chart_id]['datasource_id']
+                                  for chart_id in self.dashboards_charts.get(dashboard_id, [])))
+
+    def repoint_chart(self, chart_id, dataset_id):
+        """Points a chart to another dataset, which changes the chart but not its dashboards, as in Superset.
+
+        The chart stays on its dashboards, so that ``dashboards_charts`` does not change.
+        """
+
+        with self._lock:
+            self.charts[chart_id]['datasource_id'] = dataset_id
+            self.charts[chart_id]['changed_on_utc'] = get_changed_on()
+
+    def repoint_dataset(self, dataset_id, schema, table_name):
+        """Points a physical dataset to another table, which changes the dataset but not its dashboards."""
+
+        with self._lock:
+            self.datasets[dataset_id]['schema'] = schema
+            self.datasets[dataset_id]['table_name'] = table_name
+            self.datasets[dataset_id]['changed_on_utc'] = get_changed_on()
+
+    def count_requests(self):
+        """Returns numbers of requests by method and endpoint, IDs replaced by ``{id}``."""
+
+        return Counter(f"{method} {re.sub(r'/[0-9]+', '/{id}', path)}" for method, path in self.requests)
+
+    def _check(self, method, path, authorization):
+        """Returns an error response for the request, if any."""
+
+        with self._lock:
+            self.requests.append((method, path))
+            if self.error_rate and method in ('GET', 'PUT') and self._random.random() < self.error_rate:
+                return 503, {'message': 'Service Unavailable'}
+
+            token = self.tokens.get((authorization or '').removeprefix('Bearer '))
+            if token is not None and path != '/security/refresh':
+                token['requests'] += 1
+                if token['expiration'] is not None and token['expiration'] < time.time() \
+                        or self.token_max_requests is not None and token['requests'] > self.token_max_requests:
+                    return 401, {'msg': 'Token has expired'}
+
+        return None
+
+    def _list(self, objects, query):
+        for item in query.get('filters', []):
+            if item['col'] == 'published' and item['opr'] == 'eq':
+                objects = [o for o in objects if o['published'] == item['value']]
+            elif item['col'] == 'sql' and item['opr'] == 'dataset_is_null_or_empty':
+                objects = [o for o in objects if (not o['sql']) == item['value']]
+            elif item['col'] == 'database' and item['opr'] == 'rel_o_m':
+                objects = [o for o in objects if o['database']['id'] == item['value']]
+
+        page_size = min(query.get('page_size', 25), self.max_page_size)
+        page = query.get('page', 0)
+        result = objects[page * page_size:(page + 1) * page_size]
+
+        if 'columns' in query:
+            result = [project(o, query['columns']) for o in result]
+
+        return {'count': len(objects), 'ids': [o['id'] for o in result], 'result': result}
+
+    def get(self, path, query):
+        if path == '/dashboard/':
+            return 200, self._list(list(self.dashboards.values()), query)
+
+        if path == '/dataset/':
+            return 200, self._list(list(self.datasets.values()), query)
+
+        if path == '/chart/':
+            return 200, self._list(list(self.charts.values()), query)
+
+        if path == '/me/':
+            return 200, {'result': {'id': API_USER_ID, 'username': 'api'}}
+
+        if path == '/dataset/export/':
+            return 200, self._export([int(i) for i in query.strip('!()').split(',') if i])
+
+        match = re.fullmatch(r'/dashboard/([0-9]+)(/datasets)?', path)
+        if match and int(match[1]) in self.dashboards:
+            dashboard = self.dashboards[int(match[1])]
+            if not match[2]:
+                return 200, {'id': dashboard['id'], 'result': dashboard}
+
+            return 200, {'result': [{
+                'id': dataset['id'],
+                'table_name': dataset['table_name'],
+                'schema': dataset['schema'],
+                'kind': dataset['kind'],
+                'sql': dataset['sql'],
+                'database': {'id': dataset['database']['id'], 'name': dataset['database']['database_name']}
+            } for dataset in (self.datasets[i] for i in self.get_dashboard_datasets(dashboard['id']))]}
+
+        match = re.fullmatch(r'/dataset/([0-9]+)', path)
+        if match and int(match[1]) in self.datasets:
+            return 200, {'id': int(match[1]), 'result': self.datasets[int(match[1])]}
+
+        return 404, {'message': 'Not found'}
+
+    def put(self, path, body):
+        match = re.fullmatch(r'/dataset/([0-9]+)(/refresh)?', path)
+        if not match or int(match[1]) not in self.datasets:
+            return 404, {'message': 'Not found'}
+
+        dataset = self.datasets[int(match[1])]
+        if not match[2]:
+            with self._lock:
+                if 'description' in body:
+                    dataset['description'] = body['description']
+                descriptions = {column['id']: column['description'] for column in body.get('columns', [])}
+                for column in dataset['columns']:
+                    column['description'] = descriptions.get(column['id'], column['description'])
+                if 'owners' in body:
+                    dataset['owners'] = [dict(USERS[owner_id]) for owner_id in body['owners']]
+                dataset['changed_on_utc'] = get_changed_on()
+
+        return 200, {'id': dataset['id'], 'result': {}}
+
+    def post(self, path, content_type, body):
+        if path == '/security/refresh':
+            return 200, {'access_token': self.issue_token()}
+
+        if path == '/dataset/import/':
+            message = email.message_from_bytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+            form = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                    for part in message.get_payload()}
+            self._import(form['formData'], overwrite=form.get('overwrite') == b'true')
+            return 200, {'message': 'OK'}
+
+        return 404, {'message': 'Not found'}
+
+    def _export(self, ids):
+        # JSON is valid YAML and much faster to dump than YAML, keeping the fake out of the timings
+        content = io.BytesIO()
+        with zipfile.ZipFile(content, 'w') as zip_file:
+            zip_file.writestr('dataset_export/metadata.yaml', 'version: 1.0.0\ntype: SqlaTable\n')
+            zip_file.writestr('dataset_export/databases/warehouse.yaml', 'database_name: warehouse\nuuid: db-1\n')
+            for i in ids:
+                dataset = self.datasets[i]
+                zip_file.writestr(f"dataset_export/datasets/warehouse/{dataset['table_name']}.yaml", json.dumps({
+                    'table_name': dataset['table_name'],
+                    'schema': dataset['schema'],
+                    'sql': dataset['sql'],
+                    'description': dataset['description'],
+                    'uuid': f'dataset-{i}',
+                    'database_uuid': 'db-1',
+                    'columns': [{k: v for k, v in column.items() if k != 'id'} for column in dataset['columns']]
+                }))
+
+        return content.getvalue()
+
+    def _import(self, content, overwrite):
+        assert overwrite, "Existing datasets are only updated with overwrite."
+
+        yaml = ruamel.yaml.YAML(typ='safe')
+        with zipfile.ZipFile(io.BytesIO(content)) as zip_file:
+            for file_name in zip_file.namelist():
+                if '/datasets/' not in file_name:
+                    continue
+
+                config = yaml.load(zip_file.read(file_name))
+                dataset = self.datasets[int(config['uuid'].split('-')[1])]
+                with self._lock:
+                    dataset['description'] = config['description']
+                    descriptions = {column['column_name']: column['description'] for column in config['columns']}
+                    for column in dataset['columns']:
+                        column['description'] = descriptions.get(column['column_name'], column['description'])
+                    # as in Superset, the importing user becomes an owner
+                    if API_USER_ID not in [owner['id'] for owner in dataset['owners']]:
+                        dataset['owners'].append(dict(USERS[API_USER_ID]))
+                    dataset['changed_on_utc'] = get_changed_on()
+
+
+def get_changed_on():
+    """Returns the current time as Superset formats ``changed_on_utc``."""
+
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f%z')
+
+
+def project(obj, columns):
+    """Keeps only ``columns`` of ``obj``, related fields written as e.g. ``database.id``."""
+
+    result = {}
+    for column in columns:
+        if '.' in column:
+            relation, field = column.split('.', 1)
+            if isinstance(obj[relation], list):  # e.g. dashboards of a chart
+                related = result.setdefault(relation, [{} for _ in obj[relation]])
+                for related_obj, obj_related in zip(related, obj[relation]):
+                    related_obj[field] = obj_related[field]
+            else:
+                result.setdefault(relation, {})[field] = obj[relation][field]
+        else:
+            result[column] = obj[column]
+    return result
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep connections alive as Superset behind a proxy does
+
+        def log_message(self, *args):
+            pass
+
+        def _respond(self, method, handle):
+            url = urlparse(self.path)
+            path = url.path.removeprefix('/api/v1')
+            error = fake._check(method, path, self.headers.get('Authorization'))
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            time.sleep(fake.latency)
+            status, result = error or handle(path, url, body)
+
+            if isinstance(result, bytes):
+                content, content_type = result, 'application/zip'
+            else:
+                content, content_type = json.dumps(result).encode(), 'application/json'
+
+            # Superset sends ETags of dashboards and their datasets and honors If-None-Match on them
+            etag = None
+            if method == 'GET' and status == 200 and re.fullmatch(r'/dashboard/[0-9]+(/datasets)?', path):
+                etag = '"' + hashlib.md5(content).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    status, content = 304, b''
+
+            # send headers and content at once, separate writes stall on delayed ACKs
+            self.send_response(status)
+            if etag is not None:
+                self.send_header('ETag', etag)
+            if status != 304:
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(content)))
+            self._headers_buffer.append(b'\r\n' + content)
+            self.flush_headers()
+
+        def do_GET(self):
+            self._respond('GET', lambda path, url, body: fake.get(
+                path, json.loads(parse_qs(url.query).get('q', ['{}'])[0])
+                if not path.endswith('/export/') else parse_qs(url.query)['q'][0]))
+
+        def do_PUT(self):
+            self._respond('PUT', lambda path, url, body: fake.put(path, json.loads(body) if body else None))
+
+        def do_POST(self):
+            self._respond('POST', lambda path, url, body: fake.post(path, self.headers.get('Content-Type'), body))
+
+    return Handler
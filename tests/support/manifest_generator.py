@@ -0,0 +1,79 @@
+import json
+import random
+
+from pathlib import Path
+
+N_SCHEMAS = 10
+
+
+def get_table_name(i):
+    """Returns the schema and name of the ``i``-th synthetic table, shared by the manifest and the fake Superset."""
+
+    return f'analytics_{i % N_SCHEMAS}', f'model_{i}'
+
+
+def generate_manifest(n_models, n_sources=0, columns_per_table=5, database='warehouse', seed=0):
+    """Generates a dbt ``manifest.json`` with ``n_models`` models and ``n_sources`` sources.
+
+    Descriptions are Markdown of varied length so that converting them to plain text costs
+    about as much as in a real project.
+
+    Returns:
+        The manifest as a dictionary.
+    """
+
+    rng = random.Random(seed)
+
+    def get_description(name):
+        paragraphs = [f'**{name}** holds one row per `id`, see [docs](https://docs.example.com/{name}).']
+        paragraphs += ['Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * rng.randint(1, 5)
+                       for _ in range(rng.randint(0, 3))]
+        if rng.random() < 0.3:
+            paragraphs.append('- first\n- second\n- third')
+        return '\n\n'.join(paragraphs)
+
+    def get_table(resource_type, unique_id, i):
+        schema, name = get_table_name(i)
+        return {
+            'resource_type': resource_type,
+            'unique_id': unique_id,
+            'name': name,
+            'schema': schema,
+            'database': database,
+            'description': get_description(name),
+            'columns': {
+                f'column_{c}': {'name': f'column_{c}', 'description': get_description(f'column_{c}'), 'meta': {}}
+                for c in range(columns_per_table)
+            },
+            'config': {'materialized': 'table'},
+            'depends_on': {'nodes': []}
+        }
+
+    nodes = {}
+    for i in range(1, n_models + 1):
+        unique_id = f'model.synthetic.{get_table_name(i)[1]}'
+        nodes[unique_id] = get_table('model', unique_id, i)
+
+    sources = {}
+    for i in range(n_models + 1, n_models + n_sources + 1):
+        unique_id = f'source.synthetic.raw.{get_table_name(i)[1]}'
+        sources[unique_id] = get_table('source', unique_id, i)
+
+    return {
+        'metadata': {'dbt_schema_version': 'https://schemas.getdbt.com/dbt/manifest/v11.json'},
+        'nodes': nodes,
+        'sources': sources,
+        'macros': {},
+        'exposures': {}
+    }
+
+
+def write_dbt_project(dbt_project_dir, n_models, **kwargs):
+    """Writes a synthetic ``target/manifest.json`` into ``dbt_project_dir``, see ``generate_manifest``."""
+
+    manifest_path = Path(dbt_project_dir) / 'target' / 'manifest.json'
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump(generate_manifest(n_models, **kwargs), f)
+
+    return manifest_path
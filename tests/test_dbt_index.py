@@ -0,0 +1,63 @@
+import dataclasses
+import json
+import os
+
+from dbt_superset_lineage.dbt_index import get_tables_changed, get_tables_from_dbt, load_dbt_index
+
+
+def write_manifest(dbt_project_dir, description):
+    (dbt_project_dir / 'target').mkdir(exist_ok=True)
+    (dbt_project_dir / 'target' / 'manifest.json').write_text(json.dumps({
+        'nodes': {
+            'model.jaffle_shop.orders': {
+                'name': 'orders', 'schema': 'analytics', 'database': 'dwh',
+                'unique_id': 'model.jaffle_shop.orders', 'description': description,
+                'columns': {'id': {'name': 'id', 'description': 'Primary key'}},
+            },
+        },
+        'sources': {
+            'source.jaffle_shop.raw.payments': {
+                'name': 'payments', 'schema': 'raw', 'database': 'dwh',
+                'unique_id': 'source.jaffle_shop.raw.payments', 'description': '', 'columns': {},
+            },
+        },
+    }))
+
+
+def test_load_dbt_index(tmp_path):
+    write_manifest(tmp_path, 'Orders')
+    tables = get_tables_from_dbt(load_dbt_index(tmp_path), None)
+
+    assert tables['analytics.orders'].ref == "ref('orders')"
+    assert tables['analytics.orders'].columns == {'id': 'Primary key'}
+    assert tables['raw.payments'].ref == "source('raw', 'payments')"
+
+    # the persisted index is read back the same
+    assert get_tables_from_dbt(load_dbt_index(tmp_path), None) == tables
+
+
+def test_load_dbt_index_fingerprint(tmp_path):
+    index_path = tmp_path / 'target' / 'dbt_superset_lineage' / 'dbt_index.json'
+    write_manifest(tmp_path, 'Orders')
+    load_dbt_index(tmp_path)
+
+    # only touched manifest is recognized by its content
+    os.utime(tmp_path / 'target' / 'manifest.json', ns=(0, 0))
+    assert load_dbt_index(tmp_path)[0].description == 'Orders'
+    assert json.loads(index_path.read_text())['fingerprint']['mtime_ns'] == 0
+
+    # changed manifest of the same size results in a rebuild
+    write_manifest(tmp_path, 'Sales')
+    assert load_dbt_index(tmp_path)[0].description == 'Sales'
+
+
+def test_get_tables_changed(tmp_path):
+    write_manifest(tmp_path, 'Orders')
+    tables_previous = get_tables_from_dbt(load_dbt_index(tmp_path), None)
+    assert get_tables_changed(tables_previous, tables_previous) == set()
+
+    write_manifest(tmp_path, 'Sales')
+    tables = get_tables_from_dbt(load_dbt_index(tmp_path), None)
+    tables['raw.payments'].columns = {'id': 'Payment ID'}
+    tables['raw.refunds'] = dataclasses.replace(tables['raw.payments'], name='refunds')
+    assert get_tables_changed(tables, tables_previous) == {'analytics.orders', 'raw.payments', 'raw.refunds'}
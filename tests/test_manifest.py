@@ -0,0 +1,70 @@
+import io
+import json
+
+import pytest
+
+from dbt_superset_lineage.manifest import JsonStream, load_manifest
+
+MANIFEST = {
+    'metadata': {'dbt_version': '1.7.0', 'nested': [1, 2.5, -3e-7, None, True, {'a': 'b'}]},
+    'nodes': {
+        'model.jaffle_shop.orders': {
+            'name': 'orders',
+            'schema': 'analytics',
+            'database': 'dwh',
+            'unique_id': 'model.jaffle_shop.orders',
+            'description': 'Orders → "placed" by customers\n',
+            'columns': {
+                'id': {'name': 'id', 'description': 'Primary key', 'meta': {}},
+                'amount': {'name': 'amount', 'meta': {}},
+            },
+            'compiled_code': 'select 1.5 as amount',
+        },
+    },
+    'sources': {
+        'source.jaffle_shop.raw.payments': {
+            'name': 'payments',
+            'schema': 'raw',
+            'database': 'dwh',
+            'unique_id': 'source.jaffle_shop.raw.payments',
+            'description': '',
+            'columns': {},
+        },
+    },
+    'macros': {'macro.dbt.run': {'macro_sql': '{% macro run() %}{% endmacro %}'}},
+    'docs': [],
+}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 1 << 20])
+def test_json_stream(chunk_size):
+    stream = JsonStream(io.StringIO(json.dumps(MANIFEST, indent=2)), chunk_size=chunk_size)
+
+    decoded = {}
+    for key in stream.iter_object():
+        if key == 'macros':
+            stream.skip()
+        else:
+            decoded[key] = stream.decode()
+
+    assert decoded == {key: value for key, value in MANIFEST.items() if key != 'macros'}
+
+
+def test_load_manifest(tmp_path):
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps(MANIFEST), encoding='utf-8')
+
+    manifest = load_manifest(path, fields=['name', 'description', 'columns'])
+
+    assert manifest == {
+        'nodes': {
+            'model.jaffle_shop.orders': {
+                'name': 'orders',
+                'description': 'Orders → "placed" by customers\n',
+                'columns': {'id': {'description': 'Primary key'}, 'amount': {}},
+            },
+        },
+        'sources': {
+            'source.jaffle_shop.raw.payments': {'name': 'payments', 'description': '', 'columns': {}},
+        },
+    }
@@ -0,0 +1,33 @@
+import pytest
+
+from dbt_superset_lineage.merge_exposures import merge_exposures
+
+
+def make_exposure(dashboard_id, description=''):
+    return {
+        'name': f'dashboard_{dashboard_id}',
+        'label': f'Dashboard {dashboard_id}',
+        'type': 'dashboard',
+        'url': f'https://superset.example.com/superset/dashboard/{dashboard_id}',
+        'description': description,
+        'depends_on': ["ref('orders')"],
+        'owner': {'name': 'Jane Doe', 'email': ''}
+    }
+
+
+def test_merge_exposures():
+    exposures_partial = [[make_exposure(3), make_exposure(10, 'Pulled.')], [], [make_exposure(2, 'Pulled.')]]
+    exposures = [make_exposure(10, 'Kept.'), make_exposure(4, 'Removed.')]
+
+    # sorted by IDs of dashboards, not their URLs, with descriptions only kept from the existing file
+    assert merge_exposures(exposures_partial, exposures) == [
+        make_exposure(2), make_exposure(3), make_exposure(10, 'Kept.')
+    ]
+
+
+def test_merge_exposures_fails_on_overlapping_shards():
+    with pytest.raises(AssertionError, match='more than one shard'):
+        merge_exposures([[make_exposure(1)], [make_exposure(1)]], [])
+
+    with pytest.raises(AssertionError, match='duplicate dashboard names'):
+        merge_exposures([[make_exposure(1)], [{**make_exposure(2), 'label': 'Dashboard 1'}]], [])
@@ -0,0 +1,67 @@
+import json
+
+from dbt_superset_lineage.metrics import Metrics, get_endpoint_name, get_percentile
+
+
+class Retry:
+    def __init__(self, history):
+        self.history = history
+
+
+class Raw:
+    def __init__(self, retries):
+        self.retries = retries
+
+
+class Response:
+    def __init__(self, status_code, content, retries=0):
+        self.status_code = status_code
+        self.content = content
+        self.raw = Raw(Retry(('503',) * retries))
+
+
+def test_get_endpoint_name():
+    assert get_endpoint_name('GET', '/dataset/42') == 'GET /dataset/{id}'
+    assert get_endpoint_name('GET', '/dashboard/7/datasets') == 'GET /dashboard/{id}/datasets'
+    assert get_endpoint_name('POST', '/security/refresh') == 'POST /security/refresh'
+
+
+def test_get_percentile():
+    values = [float(v) for v in range(1, 101)]
+    assert get_percentile(values, 50) == 50
+    assert get_percentile(values, 99) == 99
+    assert get_percentile([3.0], 90) == 3
+    assert get_percentile([], 50) is None
+
+
+def test_metrics_report(tmp_path):
+    metrics = Metrics('pull-dashboards')
+    with metrics.phase('dashboard_details'):
+        metrics.record_request('GET', '/dashboard/1', Response(200, b'{}'), 0.1)
+        metrics.record_request('GET', '/dashboard/2', Response(200, b'{"a": 1}', retries=2), 0.3)
+        metrics.record_request('GET', '/dashboard/3', Response(404, b''), 0.2)
+    metrics.record_request('POST', '/security/refresh', Response(200, b'{}'), 0.05)
+    with metrics.phase('sql_parse'):
+        metrics.count('sql_queries_parsed_sqlfluff', 2)
+        metrics.add_time('sql_parse_sqlfluff', 1.5)
+    with metrics.phase('sql_parse'):
+        pass
+
+    metrics.write_json(tmp_path / 'metrics.json')
+    with open(tmp_path / 'metrics.json') as f:
+        report = json.load(f)
+
+    assert report['command'] == 'pull-dashboards'
+    assert list(report['phases_seconds']) == ['dashboard_details', 'sql_parse']
+    assert report['requests']['GET /dashboard/{id}'] == {
+        'count': 3,
+        'errors': 1,
+        'retries': 2,
+        'bytes': 10,
+        'latency_seconds': {'p50': 0.2, 'p90': 0.3, 'p99': 0.3, 'max': 0.3}
+    }
+    assert report['requests_total'] == {'count': 4, 'errors': 1, 'retries': 2, 'bytes': 12}
+    assert report['token_refreshes'] == 1
+    assert report['counters'] == {'sql_queries_parsed_sqlfluff': 2}
+    assert report['timings_seconds'] == {'sql_parse_sqlfluff': 1.5}
+    assert report['wall_seconds'] >= sum(report['phases_seconds'].values())
@@ -0,0 +1,384 @@
+import json
+import math
+
+from concurrent.futures import Future
+
+import pytest
+
+from dbt_superset_lineage.metrics import Metrics
+from dbt_superset_lineage.pull_dashboards import (SQL_PENDING_PER_WORKER, SqlTablesExtractor,
+                                                  get_dashboards_from_superset, get_dashboards_listed,
+                                                  get_datasets_changed_on_from_superset, get_datasets_from_superset,
+                                                  get_tables_from_sql, get_tables_from_sql_fast,
+                                                  get_tables_from_sql_fluff)
+from dbt_superset_lineage.records import DbtTable
+from dbt_superset_lineage.sql_cache import SqlTablesCache
+from dbt_superset_lineage.superset_api import Superset
+
+from .support.commands import pull
+from .support.fake_superset import FakeSuperset
+from .support.manifest_generator import get_table_name, write_dbt_project
+
+# queries as they are typically found in virtual datasets
+SQL_CORPUS = [
+    "select * from analytics.orders",
+    "SELECT id, name FROM analytics.customers;",
+    "select o.id, c.name from analytics.orders o join analytics.customers c on o.customer_id = c.id",
+    "select o.id, c.name\n"
+    "from analytics.orders as o\n"
+    "left join analytics.customers as c\n"
+    "    on o.customer_id = c.id\n"
+    "where o.status = 'shipped'",
+    "select count(*) as cnt, date_trunc('month', created_at) as month\n"
+    "from staging.events\n"
+    "group by 2\n"
+    "order by 2 desc\n"
+    "limit 100",
+    "select e.*, u.email from staging.events e inner join staging.users u using (user_id)",
+    "select a.x, b.y, c.z from s.a a left outer join s.b b on a.id = b.id and b.valid "
+    "right join s.c c on c.id = a.id",
+    "select a.x from s.a a cross join s.b",
+    "select a.x, b.y from s.a a, s.b b where a.id = b.id",
+    "select * from warehouse.analytics.orders",
+    "select * from orders",
+    "select * from analytics.orders o join customers c on o.cid = c.id",
+    "-- daily revenue\nselect day, sum(amount) as revenue /* gross */ from finance.payments group by day",
+    "select case when status = 'paid' then 1 else 0 end as is_paid, coalesce(amount, 0) "
+    "from finance.invoices where created_at >= '2021-01-01'",
+    "select id, amount::numeric(10, 2) as amount from finance.invoices",
+    "select extract(year from created_at) as yr, count(distinct user_id) from product.sessions "
+    "group by 1 having count(*) > 10",
+    "select user_id, row_number() over (partition by user_id order by ts desc) as rn from product.sessions",
+    "select * from analytics.orders where id in (1, 2, 3) and note like '%it''s%'",
+    "with recent as (select * from analytics.orders where created_at > current_date - 7) "
+    "select * from recent join analytics.customers c on recent.cid = c.id",
+    "select * from (select id from analytics.orders) sub",
+    "select id from analytics.orders union all select id from archive.orders",
+    "select * from analytics.orders where customer_id in (select id from analytics.customers where vip)",
+    "select o.id from analytics.orders o where exists (select 1 from analytics.refunds r where r.order_id = o.id)",
+    'select * from "analytics"."Orders"',
+    'select "Order ID", amount from analytics.orders',
+    'select * from analytics."Orders" o join "staging".users u on o.uid = u.id',
+    "select a.id from s.a a natural join s.b",
+    "select a.id from s.a a full outer join s.b b on a.id = b.id where a.id is not null "
+    "order by a.id limit 10 offset 5",
+    "select left(name, 3) from s.people",
+    "select * from s.a a join s.b b on left(a.code, 2) = b.prefix",
+    "select 1",
+    "select current_date",
+    "select * from generate_series(1, 10)",
+    "select t.* from analytics.orders t",
+    "select analytics.orders.id from analytics.orders",
+    "select sum(x) filter (where y > 0) from s.t",
+    "select distinct country from geo.cities order by country",
+    "select * from s.t where name ilike 'a%'",
+    "select * from s.t t where t.x between 1 and 10",
+    "select a, b from s.t group by a, b",
+]
+
+
+# tables extracted from ``SQL_CORPUS`` in ansi before the fast path, frozen so that changes of the output are caught
+SQL_CORPUS_TABLES_BASELINE = [
+    ['analytics.orders'], ['analytics.customers'], ['analytics.customers', 'analytics.orders'],
+    ['analytics.customers', 'analytics.orders'], ['staging.events'], ['staging.events', 'staging.users'],
+    ['s.a', 's.b', 's.c'], ['s.a', 's.b'], ['s.a', 's.b'], ['warehouse.analytics.orders'], [], ['analytics.orders'],
+    ['finance.payments'], ['finance.invoices'], ['finance.invoices'], ['product.sessions'], ['product.sessions'],
+    ['analytics.orders'], ['analytics.customers', 'analytics.orders'], ['analytics.orders'],
+    ['analytics.orders', 'archive.orders'], ['analytics.customers', 'analytics.orders'],
+    ['analytics.orders', 'analytics.refunds'], [], ['analytics.orders'], [], ['s.a', 's.b'], ['s.a', 's.b'],
+    ['s.people'], ['s.a', 's.b'], [], [], [], ['analytics.orders'], ['analytics.orders'], ['s.t'], ['geo.cities'],
+    ['s.t'], ['s.t'], ['s.t'],
+]
+
+# intended changes of the output: tables named by quoted identifiers were dropped
+SQL_CORPUS_TABLES_CHANGED = {
+    'select * from "analytics"."Orders"': ['analytics.orders'],
+    'select * from analytics."Orders" o join "staging".users u on o.uid = u.id': ['analytics.orders', 'staging.users'],
+}
+
+
+@pytest.mark.parametrize('sql, tables_baseline', list(zip(SQL_CORPUS, SQL_CORPUS_TABLES_BASELINE)))
+def test_get_tables_from_sql_baseline(sql, tables_baseline):
+    assert sorted(get_tables_from_sql(sql, 'ansi')) == SQL_CORPUS_TABLES_CHANGED.get(sql, tables_baseline)
+
+
+def test_get_tables_from_sql_baseline_covers_corpus():
+    assert len(SQL_CORPUS_TABLES_BASELINE) == len(SQL_CORPUS)
+
+
+@pytest.mark.parametrize('sql, dialect, tables_baseline', [
+    # sqlfluff fails on these in the dialect and regular expressions take over, also for simple queries
+    ("select * from t limit 10", 'tsql', ['t']),
+    ("select * from t limit 10", 'ansi', []),
+    ("select top 10 * from s.t", 'tsql', ['s.t']),
+    ("select * from s.t limit 10", 'oracle', ['s.t']),
+    ("select extract(year from ts) from s.t limit 10", 'tsql', ['s.t', 'ts']),
+    # intended changes of the output: tables named by quoted identifiers were dropped
+    ("select * from [s].[t]", 'tsql', ['s.t']),
+    ("select * from `s`.`t`", 'bigquery', ['s.t']),
+])
+def test_get_tables_from_sql_baseline_in_dialects(sql, dialect, tables_baseline):
+    assert sorted(get_tables_from_sql(sql, dialect)) == tables_baseline
+
+
+@pytest.mark.parametrize('sql', SQL_CORPUS)
+def test_get_tables_from_sql_fast_parity(sql):
+    tables = get_tables_from_sql_fast(sql)
+    if tables is not None:
+        assert tables == get_tables_from_sql_fluff(sql, 'ansi')
+
+
+def test_get_tables_from_sql_fast_coverage():
+    # the common simple shapes must not need sqlfluff
+    assert sum(get_tables_from_sql_fast(sql) is not None for sql in SQL_CORPUS) >= 25
+
+
+@pytest.mark.parametrize('sql', [
+    "with a as (select * from s.t) select * from a",
+    "select * from (select * from s.t) a",
+    "select * from s.t union select * from s.u",
+    'select * from "s"."t"',
+    "select * from `s`.`t`",
+    "select * from [s].[t]",
+    "select * from s.t where x = '\\'' ",
+    "select * from {{ source }}",
+    "select * from generate_series(1, 10)",
+    "select * from s.t t(a, b)",
+    "select * from s.t for update",
+])
+def test_get_tables_from_sql_fast_gives_up(sql):
+    assert get_tables_from_sql_fast(sql) is None
+
+
+def test_get_tables_from_sql_fluff_quoted_identifiers():
+    sql = 'select * from "analytics"."Orders" o join staging."Users" u on o.uid = u.id'
+    assert get_tables_from_sql_fluff(sql, 'ansi') == {'analytics.orders', 'staging.users'}
+
+
+DBT_TABLE = DbtTable(name='orders', schema='analytics', database='dwh', type='node', ref="ref('orders')",
+                     description='', columns={})
+
+
+class SupersetDatasets:
+    """Stands in for ``Superset``, serving single datasets only."""
+
+    def __init__(self, datasets):
+        self.datasets = datasets
+        self.endpoints = []
+
+    def request(self, method, endpoint, **request_kwargs):
+        self.endpoints.append(endpoint)
+        return {'result': self.datasets[int(endpoint.split('/')[-1])]}
+
+
+def test_get_datasets_from_superset():
+    superset = SupersetDatasets({
+        2: {'table_name': 'orders_eur', 'schema': 'reports', 'kind': 'virtual',
+            'sql': 'select * from analytics.orders', 'database': {'id': 1, 'database_name': 'dwh'}},
+    })
+    dashboards_datasets = {
+        'analytics.orders': {'id': 1, 'name': 'orders', 'schema': 'analytics', 'database': 'dwh',
+                             'database_id': 1, 'kind': 'physical', 'sql': None},
+        # kind is missing, the dataset has to be requested
+        'reports.orders_eur': {'id': 2, 'name': 'orders_eur', 'schema': 'reports', 'database': 'dwh',
+                               'database_id': 1, 'kind': None, 'sql': None},
+    }
+    dbt_tables = {'analytics.orders': DBT_TABLE}
+
+    datasets = get_datasets_from_superset(superset, dashboards_datasets, dbt_tables, 'ansi', None,
+                                          parse_workers=1)
+
+    assert superset.endpoints == ['/dataset/2']
+    assert datasets['analytics.orders'].dbt_refs == ["ref('orders')"]
+    assert datasets['reports.orders_eur'].tables == ['analytics.orders']
+    assert datasets['reports.orders_eur'].dbt_refs == ["ref('orders')"]
+
+
+class ListingSession:
+    """Stands in for ``requests.Session``, keeping queries of listings and answering them with ``results``."""
+
+    def __init__(self, results):
+        self.results = results
+        self.queries = []
+
+    def request(self, method, url, headers, params):
+        self.queries.append((url, json.loads(params['q'])))
+        return Response({'count': len(self.results), 'result': self.results})
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+def test_listings_filter_and_project_in_superset():
+    superset = Superset('https://superset/api/v1', access_token='token')
+    superset.session = ListingSession([{'id': 1, 'published': True, 'changed_on_utc': '2024-01-01T00:00:00'}])
+
+    assert list(get_dashboards_listed(superset, superset_page_size=500)) == [(1, '2024-01-01T00:00:00', 1)]
+    assert get_datasets_changed_on_from_superset(superset, 3) == {1: '2024-01-01T00:00:00'}
+
+    # only published dashboards and datasets of the database are listed, with the fields used only
+    assert superset.session.queries == [
+        ('https://superset/api/v1/dashboard/', {
+            'filters': [{'col': 'published', 'opr': 'eq', 'value': True}],
+            'columns': ['id', 'published', 'changed_on_utc'],
+            'page': 0, 'page_size': 500
+        }),
+        ('https://superset/api/v1/dataset/', {
+            'filters': [{'col': 'database', 'opr': 'rel_o_m', 'value': 3}],
+            'columns': ['id', 'changed_on_utc'],
+            'page': 0, 'page_size': 1000
+        }),
+    ]
+
+
+class Snapshot:
+    """Stands in for ``SupersetSnapshot``."""
+
+    def __init__(self, datasets):
+        self.datasets = datasets
+
+    def get_datasets(self):
+        return self.datasets
+
+
+def test_get_datasets_from_superset_with_snapshot():
+    superset = SupersetDatasets({})
+    snapshot = Snapshot([
+        {'id': 2, 'table_name': 'orders_eur', 'schema': 'reports', 'kind': 'virtual',
+         'sql': 'select * from analytics.orders', 'changed_on_utc': '2024-01-02T00:00:00',
+         'database': {'id': 1, 'database_name': 'dwh'}},
+    ])
+    dashboards_datasets = {
+        # kind is missing, the dataset is taken from the snapshot
+        'reports.orders_eur': {'id': 2, 'name': 'orders_eur', 'schema': 'reports', 'database': 'dwh',
+                               'database_id': 1, 'kind': None, 'sql': None},
+    }
+    dbt_tables = {'analytics.orders': DBT_TABLE}
+
+    datasets = get_datasets_from_superset(superset, dashboards_datasets, dbt_tables, 'ansi', None,
+                                          parse_workers=1, snapshot=snapshot)
+
+    assert superset.endpoints == []
+    assert datasets['reports.orders_eur'].changed_on == '2024-01-02T00:00:00'
+    assert datasets['reports.orders_eur'].dbt_refs == ["ref('orders')"]
+
+
+def test_sql_tables_extractor():
+    metrics = Metrics()
+    sql_fluff = "select id from analytics.orders union all select id from analytics.returns"
+
+    with SqlTablesExtractor('ansi', parse_workers=2, metrics=metrics) as sql_extractor:
+        sql_extractor.submit(sql_fluff)
+        sql_extractor.submit(sql_fluff)
+        assert sorted(sql_extractor.get_tables(sql_fluff)) == sorted(get_tables_from_sql(sql_fluff, 'ansi'))
+        assert sql_extractor.get_tables(SQL_CORPUS[0]) == ['analytics.orders']
+
+    assert metrics.counters == {'sql_queries_parsed_sqlfluff': 1, 'sql_queries_parsed_fast': 1}
+
+
+def test_sql_tables_extractor_in_processes(tmp_path):
+    # a query sqlfluff fails on falls back to regular expressions within the worker process
+    sqls = SQL_CORPUS + ["select * from s.t where ("]
+
+    with SqlTablesExtractor('ansi', parse_workers=1) as sql_extractor:
+        tables_expected = [sorted(sql_extractor.get_tables(sql)) for sql in sqls]
+
+    metrics = Metrics()
+    sql_cache = SqlTablesCache(tmp_path / 'cache.json', version='1')
+    with SqlTablesExtractor('ansi', parse_workers=3, sql_cache=sql_cache, metrics=metrics) as sql_extractor:
+        for sql in sqls:
+            sql_extractor.submit(sql)
+        assert [sorted(sql_extractor.get_tables(sql)) for sql in sqls] == tables_expected
+    assert metrics.counters['sql_queries_parsed_regex'] == 1
+
+    # queries parsed by the workers are cached, nothing is parsed again
+    metrics = Metrics()
+    with SqlTablesExtractor('ansi', parse_workers=3, sql_cache=sql_cache, metrics=metrics) as sql_extractor:
+        assert [sorted(sql_extractor.get_tables(sql)) for sql in sqls] == tables_expected
+        assert sql_extractor._executor is None
+    assert metrics.counters == {'sql_queries_cached': len(sqls)}
+
+
+def test_sql_tables_extractor_bounds_pending_queries():
+    sqls = [f"with t as (select * from s.t{i}) select * from t" for i in range(20)]
+
+    with SqlTablesExtractor('ansi', parse_workers=2) as sql_extractor:
+        for sql in sqls:
+            sql_extractor.submit(sql)
+            # further submits wait for the oldest queries instead of queueing all of them
+            assert sum(isinstance(result, Future) for result in sql_extractor._results.values()) \
+                <= 2 * SQL_PENDING_PER_WORKER
+        assert [sql_extractor.get_tables(sql) for sql in sqls] == [[f's.t{i}'] for i in range(20)]
+
+
+def test_get_dashboards_from_superset_concurrently():
+    # latency lets the fetches of dashboards overlap and finish out of order
+    with FakeSuperset(n_dashboards=40, n_datasets=40, max_page_size=10, latency=0.002) as fake:
+        superset = Superset(fake.url + '/api/v1', refresh_token='refresh')
+        dashboards_expected, datasets_expected = get_dashboards_from_superset(superset, fake.url, None, max_workers=1)
+        dashboards, datasets = get_dashboards_from_superset(superset, fake.url, None, max_workers=8)
+
+    assert [d.id for d in dashboards_expected] == [i for i in range(1, 41) if i % 4 != 0]
+    assert dashboards == dashboards_expected
+    assert list(datasets.items()) == list(datasets_expected.items())
+
+
+def test_incremental_pull_follows_charts_pointed_to_other_datasets(tmp_path):
+    write_dbt_project(tmp_path, n_models=30)
+
+    with FakeSuperset(n_dashboards=20, n_datasets=30, max_page_size=10) as fake:
+        pull(fake, tmp_path, incremental=True)
+
+        # the dashboard of the chart does not change, only the chart does
+        chart = next(c for c in fake.charts.values() if c['dashboards'] == [{'id': 1}])
+        dataset_id = next(i for i in fake.datasets if i not in fake.get_dashboard_datasets(1))
+        fake.repoint_chart(chart['id'], dataset_id)
+
+        fake.requests.clear()
+        exposures = pull(fake, tmp_path, incremental=True)
+        requests = fake.count_requests()
+
+        exposures_expected = pull(fake, tmp_path)
+
+    assert exposures == exposures_expected
+    assert any(f"model_{dataset_id}'" in ref for ref in exposures[0]['depends_on'])
+    # only the dashboard of the chart is fetched again
+    assert requests['GET /dashboard/{id}'] == 1
+    assert requests['GET /chart/'] == math.ceil(len(fake.charts) / 10)
+
+
+def test_incremental_pull_follows_datasets_pointed_to_other_tables(tmp_path):
+    write_dbt_project(tmp_path, n_models=30)
+
+    with FakeSuperset(n_dashboards=20, n_datasets=30, max_page_size=10) as fake:
+        pull(fake, tmp_path, incremental=True)
+
+        # neither the dashboard nor its charts change, only the dataset does
+        dataset_id = next(i for i in fake.get_dashboard_datasets(1) if fake.datasets[i]['kind'] == 'physical')
+        table_id = next(i for i in fake.datasets if fake.datasets[i]['kind'] == 'virtual')
+        fake.repoint_dataset(dataset_id, *get_table_name(table_id))
+
+        fake.requests.clear()
+        exposures = pull(fake, tmp_path, incremental=True)
+        requests = fake.count_requests()
+
+        exposures_expected = pull(fake, tmp_path)
+        # the saved dashboard is pointed to the current key of the dataset as well
+        exposures_next = pull(fake, tmp_path, incremental=True)
+
+    assert exposures == exposures_expected
+    assert exposures_next == exposures_expected
+    assert any(f"model_{table_id}'" in ref for ref in exposures[0]['depends_on'])
+    # the dashboard is reused, only the dataset is fetched again
+    assert requests['GET /dashboard/{id}'] == 0
+    assert requests['GET /dataset/{id}'] == 1
@@ -0,0 +1,225 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+import ruamel.yaml
+
+from dbt_superset_lineage.push_descriptions import main as push_descriptions_main
+from dbt_superset_lineage.push_descriptions import (build_datasets_import, convert_markdown_to_plain_text,
+                                                    get_datasets_from_superset, merge_columns_info,
+                                                    read_datasets_export)
+from dbt_superset_lineage.records import DbtTable
+from dbt_superset_lineage.superset_api import Superset
+
+from .support.fake_superset import API_USER_ID, FakeSuperset
+from .support.manifest_generator import write_dbt_project
+
+# outputs of the previous BeautifulSoup-based implementation
+MARKDOWN_GOLDEN = [
+    ('', ''),
+    ('Plain description', 'Plain description'),
+    ('Primary key of the table.', 'Primary key of the table.'),
+    ('  leading and trailing whitespace  ', 'leading and trailing whitespace '),
+    ('Multi\nline\ndescription', 'Multi line description'),
+    ('First paragraph.\n\nSecond paragraph.', 'First paragraph. Second paragraph.'),
+    ('**Bold** and *italic* and __strong__ and _em_', 'Bold and italic and strong and em'),
+    ('Inline `code` inside a sentence', 'Inline code inside a sentence'),
+    ('Text with a [link](https://example.com) in it', 'Text with a link in it'),
+    ('Autolink <https://example.com>', 'Autolink https://example.com'),
+    ('Image ![alt text](https://example.com/a.png) here', 'Image here'),
+    ('# Heading\n\nBody text', 'Heading Body text'),
+    ('## Sub heading\nright below', 'Sub heading right below'),
+    ('Setext heading\n==============\n\nbody', 'Setext heading body'),
+    ('- one\n- two\n- three', ' one two three '),
+    ('1. first\n2. second\n3. third', ' first second third '),
+    ('* nested\n    * deeper\n        * deepest', ' nested deeper deepest '),
+    ('> quoted text\n> continues', ' quoted text continues '),
+    ('```\nselect 1\nfrom t\n```', 'select 1 from t'),
+    ('Before\n\n    indented code\n    block\n\nAfter', 'Before indented code block After'),
+    ('Text with &amp; entity and &lt;tag&gt;', 'Text with & entity and <tag>'),
+    ('Ampersand & alone and 5 < 6 > 4', 'Ampersand & alone and 5 < 6 > 4'),
+    ('Arrow → replaced', 'Arrow -> replaced'),
+    ('Value is <null> when missing', 'Value is when missing'),
+    ('Value is `<null>` in code', 'Value is "null" in code'),
+    ('Raw <b>html</b> inline', 'Raw html inline'),
+    ('<div>\nblock html\n</div>\n\nafter', ' block html after'),
+    ('<pre>single line pre</pre>', ' '),
+    ('<code>weird</code > spacing', ' spacing'),
+    ('<!-- comment --> visible', ' comment visible'),
+    ('Tabs\tand\t\ttabs', 'Tabs and tabs'),
+    ('Line with trailing spaces  \nhard break', 'Line with trailing spaces hard break'),
+    ('Unicode: žluťoučký kůň, 日本語, emoji 🎉', 'Unicode: žluťoučký kůň, 日本語, emoji 🎉'),
+    ('Escaped \\*not italic\\* and \\`not code\\`', 'Escaped *not italic* and `not code`'),
+    ('Horizontal\n\n---\n\nrule', 'Horizontal rule'),
+    ('| a | b |\n|---|---|\n| 1 | 2 |', '| a | b | |---|---| | 1 | 2 |'),
+    ("{{ doc('orders') }}", "{{ doc('orders') }}"),
+    ("Status can be one of: 'placed', 'shipped', 'completed', 'returned'",
+     "Status can be one of: 'placed', 'shipped', 'completed', 'returned'"),
+    ('Total amount (AUD) of the order\n\n- includes tax\n- excludes shipping',
+     'Total amount (AUD) of the order includes tax excludes shipping '),
+    ('Reference [1]\n\n[1]: https://example.com', 'Reference 1'),
+    ('x < y && y > z', 'x < y && y > z'),
+    ('Mixed **bold `code` inside** text', 'Mixed bold code inside text'),
+    ('Email <someone@example.com>', 'Email someone@example.com'),
+    ('Numbers 1.5 * 2 = 3', 'Numbers 1.5 * 2 = 3'),
+    ('Footnote-like text^1', 'Footnote-like text^1'),
+    ('Line one\r\nLine two', 'Line one Line two'),
+    ('Non-breaking&nbsp;space', 'Non-breaking space'),
+    ('&#169; 2024 &#x2192; arrows', '© 2024 -> arrows'),
+    ('<script>alert(1)</script>', 'alert(1)'),
+    ('<style>p {color: red}</style>text', 'p {color: red} text'),
+    ('<p>already html</p>', 'already html'),
+    ('A *b* c **d** e ***f***', 'A b c d e f'),
+    ('Ends with backslash \\', 'Ends with backslash \\'),
+    ('Underscores in snake_case_names are kept', 'Underscores in snake_case_names are kept'),
+    ('`code with <null> and →`', 'code with "null" and ->'),
+    ('Unknown &foo; entity', 'Unknown &foo entity'),
+    ('Empty<!---->comment', 'Empty comment'),
+    ('&#150; dash &#129; &#0;', '– dash \x81 �'),
+    ('Not &copy without semicolon', 'Not &copy without semicolon'),
+    ('<![CDATA[data]]> and <?pi?>', 'data and pi?'),
+    ('<pre>\na<!---->b\n</pre>\n\nc<!---->d', ' ab c d'),
+    ('Long ' + 'word ' * 30, 'Long ' + 'word ' * 30),
+]
+
+
+@pytest.mark.parametrize('md_string, plain_text', MARKDOWN_GOLDEN)
+def test_convert_markdown_to_plain_text(md_string, plain_text):
+    assert convert_markdown_to_plain_text(md_string) == plain_text
+
+
+def test_convert_markdown_to_plain_text_memoized():
+    convert_markdown_to_plain_text.cache_clear()
+    for _ in range(3):
+        assert convert_markdown_to_plain_text('**Primary** key') == 'Primary key'
+    assert convert_markdown_to_plain_text.cache_info().hits == 2
+
+
+def write_datasets_export():
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w') as zip_file:
+        zip_file.writestr('dataset_export_20240101T000000/metadata.yaml', 'version: 1.0.0\ntype: SqlaTable\n')
+        zip_file.writestr('dataset_export_20240101T000000/databases/dwh.yaml', 'database_name: dwh\nuuid: db-1\n')
+        zip_file.writestr('dataset_export_20240101T000000/datasets/dwh/orders.yaml',
+                          'table_name: orders\n'
+                          'schema: analytics\n'
+                          'description: null\n'
+                          'uuid: ds-1\n'
+                          'database_uuid: db-1\n'
+                          'columns:\n'
+                          '- column_name: id\n'
+                          '  expression: null\n'
+                          '  description: Primary key\n'
+                          '  groupby: true\n'
+                          '- column_name: amount_eur\n'
+                          '  expression: amount * rate\n'
+                          '  description: null\n')
+
+    return content.getvalue()
+
+
+def test_read_datasets_export():
+    dataset_exported = read_datasets_export(write_datasets_export())['analytics.orders']
+
+    assert dataset_exported['description'] is None
+    assert dataset_exported['columns'] == [
+        {'column_name': 'id', 'id': None, 'expression': None, 'description': 'Primary key'},
+        {'column_name': 'amount_eur', 'id': None, 'expression': 'amount * rate', 'description': None},
+    ]
+    assert [file_name for file_name, _ in dataset_exported['files']] == ['databases/dwh.yaml',
+                                                                         'datasets/dwh/orders.yaml']
+
+
+def test_build_datasets_import():
+    dataset_exported = read_datasets_export(write_datasets_export())['analytics.orders']
+    tables = {'analytics.orders': DbtTable(name='orders', schema='analytics', database='dwh', type='node',
+                                           ref="ref('orders')", description='All **orders**',
+                                           columns={'id': 'Order ID', 'amount_eur': 'Amount in EUR'})}
+    dataset = merge_columns_info(dict(dataset_exported, id=1, key='analytics.orders', owners=[]), tables)
+
+    with zipfile.ZipFile(io.BytesIO(build_datasets_import([dataset]))) as zip_file:
+        yaml = ruamel.yaml.YAML(typ='safe')
+        assert sorted(zip_file.namelist()) == ['dataset_import/databases/dwh.yaml',
+                                               'dataset_import/datasets/dwh/orders.yaml',
+                                               'dataset_import/metadata.yaml']
+        assert yaml.load(zip_file.read('dataset_import/metadata.yaml'))['type'] == 'SqlaTable'
+        config = yaml.load(zip_file.read('dataset_import/datasets/dwh/orders.yaml'))
+
+    assert config['description'] == 'All orders'
+    assert config['uuid'] == 'ds-1'
+    # calculated columns keep their description
+    assert [(c['column_name'], c['description'], c.get('groupby')) for c in config['columns']] == [
+        ('id', 'Order ID', True), ('amount_eur', None, None)]
+
+
+class ListingSession:
+    """Stands in for ``requests.Session``, keeping queries of listings and answering them with ``results``."""
+
+    def __init__(self, results):
+        self.results = results
+        self.queries = []
+
+    def request(self, method, url, headers, params):
+        self.queries.append(json.loads(params['q']))
+        return Response({'count': len(self.results), 'result': self.results})
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+def test_get_datasets_from_superset():
+    superset = Superset('https://superset/api/v1', access_token='token')
+    superset.session = ListingSession([
+        {'id': 1, 'table_name': 'orders', 'schema': 'analytics', 'kind': 'physical', 'database': {'id': 3},
+         'changed_on_utc': '2024-01-01T00:00:00', 'owners': [{'id': 7}]},
+    ])
+
+    assert get_datasets_from_superset(superset, 3) == [
+        {'id': 1, 'key': 'analytics.orders', 'changed_on': '2024-01-01T00:00:00', 'owner_ids': [7]}
+    ]
+    # only physical datasets of the database are listed, with the fields used only
+    assert superset.session.queries == [{
+        'filters': [{'col': 'sql', 'opr': 'dataset_is_null_or_empty', 'value': True},
+                    {'col': 'database', 'opr': 'rel_o_m', 'value': 3}],
+        'columns': ['id', 'table_name', 'schema', 'kind', 'database.id', 'changed_on_utc', 'owners.id'],
+        'page': 0, 'page_size': 1000
+    }]
+
+
+def test_bulk_push_keeps_owners(tmp_path):
+    write_dbt_project(tmp_path, n_models=20)
+
+    with FakeSuperset(n_dashboards=0, n_datasets=20) as fake:
+        owners_expected = {i: list(d['owners']) for i, d in fake.datasets.items()}
+        push_descriptions_main(str(tmp_path), None, fake.url, None, False, None, None, 'refresh',
+                               superset_bulk_read=True, superset_bulk_write=True)
+        requests = fake.count_requests()
+
+        datasets_physical = [d for d in fake.datasets.values() if d['kind'] == 'physical']
+        assert requests['POST /dataset/import/'] == 1
+        # the API user added by the import is removed again from every imported dataset
+        assert requests['PUT /dataset/{id}'] == len(datasets_physical)
+        assert all(d['description'] for d in datasets_physical)
+        assert {i: d['owners'] for i, d in fake.datasets.items()} == owners_expected
+
+        # datasets the API user owns anyway are not updated again
+        for dataset in datasets_physical:
+            dataset['description'] = None
+            dataset['owners'].append({'id': API_USER_ID, 'first_name': 'API', 'last_name': 'User'})
+        fake.requests.clear()
+        push_descriptions_main(str(tmp_path), None, fake.url, None, False, None, None, 'refresh',
+                               superset_bulk_read=True, superset_bulk_write=True)
+        assert fake.count_requests()['PUT /dataset/{id}'] == 0
+        assert all(len(d['owners']) == 2 for d in datasets_physical)
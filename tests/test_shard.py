@@ -0,0 +1,103 @@
+import pytest
+
+from dbt_superset_lineage.merge_exposures import main as merge_exposures_main
+from dbt_superset_lineage.pull_dashboards import write_exposures
+from dbt_superset_lineage.shard import is_in_shard, parse_shard
+
+from .support.commands import EXPOSURES_PATH, load_exposures, pull, push, sync
+from .support.fake_superset import FakeSuperset
+from .support.manifest_generator import write_dbt_project
+
+
+def test_parse_shard():
+    assert parse_shard(None) is None
+    assert parse_shard('1/1') == (1, 1)
+    assert parse_shard('2/4') == (2, 4)
+
+    for shard in ['0/4', '5/4', '1', '1/', '/4', 'a/b', '-1/4']:
+        with pytest.raises(AssertionError):
+            parse_shard(shard)
+
+
+def test_is_in_shard():
+    # every object is in exactly one shard
+    shards = [parse_shard(f'{index}/3') for index in range(1, 4)]
+    assert all(sum(is_in_shard(object_id, shard) for shard in shards) == 1 for object_id in range(1000))
+    assert all(is_in_shard(object_id, None) for object_id in range(1000))
+
+    # shards are the same across processes and versions of Python
+    assert [i for i in range(1, 21) if is_in_shard(i, (3, 3))] == [1, 8, 13, 17]
+
+
+def test_shards_cover_everything_once(tmp_path):
+    write_dbt_project(tmp_path, n_models=50)
+    exposures_path = tmp_path / EXPOSURES_PATH[1:]
+
+    with FakeSuperset(n_dashboards=50, n_datasets=50, max_page_size=10) as fake:
+        pull(fake, tmp_path)
+        exposures_expected = exposures_path.read_text()
+
+        # shards are pulled into their own files, as on separate workers
+        requests_pull = []
+        for index in range(1, 4):
+            fake.requests.clear()
+            pull(fake, tmp_path, exposures_path=f'/target/exposures_{index}.yml', shard=f'{index}/3')
+            requests_pull.append(fake.count_requests())
+        exposures_path.unlink()
+        merge_exposures_main(str(tmp_path), EXPOSURES_PATH,
+                             [f'{tmp_path}/target/exposures_{index}.yml' for index in range(1, 4)])
+
+        requests_push = []
+        for index in range(1, 4):
+            fake.requests.clear()
+            push(fake, tmp_path, shard=f'{index}/3')
+            requests_push.append(fake.count_requests())
+        datasets_physical = sum(d['kind'] == 'physical' for d in fake.datasets.values())
+        dashboards_published = sum(d['published'] for d in fake.dashboards.values())
+
+    assert exposures_path.read_text() == exposures_expected
+
+    # details of every dashboard are fetched by a single shard, every dataset is updated by one
+    assert sum(r['GET /dashboard/{id}'] for r in requests_pull) == dashboards_published
+    assert all(r['GET /dashboard/{id}'] for r in requests_pull)
+    assert sum(r['PUT /dataset/{id}'] for r in requests_push) == datasets_physical
+    assert all(d['description'] for d in fake.datasets.values() if d['kind'] == 'physical')
+
+
+def test_merged_shards_match_a_single_run(tmp_path):
+    write_dbt_project(tmp_path, n_models=20)
+    exposures_path = tmp_path / EXPOSURES_PATH[1:]
+    partial_paths = [f'/target/exposures_{index}.yml' for index in range(1, 3)]
+
+    with FakeSuperset(n_dashboards=20, n_datasets=20) as fake:
+        exposures = pull(fake, tmp_path)
+        # descriptions are kept for exposures in the exposure file, those of shards from their own stale files are not
+        write_exposures([{**exposure, 'description': 'Kept.'} for exposure in exposures[::2]], str(exposures_path))
+        exposures_orig = exposures_path.read_text()
+        (tmp_path / 'target').mkdir(exist_ok=True)
+        for partial_path in partial_paths:
+            write_exposures([{**exposure, 'description': 'Stale.'} for exposure in exposures],
+                            f'{tmp_path}{partial_path}')
+
+        for index, partial_path in enumerate(partial_paths, start=1):
+            pull(fake, tmp_path, exposures_path=partial_path, shard=f'{index}/2')
+        merge_exposures_main(str(tmp_path), EXPOSURES_PATH, [f'{tmp_path}{path}' for path in partial_paths])
+        exposures_merged = exposures_path.read_text()
+
+        exposures_path.write_text(exposures_orig)
+        pull(fake, tmp_path)
+
+    assert exposures_merged == exposures_path.read_text()
+    assert {exposure['description'] for exposure in load_exposures(tmp_path)} == {'Kept.', ''}
+
+
+def test_shards_refuse_the_default_exposure_file(tmp_path):
+    write_dbt_project(tmp_path, n_models=5)
+
+    with FakeSuperset(n_dashboards=5, n_datasets=5) as fake:
+        with pytest.raises(AssertionError, match='own exposure file'):
+            pull(fake, tmp_path, shard='1/2')
+        with pytest.raises(AssertionError, match='own exposure file'):
+            sync(fake, tmp_path, shard='1/2')
+
+    assert not (tmp_path / EXPOSURES_PATH[1:]).exists()
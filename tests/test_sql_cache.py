@@ -0,0 +1,69 @@
+import json
+import os
+
+import pytest
+
+from dbt_superset_lineage.sql_cache import SqlTablesCache
+
+
+def test_get_and_set(tmp_path):
+    cache = SqlTablesCache(tmp_path / 'cache.json', version='1')
+
+    assert cache.get('select * from a.b', 'ansi') is None
+    cache.set('select * from a.b', 'ansi', ['a.b'])
+    assert cache.get('select * from a.b', 'ansi') == ['a.b']
+
+    # other dialects and versions of the extractor miss
+    assert cache.get('select * from a.b', 'postgres') is None
+    cache.save()
+    assert SqlTablesCache(tmp_path / 'cache.json', version='2').get('select * from a.b', 'ansi') is None
+
+    assert cache.stats() == {'entries': 1, 'hits': 1, 'misses': 2}
+
+
+def test_save_evicts_least_recently_used(tmp_path):
+    cache = SqlTablesCache(tmp_path / 'cache.json', version='1', max_entries=2)
+    cache.set('select 1', 'ansi', [])
+    cache.set('select 2', 'ansi', [])
+    cache.set('select 3', 'ansi', [])
+    cache.get('select 1', 'ansi')  # used more recently than the second query now
+    cache.save()
+
+    cache = SqlTablesCache(tmp_path / 'cache.json', version='1', max_entries=2)
+    assert cache.get('select 1', 'ansi') == []
+    assert cache.get('select 2', 'ansi') is None
+    assert cache.get('select 3', 'ansi') == []
+
+
+@pytest.mark.parametrize('content', ['{"entries": {"a": ["b"]', 'not json', '[]', '{"entries": [1]}', ''])
+def test_corrupted_cache_is_rebuilt(tmp_path, content):
+    (tmp_path / 'cache.json').write_text(content)
+
+    cache = SqlTablesCache(tmp_path / 'cache.json', version='1')
+    assert cache.stats() == {'entries': 0, 'hits': 0, 'misses': 0}
+
+    cache.set('select * from a.b', 'ansi', ['a.b'])
+    cache.save()
+    assert SqlTablesCache(tmp_path / 'cache.json', version='1').get('select * from a.b', 'ansi') == ['a.b']
+
+
+def test_save_replaces_atomically(tmp_path, monkeypatch):
+    cache = SqlTablesCache(tmp_path / 'cache.json', version='1')
+    cache.set('select 1', 'ansi', [])
+    cache.save()
+    content = (tmp_path / 'cache.json').read_text()
+
+    def replace(src, dst):
+        raise OSError("Interrupted")
+
+    # an interrupted save leaves the previous cache as it was
+    cache.set('select 2', 'ansi', [])
+    monkeypatch.setattr(os, 'replace', replace)
+    with pytest.raises(OSError):
+        cache.save()
+    assert (tmp_path / 'cache.json').read_text() == content
+    assert len(json.loads(content)['entries']) == 1
+
+    monkeypatch.undo()
+    cache.save()
+    assert sorted(os.listdir(tmp_path)) == ['cache.json']
@@ -0,0 +1,80 @@
+import json
+import re
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ['sqlfluff', 'ruamel.yaml', 'markdown', 'requests']
+
+# generous budgets in seconds of cumulative import time, the modules loaded are checked exactly below
+BUDGETS = {
+    'dbt_superset_lineage': 0.5,
+    'dbt_superset_lineage.pull_dashboards': 1.5,
+    'dbt_superset_lineage.push_descriptions': 1.5,
+    'dbt_superset_lineage.sync': 1.5,
+}
+
+
+def get_import_seconds(module):
+    """Returns the cumulative import time of ``module`` in a fresh interpreter, as ``-X importtime`` tells."""
+
+    timings = []
+    for _ in range(3):  # the best of a few runs, to be robust to a busy machine
+        res = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             capture_output=True, text=True, check=True)
+        match = re.search(rf'^import time:\s+\d+ \|\s+(\d+) \| {re.escape(module)}$', res.stderr, re.MULTILINE)
+        timings.append(int(match[1]) / 1e6)
+    return min(timings)
+
+
+def get_modules_loaded(code):
+    """Returns which of ``HEAVY_MODULES`` are loaded after running ``code`` in a fresh interpreter."""
+
+    res = subprocess.run([sys.executable, '-c', code + f'''
+import json, sys
+print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))
+'''], capture_output=True, text=True, check=True)
+    return json.loads(res.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize('module', BUDGETS)
+def test_import_time_within_budget(module):
+    assert get_import_seconds(module) <= BUDGETS[module]
+
+
+@pytest.mark.parametrize('args', [
+    ['--help'],
+    ['pull-dashboards', '--help'],
+    ['push-descriptions', '--help'],
+    ['sync', '--help'],
+    ['merge-exposures', '--help'],
+])
+def test_help_loads_no_heavy_modules(args):
+    code = f'''
+from dbt_superset_lineage import app
+try:
+    app({args!r})
+except SystemExit:
+    pass
+'''
+    assert get_modules_loaded(code) == []
+
+
+@pytest.mark.parametrize('module, modules_expected', [
+    ('dbt_superset_lineage.pull_dashboards', ['requests']),
+    ('dbt_superset_lineage.push_descriptions', ['requests']),
+    ('dbt_superset_lineage.sync', ['requests']),
+    ('dbt_superset_lineage.merge_exposures', ['requests']),
+])
+def test_commands_load_heavy_modules_when_needed(module, modules_expected):
+    assert get_modules_loaded(f'import {module}') == modules_expected
+
+
+def test_fast_queries_do_not_load_sqlfluff():
+    code = '''
+from dbt_superset_lineage.pull_dashboards import get_tables_from_sql, get_sql_extractor_version
+assert get_tables_from_sql('select * from analytics.orders', 'ansi') == ['analytics.orders']
+get_sql_extractor_version()
+'''
+    assert 'sqlfluff' not in get_modules_loaded(code)
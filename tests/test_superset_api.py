@@ -0,0 +1,364 @@
+import base64
+import io
+import json
+import math
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import urllib3
+
+from requests import HTTPError
+from urllib3.connectionpool import HTTPConnectionPool
+
+from dbt_superset_lineage.superset_api import (PAGES_PENDING_PER_WORKER, RateLimiter, Superset, get_token_expiration,
+                                              map_bounded)
+
+from .support.commands import pull, push
+from .support.fake_superset import FakeSuperset
+from .support.manifest_generator import write_dbt_project
+
+
+def make_token(exp):
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': exp}).encode()).decode().rstrip('=')
+    return f'header.{payload}.signature'
+
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+class Session:
+    """Stands in for ``requests.Session``, expiring tokens as Superset does."""
+
+    def __init__(self, expired_tokens=()):
+        self.expired_tokens = set(expired_tokens)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, headers, **request_kwargs):
+        with self.lock:
+            self.requests.append((method, url, headers.get('Authorization'), request_kwargs))
+        if url.endswith('/security/refresh'):
+            time.sleep(0.01)  # give other threads a chance to find the token expired as well
+            return Response(200, {'access_token': make_token(time.time() + 3600)})
+        if headers.get('Authorization') in {f'Bearer {token}' for token in self.expired_tokens}:
+            return Response(401, {'msg': 'Token has expired'})
+        return Response(200, {'result': request_kwargs})
+
+
+class Transport:
+    """Stands in for connections of urllib3, so that the adapter and retries of the session are real."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.sleeps = []
+
+    def make_request(self, pool, conn, method, url, **kwargs):
+        self.requests.append((method, url))
+        status, headers, body = self.responses.pop(0)
+        return urllib3.HTTPResponse(body=io.BytesIO(json.dumps(body).encode()), status=status, headers=headers,
+                                    preload_content=False, request_method=method)
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    transport = Transport([])
+    monkeypatch.setattr(HTTPConnectionPool, '_make_request',
+                        lambda pool, conn, method, url, **kwargs: transport.make_request(pool, conn, method, url))
+    monkeypatch.setattr('urllib3.util.retry.time.sleep', transport.sleeps.append)
+    return transport
+
+
+def test_get_token_expiration():
+    assert get_token_expiration(make_token(1700000000)) == 1700000000
+    assert get_token_expiration('not a jwt') is None
+    assert get_token_expiration(None) is None
+
+
+def test_rate_limiter_rate():
+    limiter = RateLimiter(rate=50)
+
+    start = time.monotonic()
+    for _ in range(11):
+        limiter.acquire()
+    elapsed = time.monotonic() - start
+
+    # the first event is immediate, the remaining ten are 20 ms apart
+    assert 0.19 <= elapsed < 0.4
+
+
+def test_rate_limiter_burst():
+    limiter = RateLimiter(rate=10, burst=5)
+
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.05
+
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_rate_limiter_debt_blocks_other_threads():
+    limiter = RateLimiter(rate=20)
+    times = []
+    lock = threading.Lock()
+
+    def acquire():
+        limiter.acquire()
+        with lock:
+            times.append(time.monotonic())
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=acquire) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # every thread waits for the tokens reserved by those before it, events are 50 ms apart
+    times.sort()
+    assert all(later - earlier >= 0.045 for earlier, later in zip(times, times[1:]))
+    assert times[-1] - start >= 0.19
+
+
+def test_request_refreshes_expiring_token_once():
+    superset = Superset('https://superset/api/v1', access_token=make_token(time.time() + 10),
+                        refresh_token='refresh')
+    superset.session = Session()
+
+    threads = [threading.Thread(target=superset.request, args=('GET', '/dataset/')) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    refreshes = [r for r in superset.session.requests if r[1].endswith('/security/refresh')]
+    assert len(refreshes) == 1
+    assert get_token_expiration(superset.access_token) > time.time() + 3000
+
+
+def test_request_retries_expired_token_with_same_arguments():
+    access_token = make_token(time.time() + 3600)  # seemingly valid, e.g. revoked by the server
+    superset = Superset('https://superset/api/v1', access_token=access_token, refresh_token='refresh')
+    superset.session = Session(expired_tokens=[access_token])
+
+    res = superset.request('PUT', '/dataset/1', params={'override_columns': 'false'}, json={'description': 'd'})
+
+    assert res == {'result': {'params': {'override_columns': 'false'}, 'json': {'description': 'd'}}}
+    assert [r[0] for r in superset.session.requests] == ['PUT', 'POST', 'PUT']
+
+
+def test_request_retries_429_and_5xx(transport):
+    transport.responses = [(429, {'Retry-After': '2'}, {}), (503, {}, {}), (200, {}, {'result': 'ok'})]
+    superset = Superset('http://superset/api/v1', access_token='token', max_retries=3, backoff_factor=0.5)
+
+    assert superset.request('GET', '/dataset/') == {'result': 'ok'}
+    assert transport.requests == [('GET', '/api/v1/dataset/')] * 3
+    # Retry-After is honored, then the backoff of the second retry applies
+    assert transport.sleeps == [2, 1.0]
+
+
+def test_request_raises_http_error_when_retries_are_exhausted(transport):
+    transport.responses = [(502, {}, {})] * 3
+    superset = Superset('http://superset/api/v1', access_token='token', max_retries=2, backoff_factor=0)
+
+    with pytest.raises(HTTPError) as e:
+        superset.request('GET', '/dataset/')
+    assert e.value.response.status_code == 502
+    assert len(transport.requests) == 3
+
+    # other client errors are not retried
+    transport.responses = [(404, {}, {'message': 'Not found'})]
+    with pytest.raises(HTTPError):
+        superset.request('GET', '/dataset/1')
+    assert len(transport.requests) == 4
+
+
+def test_request_calls_hooks(transport):
+    transport.responses = [(200, {}, {'result': 'ok'}), (404, {}, {})]
+    calls = []
+    superset = Superset('http://superset/api/v1', access_token='token',
+                        hooks=[lambda *args: calls.append(args)])
+    superset.add_hook(lambda method, endpoint, response, elapsed: calls.append('added'))
+
+    superset.request('GET', '/dataset/')
+    with pytest.raises(HTTPError):
+        superset.request('PUT', '/dataset/1', json={})
+
+    assert [(method, endpoint, response.status_code) for method, endpoint, response, _ in calls[::2]] == \
+        [('GET', '/dataset/', 200), ('PUT', '/dataset/1', 404)]
+    assert all(elapsed >= 0 for *_, elapsed in calls[::2])
+    assert calls[1::2] == ['added', 'added']
+
+
+def test_session_pool_size():
+    superset = Superset('https://superset/api/v1', access_token='token', pool_size=24, max_retries=5)
+
+    for scheme in ('http://', 'https://'):
+        adapter = superset.session.get_adapter(scheme + 'superset')
+        assert adapter.poolmanager.connection_pool_kw['maxsize'] == 24
+        assert adapter.max_retries.total == 5
+
+
+def test_requests_beyond_pool_size_wait_for_connections(caplog):
+    # e.g. pages of a listing requested while details of dashboards are fetched
+    with FakeSuperset(n_dashboards=40, n_datasets=40, latency=0.01) as fake:
+        superset = Superset(fake.url + '/api/v1', refresh_token='refresh', pool_size=2)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda i: superset.request('GET', f'/dashboard/{i}'), range(1, 41)))
+
+    assert 'Connection pool is full' not in caplog.text
+
+
+
+def test_superset_closes_pooled_connections():
+    with FakeSuperset(n_dashboards=1, n_datasets=1) as fake:
+        with Superset(fake.url + '/api/v1', refresh_token='refresh') as superset:
+            superset.request('GET', '/dashboard/1')
+            pools = superset.session.get_adapter(fake.url).poolmanager.pools
+            assert len(pools) == 1
+
+    assert len(pools) == 0
+
+class ListingSession:
+    """Stands in for ``requests.Session``, listing objects in pages capped as Superset does."""
+
+    def __init__(self, n_objects, max_page_size, latency=0.0):
+        self.objects = list(range(n_objects))
+        self.max_page_size = max_page_size
+        self.latency = latency
+        self.pages = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, headers, params):
+        time.sleep(self.latency)
+        query = json.loads(params['q'])
+        page_size = min(query['page_size'], self.max_page_size)
+        with self.lock:
+            self.pages.append(query['page'])
+            result = self.objects[query['page'] * page_size:(query['page'] + 1) * page_size]
+            return Response(200, {'count': len(self.objects), 'result': result})
+
+
+def test_paginate():
+    superset = Superset('https://superset/api/v1', access_token=make_token(time.time() + 3600))
+    superset.session = ListingSession(n_objects=95, max_page_size=10)
+
+    pages = list(superset.paginate('/dataset/', {'columns': ['id']}, page_size=1000, max_workers=4))
+
+    # the page size is taken from the first page, no page past the end is requested
+    assert [o for page in pages for o in page['result']] == list(range(95))
+    assert sorted(superset.session.pages) == list(range(10))
+
+
+def test_paginate_requests_pages_concurrently():
+    superset = Superset('https://superset/api/v1', access_token=make_token(time.time() + 3600))
+    superset.session = ListingSession(n_objects=100, max_page_size=10, latency=0.05)
+
+    start = time.perf_counter()
+    pages = list(superset.paginate('/dataset/', {}, page_size=10, max_workers=9))
+    elapsed = time.perf_counter() - start
+
+    assert len(pages) == 10
+    assert elapsed < 0.05 * 5  # the first page and then the rest at once, instead of ten one by one
+
+
+def test_paginate_requests_pages_ahead_bounded():
+    superset = Superset('https://superset/api/v1', access_token=make_token(time.time() + 3600))
+    superset.session = ListingSession(n_objects=100, max_page_size=10)
+
+    pages = superset.paginate('/dataset/', {}, page_size=10, max_workers=2)
+    next(pages)
+    next(pages)
+    time.sleep(0.05)
+
+    # the first page and those pending, instead of all pages, are requested ahead of a slow consumer
+    assert sorted(superset.session.pages) == list(range(1 + 2 * PAGES_PENDING_PER_WORKER))
+    assert len([o for page in pages for o in page['result']]) == 80
+
+
+def test_map_bounded():
+    taken = []
+
+    def items():
+        for i in range(20):
+            taken.append(i)
+            yield i
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = map_bounded(executor, lambda i: i * i, items(), max_pending=3)
+        assert next(results) == 0
+        # items are taken lazily, at most three are pending once the first result is consumed
+        assert taken == [0, 1, 2, 3]
+        assert list(results) == [i * i for i in range(1, 20)]
+
+
+def test_paginate_follows_objects_added_meanwhile():
+    superset = Superset('https://superset/api/v1', access_token=make_token(time.time() + 3600))
+    superset.session = ListingSession(n_objects=20, max_page_size=10)
+
+    pages = superset.paginate('/dataset/', {}, page_size=10)
+    next(pages)
+    superset.session.objects.extend(range(20, 25))
+
+    assert [o for page in pages for o in page['result']] == list(range(10, 25))
+
+
+def test_commands_with_errors_and_expiring_tokens(tmp_path):
+    write_dbt_project(tmp_path, n_models=20)
+
+    with FakeSuperset(n_dashboards=20, n_datasets=20) as fake:
+        exposures_expected = pull(fake, tmp_path)
+
+    # tokens expire several times during both runs
+    with FakeSuperset(n_dashboards=20, n_datasets=20, latency=0.01, error_rate=0.05,
+                      token_exp_claim=False, token_max_requests=20) as fake:
+        exposures = pull(fake, tmp_path)
+        requests = fake.count_requests()
+        fake.requests.clear()
+        push(fake, tmp_path, metrics_json=tmp_path / 'metrics.json')
+
+    # URLs differ in the port of the fake Superset only
+    assert [{**e, 'url': None} for e in exposures] == [{**e, 'url': None} for e in exposures_expected]
+    assert all(d['description'] for d in fake.datasets.values() if d['kind'] == 'physical')
+
+    with open(tmp_path / 'metrics.json') as f:
+        metrics = json.load(f)
+    assert metrics['counters']['datasets_updated'] == sum(d['kind'] == 'physical' for d in fake.datasets.values())
+    # every request reaching the fake Superset is either seen by the client or retried by its session
+    assert metrics['requests_total']['count'] + metrics['requests_total']['retries'] == len(fake.requests)
+    assert metrics['token_refreshes'] == fake.count_requests()['POST /security/refresh']
+    assert requests['POST /security/refresh'] > 1
+    assert metrics['token_refreshes'] > 1
+
+
+def test_listings_request_each_page_once(tmp_path):
+    write_dbt_project(tmp_path, n_models=50)
+
+    # pages of 1000 objects are requested, the fake Superset caps them to 10
+    with FakeSuperset(n_dashboards=50, n_datasets=50, max_page_size=10) as fake:
+        exposures = pull(fake, tmp_path, max_workers=4, incremental=True)
+        requests_pull = fake.count_requests()
+        fake.requests.clear()
+        push(fake, tmp_path)
+        requests_push = fake.count_requests()
+        dashboards_published = sum(d['published'] for d in fake.dashboards.values())
+        datasets_physical = sum(d['kind'] == 'physical' for d in fake.datasets.values())
+
+    assert len(exposures) == dashboards_published
+    assert requests_pull['GET /dashboard/'] == math.ceil(dashboards_published / 10)
+    assert requests_pull['GET /dataset/'] == 5
+    assert requests_push['GET /dataset/'] == math.ceil(datasets_physical / 10)
@@ -0,0 +1,179 @@
+import dataclasses
+import sqlite3
+
+import pytest
+
+from dbt_superset_lineage.metrics import Metrics
+from dbt_superset_lineage.records import Dashboard, Dataset
+from dbt_superset_lineage.superset_mirror import SupersetMirror, open_mirror
+
+from .support.commands import pull, push
+from .support.fake_superset import FakeSuperset
+from .support.manifest_generator import write_dbt_project
+
+
+class Superset:
+    def __init__(self, responses):
+        self.responses = responses
+        self.etags_sent = []
+
+    def request_conditional(self, endpoint, etag=None):
+        self.etags_sent.append(etag)
+        body, etag_new = self.responses[endpoint]
+        if etag is not None and etag == etag_new:
+            return None, etag
+        return body, etag_new
+
+
+def make_dashboard(dashboard_id):
+    return Dashboard(
+        id=dashboard_id,
+        title=f'Dashboard {dashboard_id}',
+        url=f'https://superset.example.com/superset/dashboard/{dashboard_id}/',
+        owner_name='Jane Doe',
+        datasets=['analytics.orders'],
+        datasets_w_db=['warehouse.analytics.orders'],
+        changed_on='2024-01-01T00:00:00.000000+0000',
+        refs=["ref('orders')"]
+    )
+
+
+def make_dataset():
+    return Dataset(
+        id=1,
+        name='orders',
+        schema='analytics',
+        database='warehouse',
+        kind='physical',
+        changed_on='2024-01-01T00:00:00.000000+0000',
+        sql_hash=None,
+        tables=['analytics.orders'],
+        dbt_refs=["ref('orders')"]
+    )
+
+
+def test_pull_state_round_trip(tmp_path):
+    mirror = SupersetMirror(tmp_path / 'mirror.sqlite')
+    params = {'superset_url': 'https://superset.example.com', 'superset_db_id': None}
+
+    assert mirror.load_pull_state(params) == (None, None)
+
+    mirror.save_pull_state(params, [make_dashboard(1), make_dashboard(2)], {'analytics.orders': make_dataset()})
+    mirror.close()
+
+    mirror = SupersetMirror(tmp_path / 'mirror.sqlite')
+    dashboards, datasets = mirror.load_pull_state(params)
+    # references to dbt are not reused, they are resolved again
+    assert dashboards == {1: dataclasses.replace(make_dashboard(1), refs=None),
+                          2: dataclasses.replace(make_dashboard(2), refs=None)}
+    assert datasets == {'analytics.orders': dataclasses.replace(make_dataset(), dbt_refs=None)}
+
+    # nothing is reused for other parameters
+    assert mirror.load_pull_state({**params, 'superset_db_id': 1}) == (None, None)
+
+    # references of dashboards to dbt can be queried directly
+    rows = mirror._connection.execute(
+        "select d.id from dashboards d join dashboard_refs r on r.dashboard_id = d.id "
+        "where r.ref = 'ref(''orders'')' order by d.id"
+    ).fetchall()
+    assert rows == [(1,), (2,)]
+
+
+def test_dataset_details(tmp_path):
+    mirror = SupersetMirror(tmp_path / 'mirror.sqlite')
+    result = {
+        'id': 1,
+        'description': 'Orders.',
+        'columns': [{'id': 10, 'column_name': 'id', 'expression': None, 'description': 'ID.'}],
+        'owners': [{'id': 1, 'first_name': 'Jane', 'last_name': 'Doe'}]
+    }
+
+    assert mirror.get_dataset_details(1, 'v1') is None
+    mirror.save_dataset_details(1, 'v1', result)
+
+    assert mirror.get_dataset_details(1, 'v1') == result
+    assert mirror.get_dataset_details(1, 'v2') is None
+    assert mirror.get_dataset_details(1, None) is None
+    assert mirror.stats() == {'hits': 1, 'misses': 3, 'not_modified': 0}
+
+    mirror.delete_dataset_details(1)
+    assert mirror.get_dataset_details(1, 'v1') is None
+    assert mirror._connection.execute('select count(*) from columns').fetchone() == (0,)
+
+
+def test_request_revalidates_by_etag(tmp_path):
+    mirror = SupersetMirror(tmp_path / 'mirror.sqlite')
+    superset = Superset({'/dashboard/1': ({'result': {'id': 1}}, '"a"'),
+                         '/dashboard/2': ({'result': {'id': 2}}, None)})
+
+    assert mirror.request(superset, '/dashboard/1') == {'result': {'id': 1}}
+    assert mirror.request(superset, '/dashboard/1') == {'result': {'id': 1}}
+    assert superset.etags_sent == [None, '"a"']
+    assert mirror.not_modified == 1
+
+    # responses without an ETag are not kept
+    mirror.request(superset, '/dashboard/2')
+    mirror.request(superset, '/dashboard/2')
+    assert superset.etags_sent[2:] == [None, None]
+
+    superset.responses['/dashboard/1'] = ({'result': {'id': 1, 'title': 'New'}}, '"b"')
+    assert mirror.request(superset, '/dashboard/1') == {'result': {'id': 1, 'title': 'New'}}
+
+
+def test_mirror_of_other_version_is_recreated(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'mirror.sqlite')
+    connection.execute('create table dashboards (id integer)')
+    connection.execute('pragma user_version = 0')
+    connection.close()
+
+    mirror = SupersetMirror(tmp_path / 'mirror.sqlite')
+    assert mirror.load_pull_state({}) == (None, None)
+
+    (tmp_path / 'corrupted.sqlite').write_bytes(b'not a database' * 100)
+    mirror = SupersetMirror(tmp_path / 'corrupted.sqlite')
+    assert mirror.load_pull_state({}) == (None, None)
+
+
+def test_open_mirror(tmp_path):
+    with open_mirror(tmp_path, mirror=False) as mirror:
+        assert mirror is None
+
+    metrics = Metrics()
+    with open_mirror(tmp_path, mirror=True, metrics=metrics) as mirror:
+        mirror.get_dataset_details(1, 'v1')
+    assert (tmp_path / 'target' / 'dbt_superset_lineage' / 'superset_mirror.sqlite').exists()
+    assert metrics.counters == {'mirror_hits': 0, 'mirror_not_modified': 0}
+
+    # the mirror is closed at the end
+    with pytest.raises(sqlite3.ProgrammingError):
+        mirror.get_dataset_details(1, 'v1')
+
+
+def test_mirror_reads_unchanged_objects(tmp_path):
+    write_dbt_project(tmp_path, n_models=50)
+
+    with FakeSuperset(n_dashboards=50, n_datasets=50, max_page_size=10) as fake:
+        exposures_expected = pull(fake, tmp_path, mirror=True)
+        requests_first = fake.count_requests()
+
+        fake.requests.clear()
+        exposures = pull(fake, tmp_path, mirror=True)
+        requests_second = fake.count_requests()
+
+        # push twice, the second run reads back the details of datasets updated by the first
+        push(fake, tmp_path, mirror=True)
+        push(fake, tmp_path, mirror=True)
+        fake.requests.clear()
+        push(fake, tmp_path, mirror=True)
+        requests_push = fake.count_requests()
+
+    assert exposures == exposures_expected
+
+    # unchanged dashboards come from the mirror without requesting their details
+    assert requests_first['GET /dashboard/{id}'] > 0
+    assert requests_second['GET /dashboard/{id}'] == 0
+    assert requests_second['GET /dashboard/{id}/datasets'] == 0
+
+    # datasets unchanged since the last run come from the mirror without requesting their details
+    assert requests_push['GET /dataset/{id}'] == 0
+    assert requests_push['PUT /dataset/{id}'] == 0
@@ -0,0 +1,28 @@
+from .support.commands import pull, push, sync
+from .support.fake_superset import FakeSuperset
+from .support.manifest_generator import write_dbt_project
+
+
+def test_sync_shares_client_and_datasets(tmp_path):
+    write_dbt_project(tmp_path, n_models=50)
+
+    with FakeSuperset(n_dashboards=50, n_datasets=50, max_page_size=10) as fake:
+        exposures_expected = pull(fake, tmp_path, incremental=True, full_refresh=True)
+        push(fake, tmp_path)
+        requests_expected = fake.count_requests()
+        datasets_expected = fake.datasets
+
+    with FakeSuperset(n_dashboards=50, n_datasets=50, max_page_size=10) as fake:
+        exposures = sync(fake, tmp_path, incremental=True, full_refresh=True)
+        requests = fake.count_requests()
+
+    assert [{**e, 'url': None} for e in exposures] == [{**e, 'url': None} for e in exposures_expected]
+    assert ({i: {**d, 'changed_on_utc': None} for i, d in fake.datasets.items()}
+            == {i: {**d, 'changed_on_utc': None} for i, d in datasets_expected.items()})
+
+    # one token and a single listing of datasets instead of a listing by each command
+    assert requests['POST /security/refresh'] == 1
+    assert requests_expected['POST /security/refresh'] == 2
+    assert requests['GET /dataset/'] == 5
+    assert requests_expected['GET /dataset/'] == 5 + 4  # all datasets for changes, physical ones to push
+    assert requests.total() == requests_expected.total() - 5